@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ShareIt.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once get_asgi_application() has set Django up
+from forum import push  # noqa: E402
+
+application = push.application(django_application)
@@ -49,6 +49,10 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'forum.middleware.TracingMiddleware',
+    'forum.middleware.MetricsMiddleware',
+    'forum.middleware.PerformanceMiddleware',
+    'forum.middleware.QueryInspectionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'forum.context_processors.notification_menu',
             ],
         },
     },
@@ -96,6 +101,30 @@ DATABASES = {
     }
 }
 
+# Cache
+# each process keeps up to MAX_ENTRIES recent entries in memory in front of
+# a file cache every process on the host shares; filling it costs no
+# queries, which matters for the template fragments
+CACHES = {
+    'default': {
+        'BACKEND': 'forum.cache.TieredCache',
+        'LOCATION': 'shareit',
+        'OPTIONS': {'SHARED': 'shared', 'MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 60},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
+# Tests
+# forum.testing.TestRunner keeps the shared cache tier in memory and the
+# log, metrics and push files in a temporary directory during a run
+TEST_RUNNER = 'forum.testing.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -150,6 +179,76 @@ MEDIA_ROOT = BASE_DIR / 'ShareIt' / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Home feed
+# posts are copied into each member's feed unless the group has more
+# approved members than this, in which case they are read at request time
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL_SIZE = 50
+
+# Events
+# accepted invites are added to the Google calendar in token.json; load
+# tests turn this off so they don't write to a real calendar
+CALENDAR_SYNC = True
+
+# Performance
+# share of requests profiled by forum.middleware.PerformanceMiddleware, all
+# of them only under DEBUG, and how many recent profiles per URL name the
+# staff-only /perf stats cover
+PERF_SAMPLE_RATE = 1.0 if DEBUG else 0.1
+PERF_WINDOW = 500
+
+# Query inspection
+# forum.middleware.QueryInspectionMiddleware logs queries slower than
+# SLOW_QUERY_MS and SQL run QUERY_REPEAT_LIMIT or more times in one request
+# to QUERY_FINDINGS_LOG, in a QUERY_INSPECTION_SAMPLE_RATE share of requests
+# (all of them under DEBUG); `manage.py query_report` summarizes the log
+QUERY_INSPECTION_SAMPLE_RATE = 1.0 if DEBUG else 0.1
+SLOW_QUERY_MS = 100
+QUERY_REPEAT_LIMIT = 5
+QUERY_FINDINGS_LOG = BASE_DIR / 'logs' / 'query_findings.jsonl'
+
+# Metrics
+# each process writes its samples to METRICS_DIR at most every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds them up; the endpoint
+# answers staff users and the addresses in METRICS_ALLOWED_IPS
+METRICS_DIR = BASE_DIR / 'logs' / 'metrics'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Tracing
+# forum.middleware.TracingMiddleware traces a TRACE_SAMPLE_RATE share of
+# requests through the views of TRACED_APPS, queries, templates,
+# notifications, email and calendar sync, appending OTLP/JSON to TRACE_LOG
+TRACE_SAMPLE_RATE = 0.1
+TRACE_LOG = BASE_DIR / 'logs' / 'traces.jsonl'
+TRACE_SERVICE_NAME = 'shareit'
+TRACED_APPS = ['forum', 'polls', 'event', 'accounts']
+
+# Push
+# ShareIt.asgi serves PUSH_PATH itself, streaming new notifications and
+# unread counts as Server-Sent Events with a keepalive every PUSH_KEEPALIVE
+# seconds. PUSH_BACKEND carries messages between processes:
+# forum.push.LocalBackend for a single ASGI process, forum.push.SQLiteBackend
+# through the SQLite file PUSH_DATABASE for the processes of one host
+PUSH_PATH = '/notifications/stream/'
+PUSH_BACKEND = 'forum.push.SQLiteBackend'
+PUSH_DATABASE = BASE_DIR / 'logs' / 'push.sqlite3'
+PUSH_POLL_INTERVAL = 0.5
+PUSH_RETENTION = 300
+PUSH_KEEPALIVE = 15
+
+# Notification fan-out
+# notifications to a whole group or its admins are written by forum.fanout
+# after the request, NOTIFICATION_FANOUT_CHUNK recipients per bulk insert,
+# on a background thread unless NOTIFICATION_FANOUT_IN_THREAD is off
+NOTIFICATION_FANOUT_CHUNK = 500
+NOTIFICATION_FANOUT_IN_THREAD = True
+
+# Notification coalescing
+# likes of one post, comment or reply merge into the author's unread
+# notification for it while its last like is younger than this many seconds
+NOTIFICATION_COALESCE_WINDOW = 60 * 60
+
 from django.contrib.messages import constants as messages
 
 MESSAGE_TAGS = {
@@ -158,6 +257,7 @@ MESSAGE_TAGS = {
 
 
 # SMTP configuration
+EMAIL_BACKEND = 'forum.mail.EmailBackend'
 EMAIL_HOST = "smtp.mailtrap.io"
 EMAIL_PORT = 587
 EMAIL_HOST_USER = "daf32b31bf6726"
@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 18:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_notifications(apps, schema_editor):
+    Account = apps.get_model('accounts', 'Account')
+    Notification = apps.get_model('notifications', 'Notification')
+    unread = Notification.objects.filter(recipient_id=OuterRef('pk'), unread=True)
+    Account.objects.update(unread_notifications=Coalesce(Subquery(
+        unread.order_by().values('recipient_id').annotate(n=Count('pk')).values('n')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_remove_userprofile_is_suspended_account_is_suspended'),
+        ('notifications', '0008_index_together_recipient_unread'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unread_notifications, migrations.RunPython.noop),
+    ]
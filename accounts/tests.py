@@ -1,3 +1,94 @@
+from django.contrib.auth.tokens import default_token_generator
 from django.test import TestCase
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 
-# Create your tests here.
+from forum.testing import QueryBudgetMixin, QueryPlanMixin, ViewRequest, create_sample_group
+
+
+class AccountsQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+        cls.owner = cls.sample['owner']
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_dashboard(self):
+        self.assertNoFullScans(reverse('accounts:dashboard'))
+
+    def test_profile(self):
+        self.assertNoFullScans(reverse('accounts:profile_view', args=[self.owner.id]))
+
+    def test_login(self):
+        self.client.logout()
+        self.assertNoFullScans(
+            reverse('accounts:login'),
+            method='post',
+            data={'email': self.owner.email, 'password': 'password'}
+        )
+
+    def test_forgot_password(self):
+        self.client.logout()
+        self.assertNoFullScans(
+            reverse('accounts:forgotPassword'),
+            method='post',
+            data={'email': self.owner.email}
+        )
+
+
+class AccountsQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'accounts.urls'
+    budgets = {
+        'register': (0, 300),
+        'login': (0, 300),
+        'logout': (4, 200),
+        'dashboard': (5, 300),
+        'edit_profile': (5, 200),
+        'profile_view': (5, 300),
+        'activate': (2, 200),
+        'forgotPassword': (2, 200),
+        'resetpassword_validate': (5, 200),
+        'resetPassword': (3, 300),
+        'change_password': (3, 200),
+    }
+
+    def view_requests(self, sample):
+        owner = sample['owner']
+        # the token covers last_login, which logging the owner in changes
+        pending = sample['pending']
+        uid = urlsafe_base64_encode(force_bytes(pending.pk))
+        token = default_token_generator.make_token(pending)
+        return [
+            ViewRequest('register', reverse('accounts:register')),
+            ViewRequest('login', reverse('accounts:login')),
+            ViewRequest('dashboard', reverse('accounts:dashboard')),
+            ViewRequest(
+                'edit_profile', reverse('accounts:edit_profile'),
+                method='post', data={'username': owner.username, 'email': owner.email}
+            ),
+            ViewRequest('profile_view', reverse('accounts:profile_view', args=[owner.id])),
+            ViewRequest('activate', reverse('accounts:activate', args=[uid, token])),
+            ViewRequest(
+                'forgotPassword', reverse('accounts:forgotPassword'),
+                method='post', data={'email': owner.email}
+            ),
+            ViewRequest(
+                'resetpassword_validate',
+                reverse('accounts:resetpassword_validate', args=[uid, token])
+            ),
+            ViewRequest('resetPassword', reverse('accounts:resetPassword')),
+            ViewRequest(
+                'change_password', reverse('accounts:change_password'),
+                method='post',
+                data={
+                    'current_password': 'password',
+                    'new_password': 'changed',
+                    'confirm_password': 'mistyped',
+                }
+            ),
+            ViewRequest('logout', reverse('accounts:logout')),
+        ]
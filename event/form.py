@@ -23,14 +23,13 @@ class EventCreation(forms.ModelForm):
         fields = ['name', 'location', 'Cover_image', 'description', 'start_date_time', 'end_date_time', ]
 
     def clean(self):
-        print(self.cleaned_data)
         start_date_time = self.cleaned_data.get('start_date_time')
         end_date_time = self.cleaned_data.get('end_date_time')
         if start_date_time < timezone.now():
             raise ValidationError('Invalid event start date')
         elif end_date_time <= start_date_time:
             raise ValidationError('Invalid event end date')
-        return start_date_time, end_date_time
+        return self.cleaned_data
 
     # def clean_end_date_time(self):
     #     if end_date_time <= self.clean_start_date_time():
@@ -0,0 +1,39 @@
+# Generated by Django 4.1 on 2026-10-18 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forum', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Event name')),
+                ('slug', models.SlugField(blank=True, max_length=150, null=True, unique=True)),
+                ('description', models.TextField()),
+                ('location', models.CharField(max_length=300, verbose_name='Event Location')),
+                ('start_date_time', models.DateTimeField()),
+                ('end_date_time', models.DateTimeField()),
+                ('Cover_image', models.ImageField(default='img/cover_bg.jfif', upload_to='upload/event/')),
+                ('confirmed_invitees', models.ManyToManyField(related_name='confirmed_event', to=settings.AUTH_USER_MODEL)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='forum.group')),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('rejected_invitees', models.ManyToManyField(related_name='rejected_event', to=settings.AUTH_USER_MODEL)),
+                ('unconfirmed_invitees', models.ManyToManyField(related_name='tentative_event', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-end_date_time',),
+            },
+        ),
+    ]
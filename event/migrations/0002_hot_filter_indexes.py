@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['group', 'start_date_time'], name='event_group_start_idx'),
+        ),
+    ]
@@ -28,6 +28,9 @@ class Event(models.Model):
 
     class Meta:
         ordering = ('-end_date_time',)
+        indexes = [
+            models.Index(fields=['group', 'start_date_time'], name='event_group_start_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -1,3 +1,110 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from notifications.models import Notification
+
+from accounts.models import Account
+from forum.models import NotificationFanout
+from forum.testing import QueryBudgetMixin, QueryPlanMixin, ViewRequest, create_sample_group
+
+from .models import Event
+
+
+class EventQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+        cls.group = cls.sample['group']
+        cls.event = cls.sample['event']
+
+    def setUp(self):
+        self.client.force_login(self.sample['owner'])
+
+    def test_event_list(self):
+        self.assertNoFullScans(reverse('forum:event:event-list', args=[self.group.slug]))
+
+    def test_event_list_as_member(self):
+        self.client.force_login(self.sample['members'][0])
+        self.assertNoFullScans(reverse('forum:event:event-list', args=[self.group.slug]))
+
+    def test_create_event(self):
+        self.assertNoFullScans(reverse('forum:event:create-event', args=[self.group.slug]))
+
+    def test_event_detail(self):
+        self.assertNoFullScans(reverse('forum:event:event-detail', args=[self.group.slug, self.event.id]))
+
+    def test_event_edit(self):
+        self.assertNoFullScans(reverse('forum:event:event-edit', args=[self.group.slug, self.event.id]))
+
+    def test_calendar(self):
+        self.assertNoFullScans(reverse('forum:event:calendar', args=[self.group.slug]))
+
+
+class EventQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'event.urls'
+    budgets = {
+        'event-list': (7, 300),
+        'create-event': (4, 300),
+        'event-edit': (5, 300),
+        'event-detail': (12, 300),
+        'calendar': (5, 300),
+        'event-invite': (7, 200),
+    }
+
+    def view_requests(self, sample):
+        slug = sample['group'].slug
+        event = sample['event']
+        return [
+            ViewRequest('event-list', reverse('forum:event:event-list', args=[slug])),
+            ViewRequest('create-event', reverse('forum:event:create-event', args=[slug])),
+            ViewRequest('event-edit', reverse('forum:event:event-edit', args=[slug, event.id])),
+            ViewRequest('event-detail', reverse('forum:event:event-detail', args=[slug, event.id])),
+            ViewRequest('calendar', reverse('forum:event:calendar', args=[slug])),
+            ViewRequest(
+                'event-invite',
+                reverse('forum:event:event-invite', args=[slug, event.id, 'tentative']),
+                method='post', data={'next_url': '/'}
+            ),
+        ]
+
+
+@override_settings(NOTIFICATION_FANOUT_IN_THREAD=False, NOTIFICATION_FANOUT_CHUNK=10)
+class EventInviteTests(TestCase):
+
+    def create_event(self, sample):
+        self.client.force_login(sample['owner'])
+        start = timezone.now() + timedelta(days=3)
+        with CaptureQueriesContext(connection) as request:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('forum:event:create-event', args=[sample['group'].slug]),
+                    data={
+                        'name': 'Launch', 'location': 'online', 'description': 'an event',
+                        'start_date_time': start.strftime('%Y-%m-%d %H:%M'),
+                        'end_date_time': (start + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M'),
+                    }
+                )
+        self.assertEqual(response.status_code, 302)
+        return request
+
+    def test_invites_are_written_after_the_response(self):
+        sample = create_sample_group(members=25)
+        request = self.create_event(sample)
+        event = Event.objects.get(name='Launch')
+        fanout = NotificationFanout.objects.get(group=sample['group'])
+        # 25 members and the pending one, in three chunks
+        self.assertEqual((fanout.status, fanout.sent, fanout.total), (NotificationFanout.DONE, 26, 26))
+        invites = Notification.objects.filter(description='event invite')
+        self.assertEqual(invites.count(), 26)
+        self.assertEqual(invites.first().action_object, event)
+        self.assertFalse(invites.filter(recipient=sample['owner']).exists())
+        self.assertEqual(Account.objects.get(id=sample['members'][0].id).unread_notifications, 1)
+        # the fan-out ran after the response, in bulk inserts of ten
+        inserts = [query for query in request if query['sql'].startswith('INSERT INTO "notifications_notification"')]
+        self.assertEqual(len(inserts), 3)
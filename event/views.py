@@ -1,16 +1,16 @@
 from datetime import datetime
 
 from django.http import HttpResponseRedirect
-from notifications.signals import notify
 
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, reverse, get_object_or_404
 from django.views.generic.edit import CreateView,FormView, View
 from django.views.generic import UpdateView, ListView, DetailView
 from django.utils import timezone
 
-from accounts.models import Account
-from forum.models import Group
+from forum import fanout
+from forum.models import NotificationFanout
 from forum.views import GroupMixin
 
 from .calendar_api import sync_event
@@ -24,28 +24,22 @@ class CreateEventView(GroupMixin, LoginRequiredMixin, FormView):
     form_class = EventCreation
 
     def form_valid(self, form):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
+        group = self.group
         form.instance.host = self.request.user
         form.instance.group = group
         form.instance.slug = form.instance.name
         form.save()
 
         content = f"You are invited to join {form.instance.name}"
-        group_members = group.member.filter(is_suspended=False).exclude(
-            user_id=self.request.user.id
+        invites = fanout.send(
+            self.request.user,
+            group,
+            NotificationFanout.MEMBERS,
+            verb=content,
+            action_object=form.instance,
+            description='event invite',
         )
-        members = Account.objects.filter(
-            group_membership__in=group_members
-        )
-        sender = self.request.user
-
-        notify.send(sender=sender,
-                    recipient=members,
-                    verb=content,
-                    action_object=form.instance,
-                    description='event invite',
-
-                    )
+        messages.info(self.request, f"Sending the invite to {invites.total} members")
         return super().form_valid(form)
 
     def get_success_url(self) -> str:
@@ -73,11 +67,9 @@ class EventListView(GroupMixin, LoginRequiredMixin, ListView):
     model = Event
     template_name = 'event/event_list.html'
     paginate_by = 5
-    records = {}
 
     def get(self, request, **kwargs):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        if request.user not in group.admin.all():
+        if not self.access.is_admin:
             # event = group.event_set.all()
             # context = super(EventListView, self).get()
             # context['event'] = event
@@ -88,29 +80,27 @@ class EventListView(GroupMixin, LoginRequiredMixin, ListView):
         return super().get(request, **kwargs)
 
     def get_queryset(self):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        self.records['group'] = group
-        if self.request.user not in group.admin.all():
+        if not self.access.is_admin:
             return Event.objects.filter(
                 confirmed_invitees=self.request.user
             )
         return Event.objects.filter(
-            group=group
-        )
+            group=self.group
+        ).select_related('group', 'host')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # group = Group.objects.filter(slug=self.kwargs['slug']).first()
         context['upcoming_events'] = Event.objects.filter(
-            group=self.records['group'],
+            group=self.group,
             start_date_time__gt=datetime.now()
         )
         context['past_events'] = Event.objects.filter(
-            group=self.records['group'],
+            group=self.group,
             end_date_time__lt=datetime.now()
         )
         context['ongoing_events'] = Event.objects.filter(
-            group=self.records['group'],
+            group=self.group,
             start_date_time=timezone.now()
         )
         return context
@@ -122,21 +112,18 @@ class EventDetailView(GroupMixin, LoginRequiredMixin, DetailView):
 
     def get_context_data(self, *args, **kwargs):
         context = super(EventDetailView, self).get_context_data()
-        context['confirmed_invitees']=self.get_object().confirmed_invitees
-        context['unconfirmed_invitees'] = self.get_object().unconfirmed_invitees
-        context['invitees'] = self.get_object().group.member.all()
+        context['confirmed_invitees'] = self.object.confirmed_invitees
+        context['unconfirmed_invitees'] = self.object.unconfirmed_invitees
+        context['invitees'] = self.group.member.all()
         return context
 
 
-class EventOnCalendar(View):
+class EventOnCalendar(GroupMixin, LoginRequiredMixin, ListView):
+    template_name = 'calendar/calendar.html'
+    context_object_name = 'events'
 
-    def get(self, request, *args, **kwargs):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        events = group.event_set.all()
-        context = {
-            'events': events
-        }
-        return render(request, 'calendar/calendar.html', context)
+    def get_queryset(self):
+        return self.group.event_set.all()
 
 
 class AcceptInviteView(GroupMixin, LoginRequiredMixin, View):
@@ -150,10 +137,8 @@ class AcceptInviteView(GroupMixin, LoginRequiredMixin, View):
             sync_event(event)
         elif 'reject' in request.get_full_path():
             event.rejected_invitees.add(request.user)
-            event.save()
         elif 'tentative' in request.get_full_path():
             event.unconfirmed_invitees.add(request.user)
-        event.save()
 
         next_url = request.POST.get('next_url', '')
         return HttpResponseRedirect(
@@ -0,0 +1,71 @@
+from django.db.models import F, FilteredRelation, Q
+from django.http import Http404
+
+from .models import Group, Membership
+
+
+class GroupAccess:
+    """
+    What the current user is in a group: their Membership row (if any) and
+    the role it gives them. Resolved once per request, see resolve_group_access.
+    """
+
+    def __init__(self, group, membership):
+        self.group = group
+        self.membership = membership
+
+    @property
+    def is_member(self):
+        return self.membership is not None and self.membership.is_approved
+
+    @property
+    def is_pending(self):
+        return self.membership is not None and not self.membership.is_approved
+
+    @property
+    def is_suspended(self):
+        return self.membership is not None and self.membership.is_suspended
+
+    @property
+    def is_admin(self):
+        return self.is_member and self.membership.is_admin
+
+    @property
+    def is_owner(self):
+        return self.is_member and self.membership.role == Membership.OWNER
+
+
+def resolve_group_access(request, slug):
+    """
+    Loads the group joined to the viewer's membership row in a single query
+    and caches the result on the request for the views and templates that
+    ask again.
+    """
+    cache = request.__dict__.setdefault('_group_access', {})
+    if slug in cache:
+        return cache[slug]
+
+    user_id = request.user.id
+    group = Group.objects.filter(slug=slug).select_related('owner').annotate(
+        viewer=FilteredRelation('member', condition=Q(member__user_id=user_id)),
+        viewer_membership_id=F('viewer__id'),
+        viewer_is_approved=F('viewer__is_approved'),
+        viewer_is_suspended=F('viewer__is_suspended'),
+        viewer_role=F('viewer__role'),
+    ).first()
+    if group is None:
+        raise Http404("No such group exist")
+
+    viewer_membership = None
+    if group.viewer_membership_id is not None:
+        viewer_membership = Membership(
+            id=group.viewer_membership_id,
+            group=group,
+            user_id=user_id,
+            is_approved=group.viewer_is_approved,
+            is_suspended=group.viewer_is_suspended,
+            role=group.viewer_role
+        )
+    access = GroupAccess(group, viewer_membership)
+    cache[slug] = access
+    return access
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ForumConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'forum'
+
+    def ready(self):
+        # connects the search index, metrics, cache version, unread counter
+        # and push signal handlers
+        from . import cache, inbox, metrics, push, search  # noqa: F401
+        from . import perf, tracing
+        perf.install()
+        tracing.install()
@@ -0,0 +1,215 @@
+"""
+Application cache. TieredCache keeps a small LRU of recent entries in each
+process in front of a cache shared by all processes. Entries about a group
+are namespaced by the group's cache_version; any post, membership, poll or
+event write in the group sets a new one in the same transaction, so every
+entry cached for the old version becomes unreachable at once instead of
+being deleted key by key. Posts have a cache_version of their own that
+their comments and replies move on the same way.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from event.models import Event
+from polls.models import Choice, Poll, Vote
+
+from .models import Comment, Group, Membership, Post, Reply
+
+
+# one local tier per process and cache alias, shared by the per-thread
+# backend instances Django creates
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, timeout):
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Reads from the process's LRU first and falls back to the SHARED cache
+    alias, copying what it finds into the LRU for at most LOCAL_TIMEOUT
+    seconds. Writes go to both. LOCAL_TIMEOUT bounds how long another
+    process's overwrite of a key can go unseen; versioned keys never change
+    once written, so it doesn't matter for them.
+
+        'default': {
+            'BACKEND': 'forum.cache.TieredCache',
+            'LOCATION': 'shareit',
+            'OPTIONS': {'SHARED': 'shared', 'MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 60},
+        }
+    """
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        self.shared_alias = options.pop('SHARED')
+        self.local_timeout = options.pop('LOCAL_TIMEOUT', 60)
+        max_entries = options.pop('MAX_ENTRIES', 1000)
+        super().__init__(dict(params, OPTIONS=options))
+        with _local_tiers_lock:
+            self.local = _local_tiers.setdefault(location, LocalTier(max_entries))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def local_timeout_for(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return max(min(timeout - time.time(), self.local_timeout), 0)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.local.set(self.make_and_validate_key(key, version), value, self.local_timeout_for(timeout))
+        return added
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version)
+        entry = self.local.get(local_key)
+        if entry is not None:
+            return entry[0]
+        missing = object()
+        value = self.shared.get(key, missing, version)
+        if value is missing:
+            return default
+        # the shared tier doesn't say when the entry expires; LOCAL_TIMEOUT caps it
+        self.local.set(local_key, value, self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.local.set(self.make_and_validate_key(key, version), value, self.local_timeout_for(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version))
+        return self.shared.delete(key, version)
+
+    def has_key(self, key, version=None):
+        if self.local.get(self.make_and_validate_key(key, version)) is not None:
+            return True
+        return self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version))
+        return self.shared.incr(key, delta, version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+
+def group_key(group, *parts):
+    """
+    Returns a cache key for something about group, valid until the next
+    write in the group moves its cache_version on.
+    """
+    return ':'.join(['group', str(group.id), f'v{group.cache_version}', *map(str, parts)])
+
+
+def cached_for_group(group, name, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    Returns compute() from the cache, keyed by name and the group's current
+    version, computing and caching it on a miss.
+    """
+    key = group_key(group, name)
+    missing = object()
+    value = cache.get(key, missing)
+    if value is missing:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+# Post and Membership writes move the version on in move_summary,
+# with the UPDATE that already runs for them
+
+@receiver(post_save, sender=Group)
+def bump_group(sender, instance, created, **kwargs):
+    if not created:
+        Group.objects.filter(id=instance.id).bump_cache_version()
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def bump_group_of(sender, instance, **kwargs):
+    Group.objects.filter(id=instance.group_id).bump_cache_version()
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def bump_poll_group(sender, instance, **kwargs):
+    Group.objects.filter(polls__id=instance.poll_id).bump_cache_version()
+
+
+@receiver(m2m_changed, sender=Event.confirmed_invitees.through)
+@receiver(m2m_changed, sender=Event.rejected_invitees.through)
+@receiver(m2m_changed, sender=Event.unconfirmed_invitees.through)
+def bump_invitee_group(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_') and not reverse:
+        Group.objects.filter(id=instance.group_id).bump_cache_version()
+
+
+def _bump_posts(posts):
+    posts.update(cache_version=time.time_ns())
+
+
+# a post's own saves move its version on in bump_post_version
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_post(sender, instance, **kwargs):
+    _bump_posts(Post.objects.filter(id=instance.post_id))
+
+
+@receiver(post_save, sender=Reply)
+@receiver(post_delete, sender=Reply)
+def bump_reply_post(sender, instance, **kwargs):
+    _bump_posts(Post.objects.filter(comments__id=instance.comment_id))
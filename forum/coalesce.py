@@ -0,0 +1,61 @@
+"""
+Like notifications merged per liked object. A like on a post, comment or
+reply whose author still has an unread like notification for it, with
+the last like less than NOTIFICATION_COALESCE_WINDOW seconds old, updates
+that notification ("Ada and 41 others liked your post") instead of adding
+a row. Each person counts once however often they toggle; unlikes are
+not notified.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.signals import notify
+
+
+LIKE = 'like'
+
+
+def like_verb(likers, noun):
+    if likers == 1:
+        return f"liked your {noun}"
+    others = likers - 1
+    return f"and {others} {'other' if others == 1 else 'others'} liked your {noun}"
+
+
+def notify_liked(actor, instance, noun):
+    """
+    Notifies the author of instance that actor liked it, merging into the
+    open notification for instance if there is one.
+    """
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        aggregate = Notification.objects.select_for_update().unread().filter(
+            recipient_id=instance.author_id,
+            description=LIKE,
+            action_object_content_type=ContentType.objects.get_for_model(instance),
+            action_object_object_id=str(instance.pk),
+            timestamp__gte=now - timedelta(seconds=settings.NOTIFICATION_COALESCE_WINDOW),
+        ).order_by('-timestamp').first()
+        if aggregate is None:
+            [notification] = notify.send(
+                actor, recipient=instance.author, verb=like_verb(1, noun), action_object=instance,
+                description=LIKE, timestamp=now,
+            )[0][1]
+            return notification
+        # the people who liked, so liking again after an unlike doesn't
+        # count anyone twice; the first like only has its actor
+        liker_ids = (aggregate.data or {}).get('liker_ids') or [int(aggregate.actor_object_id)]
+        if actor.pk in liker_ids:
+            return aggregate
+        liker_ids.append(actor.pk)
+        aggregate.actor = actor
+        aggregate.verb = like_verb(len(liker_ids), noun)
+        aggregate.data = {'liker_ids': liker_ids}
+        aggregate.timestamp = now
+        aggregate.save(update_fields=['actor_content_type', 'actor_object_id', 'verb', 'data', 'timestamp'])
+        return aggregate
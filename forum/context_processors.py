@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from .inbox import unread_count
+from .loaders import load_unread_notifications
+
+
+class NotificationMenu:
+    """
+    The unread count and newest unread notifications of the header
+    dropdown, loaded the first time a template reads them. Pages that
+    don't show them don't even load the user.
+    """
+    size = 4
+    stream_url = settings.PUSH_PATH
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def unread_count(self):
+        return unread_count(self.user)
+
+    @cached_property
+    def items(self):
+        if not self.user.is_authenticated:
+            return []
+        return load_unread_notifications(self.user, self.size)
+
+
+def notification_menu(request):
+    if not hasattr(request, 'user'):
+        return {}
+    return {'notification_menu': NotificationMenu(request.user)}
@@ -0,0 +1,124 @@
+"""
+Notifications to a whole group, or to its admins, written after the
+request that sends them. send() records a NotificationFanout and returns
+at once; once the request's transaction commits the fan-out runs on a
+background thread, or inline when NOTIFICATION_FANOUT_IN_THREAD is off.
+Recipients are written NOTIFICATION_FANOUT_CHUNK at a time, each chunk a
+bulk insert in a transaction of its own that also records the progress,
+so a fan-out stopped halfway resumes after its last chunk.
+`manage.py run_fanouts` runs the ones a restart left behind.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from notifications.models import Notification
+
+from .inbox import notifications_created
+from .models import NotificationFanout
+
+
+logger = logging.getLogger('forum.fanout')
+
+# one fan-out at a time per process, so a burst of them can't take all
+# the database connections
+_executor = ThreadPoolExecutor(1, thread_name_prefix='fanout')
+
+
+def send(actor, group, audience, verb, action_object=None, description=None):
+    fanout = NotificationFanout(
+        group=group,
+        audience=audience,
+        actor=actor,
+        verb=verb,
+        action_object=action_object,
+        description=description,
+    )
+    fanout.total = fanout.recipient_ids().count()
+    fanout.save()
+    transaction.on_commit(lambda: start(fanout.id))
+    return fanout
+
+
+def start(fanout_id):
+    if settings.NOTIFICATION_FANOUT_IN_THREAD:
+        _executor.submit(_run_in_thread, fanout_id)
+    else:
+        run(fanout_id)
+
+
+def _run_in_thread(fanout_id):
+    try:
+        run(fanout_id)
+    except Exception:
+        logger.exception("Notification fan-out %s failed", fanout_id)
+    finally:
+        connections.close_all()
+
+
+def claim(fanout_id, statuses=(NotificationFanout.PENDING,)):
+    """
+    Marks the fan-out running if it is in one of statuses and returns
+    whether it did, so two runners never write the same fan-out.
+    """
+    return bool(NotificationFanout.objects.filter(id=fanout_id, status__in=statuses).update(
+        status=NotificationFanout.RUNNING, updated=timezone.now()
+    ))
+
+
+def run(fanout_id, statuses=(NotificationFanout.PENDING,)):
+    if not claim(fanout_id, statuses):
+        return
+    fanout = NotificationFanout.objects.select_related('actor').get(id=fanout_id)
+    try:
+        while write_chunk(fanout):
+            pass
+    except Exception as error:
+        NotificationFanout.objects.filter(id=fanout.id).update(
+            status=NotificationFanout.FAILED, error=repr(error), updated=timezone.now()
+        )
+        raise
+    NotificationFanout.objects.filter(id=fanout.id).update(
+        status=NotificationFanout.DONE, finished=timezone.now(), updated=timezone.now()
+    )
+    logger.info("Notification fan-out %s sent %s notifications", fanout.id, fanout.sent)
+
+
+def write_chunk(fanout):
+    """
+    Writes the notifications of the next chunk of recipients and returns
+    how many it wrote.
+    """
+    recipient_ids = list(
+        fanout.recipient_ids().filter(user_id__gt=fanout.cursor)[:settings.NOTIFICATION_FANOUT_CHUNK]
+    )
+    if not recipient_ids:
+        return 0
+    actor_type = ContentType.objects.get_for_model(fanout.actor)
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create([
+            Notification(
+                recipient_id=recipient_id,
+                actor_content_type=actor_type,
+                actor_object_id=str(fanout.actor_id),
+                verb=fanout.verb,
+                description=fanout.description,
+                action_object_content_type_id=fanout.action_object_content_type_id,
+                action_object_object_id=fanout.action_object_id,
+                # the time of the action, however long the fan-out takes
+                timestamp=fanout.created,
+            )
+            for recipient_id in recipient_ids
+        ])
+        notifications_created.send(sender=Notification, notifications=notifications)
+        NotificationFanout.objects.filter(id=fanout.id).update(
+            sent=F('sent') + len(recipient_ids), cursor=recipient_ids[-1], updated=timezone.now()
+        )
+    fanout.sent += len(recipient_ids)
+    fanout.cursor = recipient_ids[-1]
+    return len(recipient_ids)
@@ -0,0 +1,112 @@
+"""
+Rendered posts for the group stream. The HTML of a post with its comments
+and replies is cached per post version, group settings version and viewer
+role (admin, member or suspended), so votes and posts elsewhere in the
+group leave it cached. What still differs between viewers of one role,
+the like labels and the CSRF token, the like counts and the relative times
+are left in it as slots that are filled in on every request.
+"""
+import re
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.timesince import timesince
+
+from .loaders import load_viewer_likes, post_tree
+
+
+# comments can't forge a slot: the text they render has its "<" escaped
+SLOT = re.compile(r'<!--slot:(\w+)(?::([^>]*?))?-->')
+CSRF_SLOT = mark_safe('<!--slot:csrf-->')
+
+
+def like_slot(kind, pk):
+    return mark_safe(f'<!--slot:like:{kind}:{pk}-->')
+
+
+def liked_by_slot(pk):
+    return mark_safe(f'<!--slot:liked_by:{pk}-->')
+
+
+def since_slot(value):
+    return mark_safe(f'<!--slot:since:{value.timestamp()}-->')
+
+
+def post_key(post, group, role):
+    # the HTML has the group's slug in its links and controls that depend
+    # on the group's settings, which only the group's own saves change
+    return f'post:{post.pk}:v{post.cache_version}:g{group.pk}:s{group.settings_version}:{role}'
+
+
+def viewer_role(access):
+    if access.is_admin:
+        return 'admin'
+    if access.is_suspended:
+        return 'suspended'
+    return 'member'
+
+
+def render_post(post, group, access):
+    """
+    Renders a post with its comment tree prefetched, slots left open, and
+    returns it with the ids the like slots refer to.
+    """
+    comments = list(post.comments.all())
+    html = render_to_string('forum/includes/post.html', {
+        'post': post,
+        'group': group,
+        'group_access': access,
+        'user_suspended': access.is_suspended,
+        'csrf_token': CSRF_SLOT,
+    })
+    return {
+        'html': html,
+        'comments': [comment.pk for comment in comments],
+        'replies': [reply.pk for comment in comments for reply in comment.replies.all()],
+    }
+
+
+def render_posts(request, group, access, posts):
+    """
+    Returns the HTML of each of posts for the viewer of request. Only posts
+    changed since they were last cached have their comments loaded and are
+    rendered again.
+    """
+    role = viewer_role(access)
+    keys = {post.pk: post_key(post, group, role) for post in posts}
+    blocks = cache.get_many(keys.values())
+    stale = [post for post in posts if keys[post.pk] not in blocks]
+    if stale:
+        prefetch_related_objects(stale, post_tree())
+        rendered = {keys[post.pk]: render_post(post, group, access) for post in stale}
+        cache.set_many(rendered)
+        blocks.update(rendered)
+
+    blocks = [blocks[keys[post.pk]] for post in posts]
+    likes = load_viewer_likes(
+        request.user,
+        [post.pk for post in posts],
+        [pk for block in blocks for pk in block['comments']],
+        [pk for block in blocks for pk in block['replies']],
+    )
+    liked = {kind: {str(pk) for pk in ids} for kind, ids in likes._asdict().items()}
+    like_counts = {str(post.pk): post.like_count for post in posts}
+    csrf_token = get_token(request)
+
+    def fill(match):
+        name, argument = match.groups()
+        if name == 'csrf':
+            return csrf_token
+        if name == 'since':
+            return timesince(datetime.fromtimestamp(float(argument), timezone.utc))
+        if name == 'liked_by':
+            count = like_counts[argument]
+            return f"Liked by {count} {'persons' if count > 1 else 'person'}"
+        kind, pk = argument.split(':')
+        return 'Unlike' if pk in liked[kind] else 'Like'
+
+    return [mark_safe(SLOT.sub(fill, block['html'])) for block in blocks]
@@ -0,0 +1,93 @@
+"""
+Keeps Account.unread_notifications equal to the number of unread
+notifications of the account, so pages and the unread count endpoint read
+it off request.user instead of counting. Saving or deleting a notification
+moves the counter by one; marking all as read, which sends no signal,
+recounts it. Rows written with bulk_create send no signal either; whoever
+writes them sends notifications_created, which moves the counters in one
+UPDATE per chunk. Either way unread_changed is sent with the ids of the
+users whose counter moved.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import Signal, receiver
+
+from notifications.base.models import is_soft_delete
+from notifications.models import Notification
+
+from accounts.models import Account
+
+
+# sent with user_ids, the accounts whose counter may have moved
+unread_changed = Signal()
+# sent with notifications, unread rows just written by bulk_create
+notifications_created = Signal()
+
+
+def unread_count(user):
+    return user.unread_notifications if user.is_authenticated else 0
+
+
+def recount_unread(accounts):
+    """
+    Sets the counter of the selected accounts from their notifications in
+    one UPDATE.
+    """
+    unread = Notification.objects.filter(recipient_id=OuterRef('pk')).unread()
+    return accounts.update(unread_notifications=Coalesce(Subquery(
+        unread.order_by().values('recipient_id').annotate(n=Count('pk')).values('n')
+    ), 0))
+
+
+def mark_all_read(user):
+    user.notifications.mark_all_as_read()
+    recount_unread(Account.objects.filter(id=user.id))
+    unread_changed.send(sender=Account, user_ids=[user.id])
+
+
+def _is_unread(notification):
+    # what NotificationQuerySet.unread() selects
+    return notification.unread and not (is_soft_delete() and notification.deleted)
+
+
+def _move_counter(recipient_id, delta):
+    Account.objects.filter(id=recipient_id).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, 0)
+    )
+    unread_changed.send(sender=Account, user_ids=[recipient_id])
+
+
+@receiver(post_init, sender=Notification)
+def remember_unread(sender, instance, **kwargs):
+    instance._counted_unread = _is_unread(instance)
+
+
+@receiver(post_save, sender=Notification)
+def count_saved_notification(sender, instance, created, **kwargs):
+    was_unread = False if created else instance._counted_unread
+    is_unread = _is_unread(instance)
+    if is_unread != was_unread:
+        _move_counter(instance.recipient_id, 1 if is_unread else -1)
+    instance._counted_unread = is_unread
+
+
+@receiver(post_delete, sender=Notification)
+def count_deleted_notification(sender, instance, **kwargs):
+    if instance._counted_unread:
+        _move_counter(instance.recipient_id, -1)
+
+
+@receiver(notifications_created)
+def count_created_notifications(sender, notifications, **kwargs):
+    per_recipient = Counter(notification.recipient_id for notification in notifications)
+    by_count = {}
+    for recipient_id, count in per_recipient.items():
+        by_count.setdefault(count, []).append(recipient_id)
+    for count, recipient_ids in by_count.items():
+        Account.objects.filter(id__in=recipient_ids).update(
+            unread_notifications=F('unread_notifications') + count
+        )
+    unread_changed.send(sender=Account, user_ids=list(per_recipient))
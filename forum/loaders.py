@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+from django.db.models import Prefetch, prefetch_related_objects
+
+from event.models import Event
+
+from .models import Comment, Post, Reply
+
+
+ViewerLikes = namedtuple('ViewerLikes', ['posts', 'comments', 'replies'])
+
+
+def post_tree():
+    """
+    Prefetch of the visible comments and replies of posts, each with its
+    author, in one query per level instead of one per object.
+    """
+    replies = Reply.active_objects.select_related('author')
+    comments = Comment.active_objects.select_related('author').prefetch_related(
+        Prefetch('replies', queryset=replies),
+    )
+    return Prefetch('comments', queryset=comments)
+
+
+def _liked_ids(model, user, ids):
+    if not ids:
+        return set()
+    likes = model._meta.get_field('likes')
+    source = likes.m2m_field_name()
+    return set(likes.remote_field.through.objects.filter(
+        **{f'{source}__in': ids, likes.m2m_reverse_field_name(): user.id}
+    ).values_list(source, flat=True))
+
+
+def load_viewer_likes(user, post_ids, comment_ids, reply_ids):
+    """
+    Returns which of the given posts, comments and replies user has liked,
+    so a page can test `id in viewer_likes.posts` instead of scanning every
+    liker.
+    """
+    if not user.is_authenticated:
+        return ViewerLikes(set(), set(), set())
+    return ViewerLikes(
+        posts=_liked_ids(Post, user, post_ids),
+        comments=_liked_ids(Comment, user, comment_ids),
+        replies=_liked_ids(Reply, user, reply_ids),
+    )
+
+
+def load_unread_notifications(user, limit):
+    """
+    Returns the newest limit unread notifications of user with their actor,
+    action object and target loaded, one query per content type, and the
+    group of event action objects, so rendering them and their URLs runs no
+    queries.
+    """
+    notifications = list(
+        user.notifications.unread().prefetch_related('actor', 'action_object', 'target')[:limit]
+    )
+    events = [n.action_object for n in notifications if isinstance(n.action_object, Event)]
+    prefetch_related_objects(events, 'group')
+    return notifications
@@ -0,0 +1,24 @@
+from django.core.mail.backends import smtp
+
+from .metrics import emails, emails_in_flight
+
+
+class EmailBackend(smtp.EmailBackend):
+    """
+    The SMTP backend, counting the emails being sent and how each send
+    ended for /metrics.
+    """
+
+    def send_messages(self, email_messages):
+        count = len(email_messages or [])
+        emails_in_flight.inc(count)
+        try:
+            sent = super().send_messages(email_messages)
+        except Exception:
+            emails.inc(count, result='failed')
+            raise
+        finally:
+            emails_in_flight.dec(count)
+        emails.inc(sent or 0, result='sent')
+        emails.inc(count - (sent or 0), result='failed')
+        return sent
@@ -0,0 +1,414 @@
+import random
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from notifications.models import Notification
+
+from accounts.models import Account, UserProfile
+from event.models import Event
+from forum.coalesce import LIKE, like_verb
+from forum.inbox import recount_unread
+from forum.models import Comment, FeedEntry, Group, Membership, Post, Reply
+from forum.search import rebuild_index
+from polls.models import Choice, Poll, Vote
+
+
+CITIES = ['Lagos', 'Abuja', 'Ibadan', 'Kano', 'Enugu', 'Port Harcourt', 'Accra', 'Nairobi']
+WORDS = (
+    'group meeting project update idea question answer event photo trip music '
+    'book food match code design plan weekend school work news help thanks'
+).split()
+
+
+class BulkWriter:
+    """
+    Buffers rows per model and writes them with executemany. Going around
+    the ORM skips building a model instance and compiling an INSERT for
+    every row, which is most of the cost of bulk_create at this volume.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.tables = {}
+        self.rows = defaultdict(list)
+        self.counts = defaultdict(int)
+
+    def prepare(self, model, values):
+        columns = []
+        for field in model._meta.concrete_fields:
+            if field.primary_key and field.attname not in values:
+                continue
+            target = field.target_field if field.is_relation else field
+            # dates and uuids need the backend's representation, the rest go as is
+            if isinstance(target, (models.DateField, models.UUIDField)):
+                convert = field.get_db_prep_save
+            else:
+                convert = None
+            columns.append((field.attname, field.column, field.get_default(), convert))
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(column) for _, column, _, _ in columns),
+            ', '.join(['%s'] * len(columns))
+        )
+        self.tables[model] = (sql, columns)
+        return self.tables[model]
+
+    def add(self, model, **values):
+        sql, columns = self.tables.get(model) or self.prepare(model, values)
+        row = []
+        for attname, _, default, convert in columns:
+            value = values.get(attname, default)
+            row.append(convert(value, connection) if convert and value is not None else value)
+        rows = self.rows[model]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for pending in [model] if model else list(self.rows):
+            rows = self.rows.pop(pending, [])
+            if rows:
+                with connection.cursor() as cursor:
+                    cursor.executemany(self.tables[pending][0], rows)
+                self.counts[pending._meta.label] += len(rows)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a deterministic synthetic dataset of users, groups, posts, "
+        "polls, events and notifications with bulk inserts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=10000, help="Posts across all groups")
+        parser.add_argument('--comments', type=float, default=3, help="Mean comments per post")
+        parser.add_argument('--replies', type=float, default=1, help="Mean replies per comment")
+        parser.add_argument('--likes', type=float, default=5, help="Mean likes per post")
+        parser.add_argument('--polls', type=int, default=2, help="Polls per group")
+        parser.add_argument('--events', type=int, default=2, help="Events per group")
+        parser.add_argument('--private', type=float, default=0.3, help="Share of private groups")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--until', help="Date the generated activity ends on (default: today)")
+        parser.add_argument('--days', type=int, default=365, help="Days of activity before --until")
+        parser.add_argument('--prefix', default='synth', help="Prefix of generated usernames and group names")
+        parser.add_argument('--password', default='password', help="Password of every generated user")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.prefix = options['prefix']
+        if Account.objects.filter(username__startswith=f"{self.prefix}user").exists():
+            raise CommandError(
+                f"Users prefixed {self.prefix!r} already exist, use another --prefix or an empty database"
+            )
+        self.rng = random.Random(options['seed'])
+        until = parse_date(options['until']) if options['until'] else timezone.localdate()
+        self.end = timezone.make_aware(datetime.combine(until, time.max))
+        self.start = self.end - timedelta(days=options['days'])
+        self.writer = BulkWriter(options['batch_size'])
+        self.account_type = ContentType.objects.get_for_model(Account)
+        self.event_type = ContentType.objects.get_for_model(Event)
+        self.next_ids = {}
+
+        # rows are written without signals, so derived data is rebuilt at the end
+        with transaction.atomic():
+            users = self.create_users()
+            for group, members, posts in self.create_groups(users):
+                self.create_posts(group, members, posts)
+                self.create_polls(group, members)
+                self.create_events(group, members)
+            self.writer.flush()
+            Group.objects.filter(name__startswith=f"{self.prefix} group").refresh_summary()
+            recount_unread(Account.objects.filter(username__startswith=f"{self.prefix}user"))
+            rebuild_index()
+
+        for label, count in sorted(self.writer.counts.items()):
+            self.stdout.write(f"{label}: {count}")
+
+    def next_id(self, model):
+        # ids are assigned up front so related rows can be written before the insert
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(n=Max('pk'))['n'] or 0) + 1
+        pk = self.next_ids[model]
+        self.next_ids[model] += 1
+        return pk
+
+    def timestamp(self, after=None):
+        start = max(after, self.start) if after else self.start
+        span = max((self.end - start).total_seconds(), 1)
+        return start + timedelta(seconds=self.rng.random() * span)
+
+    def count(self, mean):
+        # exponential draws give the long tail real activity has
+        return int(self.rng.expovariate(1 / mean)) if mean > 0 else 0
+
+    def text(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words))
+
+    def notify(self, recipient_id, actor_id, verb, timestamp, **values):
+        self.writer.add(
+            Notification,
+            recipient_id=recipient_id,
+            actor_content_type_id=self.account_type.id,
+            actor_object_id=str(actor_id),
+            verb=verb,
+            timestamp=timestamp,
+            unread=self.rng.random() < 0.3,
+            **values
+        )
+
+    def create_users(self):
+        password = make_password(self.options['password'])
+        users = []
+        for i in range(self.options['users']):
+            user_id = self.next_id(Account)
+            username = f"{self.prefix}user{i:07d}"
+            joined = self.timestamp()
+            self.writer.add(
+                Account,
+                id=user_id,
+                username=username,
+                email=f"{username}@example.com",
+                password=password,
+                phone_number='',
+                is_active=True,
+                date_joined=joined,
+                last_login=joined,
+            )
+            self.writer.add(
+                UserProfile,
+                user_id=user_id,
+                current_city=self.rng.choice(CITIES),
+                highest_qualification=self.rng.choice(['PhD', 'MSc.', 'BSc.', 'HND.']),
+                gender=self.rng.choice(['M', 'F']),
+                bio=self.text(12),
+            )
+            users.append(user_id)
+        return users
+
+    def create_groups(self, users):
+        """
+        Spreads users over groups with Zipf-like popularity, so a few groups
+        hold most of the members and posts. Returns (group, approved member
+        ids, number of posts) for every group.
+        """
+        group_count = self.options['groups']
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(group_count)]
+        total = sum(weights)
+        joined = defaultdict(set)
+        for user_id in users:
+            for _ in range(min(1 + self.count(3), group_count)):
+                joined[self.rng.choices(range(group_count), weights)[0]].add(user_id)
+
+        groups = []
+        for index in range(group_count):
+            members = sorted(joined[index]) or [self.rng.choice(users)]
+            private = self.rng.random() < self.options['private']
+            name = f"{self.prefix} group {index}"
+            group = Group(
+                id=self.next_id(Group),
+                name=name,
+                slug=slugify(name),
+                description=self.text(20),
+                owner_id=members[0],
+                privacy='private' if private else 'public',
+                fanout_on_read=len(members) > settings.FEED_FANOUT_LIMIT,
+            )
+            self.writer.add(
+                Group,
+                id=group.id,
+                name=group.name,
+                slug=group.slug,
+                description=group.description,
+                owner_id=group.owner_id,
+                privacy=group.privacy,
+                fanout_on_read=group.fanout_on_read,
+            )
+
+            approved = []
+            admins = set(self.rng.sample(members[1:], min(2, len(members) - 1)))
+            for user_id in members:
+                is_approved = user_id == group.owner_id or not private or self.rng.random() > 0.1
+                if user_id == group.owner_id:
+                    role = Membership.OWNER
+                elif user_id in admins and is_approved:
+                    role = Membership.ADMIN
+                else:
+                    role = Membership.MEMBER
+                self.writer.add(
+                    Membership,
+                    group_id=group.id,
+                    user_id=user_id,
+                    is_approved=is_approved,
+                    is_suspended=role == Membership.MEMBER and self.rng.random() < 0.01,
+                    role=role,
+                )
+                if is_approved:
+                    approved.append(user_id)
+            groups.append((group, approved, round(self.options['posts'] * weights[index] / total)))
+        return groups
+
+    def likes(self, model, pk, timestamp, members, mean, noun, recipient_id):
+        likes = model._meta.get_field('likes')
+        source = f'{likes.m2m_field_name()}_id'
+        likers = self.rng.sample(members, min(self.count(mean), len(members)))
+        for user_id in likers:
+            self.writer.add(likes.remote_field.through, **{source: pk, 'account_id': user_id})
+        # one notification for all of them, as forum.coalesce merges them
+        notified = [user_id for user_id in likers if user_id != recipient_id]
+        if notified:
+            self.notify(
+                recipient_id, notified[-1], like_verb(len(notified), noun), self.timestamp(timestamp),
+                action_object_content_type_id=ContentType.objects.get_for_model(model).id,
+                action_object_object_id=str(pk),
+                description=LIKE,
+                data=Notification._meta.get_field('data').get_db_prep_save({'liker_ids': notified}, connection),
+            )
+        return len(likers)
+
+    def create_posts(self, group, members, count):
+        visible = []
+        for _ in range(count):
+            post_id = uuid.UUID(int=self.rng.getrandbits(128), version=4)
+            author_id = self.rng.choice(members)
+            content = self.text(30)
+            timestamp = self.timestamp()
+            is_hidden = self.rng.random() < 0.02
+            self.writer.add(
+                Post,
+                id=post_id,
+                title=self.text(4).capitalize() if self.rng.random() < 0.5 else None,
+                content=content,
+                author_id=author_id,
+                group_id=group.id,
+                timestamp=timestamp,
+                is_hidden=is_hidden,
+                like_count=self.likes(
+                    Post, post_id, timestamp, members, self.options['likes'], 'post', author_id
+                ),
+            )
+            if not is_hidden:
+                visible.append((timestamp, post_id))
+
+            for _ in range(self.count(self.options['comments'])):
+                comment_id = self.next_id(Comment)
+                comment_author_id = self.rng.choice(members)
+                comment_timestamp = self.timestamp(timestamp)
+                self.writer.add(
+                    Comment,
+                    id=comment_id,
+                    post_id=post_id,
+                    content=self.text(15),
+                    author_id=comment_author_id,
+                    timestamp=comment_timestamp,
+                    is_hidden=self.rng.random() < 0.02,
+                    like_count=self.likes(
+                        Comment, comment_id, comment_timestamp, members,
+                        self.options['likes'] / 2, 'comment', comment_author_id
+                    ),
+                )
+                self.notify(
+                    author_id, comment_author_id,
+                    f"commented on your post {content[0:10]}...", comment_timestamp
+                )
+
+                for _ in range(self.count(self.options['replies'])):
+                    reply_id = self.next_id(Reply)
+                    reply_author_id = self.rng.choice(members)
+                    reply_timestamp = self.timestamp(comment_timestamp)
+                    self.writer.add(
+                        Reply,
+                        id=reply_id,
+                        comment_id=comment_id,
+                        content=self.text(10),
+                        author_id=reply_author_id,
+                        timestamp=reply_timestamp,
+                        is_hidden=self.rng.random() < 0.02,
+                        like_count=self.likes(
+                            Reply, reply_id, reply_timestamp, members,
+                            self.options['likes'] / 4, 'reply', reply_author_id
+                        ),
+                    )
+
+        # what FeedEntry.objects.backfill would give each member
+        if not group.fanout_on_read:
+            visible.sort(reverse=True)
+            for timestamp, post_id in visible[:settings.FEED_BACKFILL_SIZE]:
+                for user_id in members:
+                    self.writer.add(
+                        FeedEntry, user_id=user_id, post_id=post_id, group_id=group.id, timestamp=timestamp
+                    )
+
+    def create_polls(self, group, members):
+        for _ in range(self.options['polls']):
+            poll_id = self.next_id(Poll)
+            created = self.timestamp()
+            start = created.date() + timedelta(days=self.rng.randint(0, 7))
+            self.writer.add(
+                Poll,
+                id=poll_id,
+                poll_text=f"{self.text(6).capitalize()}?",
+                poll_author_id=group.owner_id,
+                group_id=group.id,
+                created_date=created,
+                start_date=start,
+                end_date=start + timedelta(days=self.rng.randint(1, 30)),
+            )
+            choices = {self.next_id(Choice): 0 for _ in range(self.rng.randint(2, 4))}
+            voters = self.rng.sample(members, int(len(members) * self.rng.random()))
+            for user_id in voters:
+                choice_id = self.rng.choice(list(choices))
+                choices[choice_id] += 1
+                self.writer.add(Vote, voter_id=user_id, poll_id=poll_id, choice_id=choice_id)
+            for choice_id, votes in choices.items():
+                self.writer.add(Choice, id=choice_id, poll_id=poll_id, choice_text=self.text(2), votes=votes)
+
+    def create_events(self, group, members):
+        rsvps = (
+            (0.6, None),
+            (0.85, Event.confirmed_invitees.through),
+            (0.95, Event.unconfirmed_invitees.through),
+            (1, Event.rejected_invitees.through),
+        )
+        for _ in range(self.options['events']):
+            event_id = self.next_id(Event)
+            start = self.timestamp() + timedelta(days=self.rng.randint(0, 60))
+            name = f"{self.prefix} event {event_id}"
+            self.writer.add(
+                Event,
+                id=event_id,
+                group_id=group.id,
+                host_id=group.owner_id,
+                name=name,
+                slug=slugify(name),
+                description=self.text(25),
+                location=self.rng.choice(CITIES),
+                start_date_time=start,
+                end_date_time=start + timedelta(hours=self.rng.randint(1, 8)),
+            )
+            for user_id in members:
+                if user_id == group.owner_id:
+                    continue
+                self.notify(
+                    user_id, group.owner_id, f"You are invited to join {name}", start - timedelta(days=7),
+                    action_object_content_type_id=self.event_type.id,
+                    action_object_object_id=str(event_id),
+                    description='event invite',
+                )
+                answer = self.rng.random()
+                through = next(model for limit, model in rsvps if answer < limit)
+                if through:
+                    self.writer.add(through, event_id=event_id, account_id=user_id)
@@ -0,0 +1,414 @@
+import http.cookiejar
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+
+from accounts.models import Account
+from event.models import Event
+from forum.models import Membership, Post
+from polls.models import Poll
+
+
+SCENARIOS = ('feed', 'group', 'like', 'vote', 'accept')
+DEFAULT_WEIGHTS = 'feed=5,group=3,like=2,vote=1,accept=1'
+# recent posts per group a virtual user picks from when liking
+POSTS_PER_GROUP = 20
+
+
+class WSGIClient:
+    """
+    Calls the WSGI application in this process and keeps the cookies it
+    sets, like a browser would.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        path, _, query = path.partition('?')
+        body = urlencode(data or {}).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': 'loadtest',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'loadtest',
+            'HTTP_REFERER': 'http://loadtest/',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if 'csrftoken' in self.cookies:
+            environ['HTTP_X_CSRFTOKEN'] = self.cookies['csrftoken']
+
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split()[0]))
+            for name, value in headers:
+                if name.lower() == 'set-cookie':
+                    self.set_cookie(value)
+
+        response = self.application(environ, start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            # fires request_finished, which closes the database connection
+            response.close()
+        return statuses[0]
+
+    def set_cookie(self, header):
+        for name, morsel in SimpleCookie(header).items():
+            if morsel['max-age'] == '0' or not morsel.value:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+    def has_cookie(self, name):
+        return name in self.cookies
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # the redirect is part of the measured response, following it isn't
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """
+    Sends requests to a running server, e.g. runserver or gunicorn.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect
+        )
+
+    def request(self, method, path, data=None):
+        body = urlencode(data or {}).encode() if method == 'POST' else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        request.add_header('Referer', self.base_url + '/')
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                request.add_header('X-CSRFToken', cookie.value)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def has_cookie(self, name):
+        return any(cookie.name == name for cookie in self.cookies)
+
+
+def make_client(target):
+    if target:
+        return HTTPClient(target)
+    from ShareIt.wsgi import application
+    return WSGIClient(application)
+
+
+def parse_weights(value):
+    weights = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise CommandError(f"Unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Scenario {name!r} needs a numeric weight, e.g. {name}=2")
+    if not any(weights.values()):
+        raise CommandError("At least one scenario needs a positive weight")
+    return weights
+
+
+def load_plans(prefix, count):
+    """
+    Returns what each generated user can act on: the groups they are an
+    active member of, recent posts in them, open polls and upcoming events.
+    """
+    users = list(
+        Account.objects.filter(username__startswith=f'{prefix}user', is_active=True)
+        .order_by('username')
+        .values_list('id', 'email')[:count]
+    )
+    memberships = Membership.objects.filter(
+        user_id__in=[user_id for user_id, _ in users], is_approved=True, is_suspended=False
+    ).values_list('user_id', 'group_id', 'group__slug')
+    groups = defaultdict(list)
+    slugs = {}
+    for user_id, group_id, slug in memberships:
+        groups[user_id].append(group_id)
+        slugs[group_id] = slug
+
+    # the newest POSTS_PER_GROUP of every group, in one query
+    newest = Post.objects.filter(group_id=OuterRef('group_id')).order_by('-timestamp')
+    recent = Post.objects.filter(
+        group_id__in=slugs, id__in=Subquery(newest.values('id')[:POSTS_PER_GROUP])
+    ).order_by('group_id', '-timestamp').values_list('group_id', 'id')
+    posts = defaultdict(list)
+    for group_id, pk in recent:
+        posts[group_id].append(str(pk))
+
+    today = timezone.localdate()
+    polls = defaultdict(list)
+    open_polls = Poll.objects.filter(
+        group_id__in=slugs, start_date__lte=today, end_date__gte=today
+    ).prefetch_related('choice_set')
+    for poll in open_polls:
+        polls[poll.group_id].append((poll.id, [choice.id for choice in poll.choice_set.all()]))
+
+    events = defaultdict(list)
+    upcoming = Event.objects.filter(group_id__in=slugs, start_date_time__gte=timezone.now())
+    for event_id, group_id in upcoming.values_list('id', 'group_id'):
+        events[group_id].append(event_id)
+
+    plans = []
+    for user_id, email in users:
+        group_ids = groups[user_id]
+        plans.append({
+            'email': email,
+            'groups': [slugs[group_id] for group_id in group_ids],
+            'posts': [(slugs[group_id], pk) for group_id in group_ids for pk in posts[group_id]],
+            'polls': [
+                (slugs[group_id], poll_id, choices)
+                for group_id in group_ids for poll_id, choices in polls[group_id] if choices
+            ],
+            'events': [(slugs[group_id], event_id) for group_id in group_ids for event_id in events[group_id]],
+        })
+    return plans
+
+
+def next_request(scenario, plan, rng):
+    """
+    Returns the method, path and form data of one scenario for a user, or
+    their feed when they have nothing to act on for it.
+    """
+    if scenario == 'group' and plan['groups']:
+        return 'GET', reverse('forum:group-detail', args=[rng.choice(plan['groups'])]), None
+    if scenario == 'like' and plan['posts']:
+        slug, pk = rng.choice(plan['posts'])
+        return 'GET', reverse('forum:like-post', args=[slug, pk]), None
+    if scenario == 'vote' and plan['polls']:
+        slug, poll_id, choices = rng.choice(plan['polls'])
+        # the group slug appears twice in the vote URL, which reverse() can't fill
+        return 'POST', f'/group/{slug}/polls/{slug}/{poll_id}/vote/', {'choice': rng.choice(choices)}
+    if scenario == 'accept' and plan['events']:
+        slug, event_id = rng.choice(plan['events'])
+        path = reverse('forum:event:event-invite', args=[slug, event_id, 'accept'])
+        return 'POST', path, {'next_url': reverse('forum:home')}
+    return 'GET', reverse('forum:home'), None
+
+
+def url_name(path):
+    try:
+        return resolve(urlsplit(path).path).view_name
+    except Resolver404:
+        return path
+
+
+def login(client, email, password):
+    client.request('GET', reverse('accounts:login'))
+    client.request('POST', reverse('accounts:login'), {'email': email, 'password': password})
+    if not client.has_cookie(settings.SESSION_COOKIE_NAME):
+        raise CommandError(f"Could not log in as {email}")
+
+
+def run_worker(job):
+    """
+    Logs in as each of the worker's users and sends weighted scenarios
+    round-robin across them until the deadline. Returns one
+    (url name, milliseconds, status) tuple per request sent after warmup.
+    """
+    rng = random.Random(job['seed'])
+    sessions = []
+    for plan in job['plans']:
+        client = make_client(job['target'])
+        login(client, plan['email'], job['password'])
+        sessions.append((client, plan))
+
+    scenarios = list(job['weights'])
+    weights = [job['weights'][scenario] for scenario in scenarios]
+    samples = []
+    start = time.monotonic()
+    measure_from = start + job['warmup']
+    deadline = measure_from + job['duration']
+    index = 0
+    while time.monotonic() < deadline:
+        client, plan = sessions[index % len(sessions)]
+        index += 1
+        scenario = rng.choices(scenarios, weights)[0]
+        method, path, data = next_request(scenario, plan, rng)
+        began = time.perf_counter()
+        try:
+            status = client.request(method, path, data)
+        except Exception:
+            status = 0
+        elapsed = (time.perf_counter() - began) * 1000
+        if time.monotonic() >= measure_from:
+            samples.append((url_name(path), elapsed, status))
+    return samples
+
+
+def percentile(ordered, fraction):
+    # nearest-rank, so every reported value was actually observed
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def summarize(samples, duration):
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    for name, elapsed, status in samples:
+        timings[name].append(elapsed)
+        if not 200 <= status < 400:
+            errors[name] += 1
+    urls = {}
+    for name in sorted(timings):
+        ordered = sorted(timings[name])
+        urls[name] = {
+            'requests': len(ordered),
+            'errors': errors[name],
+            'rps': round(len(ordered) / duration, 2),
+            'mean_ms': round(sum(ordered) / len(ordered), 2),
+            'p50_ms': round(percentile(ordered, 0.50), 2),
+            'p95_ms': round(percentile(ordered, 0.95), 2),
+            'p99_ms': round(percentile(ordered, 0.99), 2),
+            'max_ms': round(ordered[-1], 2),
+        }
+    return urls
+
+
+class Command(BaseCommand):
+    help = (
+        "Logs in as users made by generate_dataset and replays weighted "
+        "scenarios against the site, reporting throughput and latency "
+        "percentiles per URL name as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server (default: call the WSGI app in-process)")
+        parser.add_argument('--users', type=int, default=20, help="Generated users to log in as")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true', help="Run workers in processes instead of threads")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to measure for")
+        parser.add_argument('--warmup', type=float, default=0, help="Seconds to run before measuring")
+        parser.add_argument('--weights', default=DEFAULT_WEIGHTS, help=f"Scenario weights (default: {DEFAULT_WEIGHTS})")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synth', help="Username prefix given to generate_dataset")
+        parser.add_argument('--password', default='password', help="Password given to generate_dataset")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+        parser.add_argument('--baseline', help="A previous report to compare percentiles against")
+        parser.add_argument(
+            '--sync-calendar', action='store_true',
+            help="Push accepted invites to Google Calendar when running in-process; "
+                 "a server started for --url needs CALENDAR_SYNC = False in its settings instead"
+        )
+
+    def handle(self, *args, **options):
+        weights = parse_weights(options['weights'])
+        workers = options['workers']
+        plans = load_plans(options['prefix'], options['users'])
+        if len(plans) < workers:
+            raise CommandError(
+                f"Found {len(plans)} users prefixed {options['prefix']!r}, need at least one per worker; "
+                f"run generate_dataset first"
+            )
+        if not options['url'] and not options['sync_calendar']:
+            settings.CALENDAR_SYNC = False
+
+        jobs = [{
+            'target': options['url'],
+            'plans': plans[i::workers],
+            'password': options['password'],
+            'weights': weights,
+            'seed': options['seed'] + i,
+            'warmup': options['warmup'],
+            'duration': options['duration'],
+        } for i in range(workers)]
+
+        if options['processes']:
+            # forked children must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        else:
+            executor = ThreadPoolExecutor(workers)
+        with executor:
+            samples = [sample for result in executor.map(run_worker, jobs) for sample in result]
+
+        duration = options['duration']
+        errors = sum(1 for _, _, status in samples if not 200 <= status < 400)
+        report = {
+            'target': options['url'] or 'in-process',
+            'mode': 'processes' if options['processes'] else 'threads',
+            'workers': workers,
+            'users': len(plans),
+            'weights': weights,
+            'seed': options['seed'],
+            'duration': duration,
+            'requests': len(samples),
+            'errors': errors,
+            'rps': round(len(samples) / duration, 2),
+            'urls': summarize(samples, duration),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+
+    def compare(self, report, path):
+        with open(path) as file:
+            baseline = json.load(file)
+        self.stdout.write(f"{'url':40} {'p50':>16} {'p95':>16} {'p99':>16}")
+        names = sorted(set(report['urls']) | set(baseline['urls']))
+        for name in names:
+            current, previous = report['urls'].get(name), baseline['urls'].get(name)
+            if not current or not previous:
+                self.stdout.write(f"{name:40} only in {'this run' if current else 'the baseline'}")
+                continue
+            cells = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                change = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0
+                cells.append(f"{current[key]:8.1f} {change:+6.1f}%")
+            self.stdout.write(f"{name:40} " + ' '.join(f"{cell:>16}" for cell in cells))
+        change = (report['rps'] - baseline['rps']) / baseline['rps'] * 100 if baseline['rps'] else 0
+        self.stdout.write(f"throughput {report['rps']} req/s ({change:+.1f}%)")
@@ -0,0 +1,71 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from forum.querylog import read_findings
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes the slow and repeated queries logged by "
+        "QueryInspectionMiddleware, worst call sites first"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help="Findings log to read (default: QUERY_FINDINGS_LOG)")
+        parser.add_argument('--kind', choices=['slow', 'repeated'])
+        parser.add_argument('--view', help="Only findings of this URL name, e.g. forum:group-detail")
+        parser.add_argument('--since', help="Only findings logged after this ISO datetime")
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        path = options['log'] or settings.QUERY_FINDINGS_LOG
+        since = parse_datetime(options['since']) if options['since'] else None
+        if options['since'] and since is None:
+            raise CommandError(f"--since {options['since']!r} isn't an ISO datetime")
+        try:
+            findings = list(read_findings(path))
+        except FileNotFoundError:
+            raise CommandError(f"No findings log at {path}")
+
+        # one row per problem: the same SQL from the same site in the same view
+        rows = defaultdict(lambda: {'requests': 0, 'queries': 0, 'ms': 0, 'max_count': 0})
+        for finding in findings:
+            if options['kind'] and finding['kind'] != options['kind']:
+                continue
+            if options['view'] and finding['view'] != options['view']:
+                continue
+            if since and parse_datetime(finding['time']) < since:
+                continue
+            key = (finding['kind'], finding['view'], finding['template'], finding['frame'], finding['sql'])
+            row = rows[key]
+            row['requests'] += 1
+            row['queries'] += finding['count']
+            row['ms'] += finding['ms']
+            row['max_count'] = max(row['max_count'], finding['count'])
+
+        summary = []
+        for key, row in rows.items():
+            row['ms'] = round(row['ms'], 2)
+            summary.append(dict(zip(('kind', 'view', 'template', 'frame', 'sql'), key), **row))
+        summary.sort(key=lambda row: row['ms'], reverse=True)
+        summary = summary[:options['top']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        if not summary:
+            self.stdout.write("No findings")
+            return
+        for row in summary:
+            where = ' / '.join(site for site in (row['template'], row['frame']) if site) or 'unknown site'
+            if row['kind'] == 'repeated':
+                detail = f"{row['requests']} requests, up to {row['max_count']} queries each"
+            else:
+                detail = f"{row['requests']} queries"
+            self.stdout.write(f"{row['kind']:8} {row['ms']:10.1f} ms  {row['view']}  {where}  ({detail})")
+            self.stdout.write(f"         {row['sql'][:200]}")
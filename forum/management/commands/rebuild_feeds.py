@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import FeedEntry, Membership
+
+
+class Command(BaseCommand):
+    help = "Refills every member's home feed with the recent posts of their groups"
+
+    def handle(self, *args, **options):
+        memberships = Membership.objects.filter(
+            is_approved=True
+        ).select_related('group')
+        count = 0
+        for membership in memberships.iterator():
+            FeedEntry.objects.backfill(membership)
+            count += 1
+        self.stdout.write(f"Backfilled {count} memberships")
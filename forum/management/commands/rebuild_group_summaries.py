@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Group
+
+
+class Command(BaseCommand):
+    help = "Recomputes the member, request and post counts and last post of every group"
+
+    def handle(self, *args, **options):
+        updated = Group.objects.all().refresh_summary()
+        self.stdout.write(f"Rebuilt the summary of {updated} groups")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from forum.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of groups, posts, comments and replies"
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write("Rebuilt the search index")
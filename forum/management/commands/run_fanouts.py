@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from forum import fanout
+from forum.models import NotificationFanout
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the notification fan-outs still pending, and with --stale the "
+        "ones a stopped process left running or that failed, from their last chunk"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale', type=int, metavar='MINUTES',
+            help="Also resume fan-outs running or failed with no progress for this many minutes"
+        )
+
+    def handle(self, *args, **options):
+        statuses = [NotificationFanout.PENDING]
+        fanouts = NotificationFanout.objects.filter(status=NotificationFanout.PENDING)
+        if options['stale'] is not None:
+            statuses += [NotificationFanout.RUNNING, NotificationFanout.FAILED]
+            fanouts = fanouts | NotificationFanout.objects.filter(
+                status__in=[NotificationFanout.RUNNING, NotificationFanout.FAILED],
+                updated__lt=timezone.now() - timedelta(minutes=options['stale']),
+            )
+        for fanout_id in fanouts.order_by('id').values_list('id', flat=True):
+            try:
+                fanout.run(fanout_id, statuses)
+            except Exception as error:
+                self.stderr.write(f"Fan-out {fanout_id} failed: {error!r}")
+            progress = NotificationFanout.objects.get(id=fanout_id)
+            self.stdout.write(f"{progress}: {progress.status}")
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from forum.models import Comment, Post, Reply
+
+
+class Command(BaseCommand):
+    help = "Reconciles the like_count of posts, comments and replies with their likes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Post, Comment, Reply):
+            fixed = self.sync_model(model, batch_size)
+            self.stdout.write(f"{model.__name__}: corrected {fixed} like counts")
+
+    def sync_model(self, model, batch_size):
+        likes = model._meta.get_field('likes')
+        through = likes.remote_field.through
+        source = likes.m2m_field_name()
+        fixed = 0
+        last_pk = None
+        while True:
+            # walk the table in primary key order so every batch is an index range
+            rows = model.objects.order_by('pk')
+            if last_pk is not None:
+                rows = rows.filter(pk__gt=last_pk)
+            batch = list(rows.only('pk', 'like_count')[:batch_size])
+            if not batch:
+                return fixed
+            last_pk = batch[-1].pk
+            counts = dict(
+                through.objects.filter(
+                    **{f'{source}__in': [obj.pk for obj in batch]}
+                ).values_list(source).annotate(n=Count('pk'))
+            )
+            stale = []
+            for obj in batch:
+                actual = counts.get(obj.pk, 0)
+                if obj.like_count != actual:
+                    obj.like_count = actual
+                    stale.append(obj)
+            if stale:
+                # a toggle racing with this batch is reconciled on the next run
+                model.objects.bulk_update(stale, ['like_count'])
+                fixed += len(stale)
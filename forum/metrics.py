@@ -0,0 +1,283 @@
+"""
+Prometheus metrics. Every process keeps its samples in memory and writes
+them to a file of its own under METRICS_DIR now and then; /metrics adds up
+the files of all processes, so whichever worker answers the scrape reports
+for the whole deployment.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from accounts.models import Account
+from polls.models import Vote
+
+from .models import Post, like_toggled
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Registry:
+    """
+    Samples of this process, keyed by (sample name, labels). Counters and
+    histograms are summed across processes; live gauges only count while
+    the process that wrote them is running.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.samples = defaultdict(float)
+        self.live = defaultdict(float)
+        self.collectors = []
+        self.flushed = time.monotonic()
+        # processes that never record anything, like most commands, write no file
+        self.dirty = False
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, name, labels, amount, live=False):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            (self.live if live else self.samples)[key] += amount
+            self.dirty = self.dirty or bool(amount)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.samples), dict(self.live)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.live.clear()
+
+    def path(self, pid):
+        return os.path.join(settings.METRICS_DIR, f'{pid}.json')
+
+    def flush(self):
+        samples, live = self.snapshot()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.path(os.getpid())
+        # write then rename, so a scrape never reads half a file
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({
+                'samples': [[name, labels, value] for (name, labels), value in samples.items()],
+                'live': [[name, labels, value] for (name, labels), value in live.items()],
+            }, file)
+        os.replace(temporary, path)
+        self.flushed = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def collect(self):
+        """
+        Returns the samples of every process added up, this one's included.
+        """
+        self.flush()
+        totals = defaultdict(float)
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            pid = int(os.path.basename(path).split('.')[0])
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            rows = data['samples'] + (data['live'] if _is_running(pid) else [])
+            for name, labels, value in rows:
+                totals[(name, tuple(tuple(label) for label in labels))] += value
+        for collector in self.collectors:
+            for name, labels, value in collector(totals):
+                totals[(name, tuple(sorted(labels.items())))] = value
+        return totals
+
+
+def _is_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+atexit.register(lambda: REGISTRY.flush() if REGISTRY.dirty else None)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        REGISTRY.register(self)
+
+    def sample_names(self):
+        return [self.name]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def sample_names(self):
+        return [f'{self.name}_total']
+
+    def inc(self, amount=1, **labels):
+        REGISTRY.add(f'{self.name}_total', labels, amount)
+
+
+class Gauge(Metric):
+    """
+    Either set by a collector at scrape time, or moved with inc()/dec() in
+    each process and summed over the processes still running.
+    """
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        REGISTRY.add(self.name, labels, amount, live=True)
+
+    def dec(self, amount=1, **labels):
+        REGISTRY.add(self.name, labels, -amount, live=True)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def sample_names(self):
+        return [f'{self.name}_bucket', f'{self.name}_sum', f'{self.name}_count']
+
+    def observe(self, value, **labels):
+        for bound in self.buckets:
+            if value <= bound:
+                REGISTRY.add(f'{self.name}_bucket', dict(labels, le=_format(bound)), 1)
+        REGISTRY.add(f'{self.name}_bucket', dict(labels, le='+Inf'), 1)
+        REGISTRY.add(f'{self.name}_sum', labels, value)
+        REGISTRY.add(f'{self.name}_count', labels, 1)
+
+
+request_latency = Histogram(
+    'shareit_request_duration_seconds', 'Time to answer a request, by URL name and status',
+    LATENCY_BUCKETS,
+)
+request_queries = Histogram(
+    'shareit_request_queries', 'Database queries run by a request, by URL name', QUERY_BUCKETS,
+)
+cache_lookups = Counter('shareit_cache_lookups', 'Cache reads, by result (hit or miss)')
+cache_hit_ratio = Gauge('shareit_cache_hit_ratio', 'Share of cache reads that were hits')
+writes = Counter('shareit_writes', 'Votes, likes and posts written, by kind')
+notifications_unread = Gauge('shareit_notifications_unread', 'Notifications not read yet')
+emails_in_flight = Gauge('shareit_emails_in_flight', 'Emails the running processes are sending right now')
+emails = Counter('shareit_emails', 'Emails the mail backend finished with, by result')
+
+
+def _cache_hit_ratio(totals):
+    hits = totals.get(('shareit_cache_lookups_total', (('result', 'hit'),)), 0)
+    misses = totals.get(('shareit_cache_lookups_total', (('result', 'miss'),)), 0)
+    if hits + misses:
+        yield 'shareit_cache_hit_ratio', {}, hits / (hits + misses)
+
+
+# (monotonic time, value) of the last unread count
+_unread = (None, 0)
+
+
+def _notifications_unread(totals):
+    # the accounts' counters rather than the notifications table, and at
+    # most once a METRICS_FLUSH_INTERVAL however often /metrics is scraped
+    global _unread
+    read_at, value = _unread
+    if read_at is None or time.monotonic() - read_at >= settings.METRICS_FLUSH_INTERVAL:
+        value = Account.objects.aggregate(n=Sum('unread_notifications'))['n'] or 0
+        _unread = (time.monotonic(), value)
+    yield 'shareit_notifications_unread', {}, value
+
+
+def _emails_in_flight(totals):
+    # reported as 0 rather than missing before the first email
+    yield 'shareit_emails_in_flight', {}, totals.get(('shareit_emails_in_flight', ()), 0)
+
+
+REGISTRY.collectors += [_cache_hit_ratio, _notifications_unread, _emails_in_flight]
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return f'{value:.1f}'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _bucket_order(item):
+    (_, labels), _ = item
+    le = dict(labels).get('le')
+    return [(k, v) for k, v in labels if k != 'le'], math.inf if le == '+Inf' else float(le or 0)
+
+
+def render(totals):
+    """
+    Formats samples in the Prometheus text exposition format.
+    """
+    by_name = defaultdict(list)
+    for key, value in totals.items():
+        by_name[key[0]].append((key, value))
+    lines = []
+    for metric in REGISTRY.metrics.values():
+        rows = []
+        for sample_name in metric.sample_names():
+            rows += sorted(by_name.get(sample_name, []), key=_bucket_order)
+        if not rows:
+            continue
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for (name, labels), value in rows:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+                name = f'{name}{{{label_text}}}'
+            lines.append(f'{name} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        writes.inc(kind='post')
+
+
+@receiver(post_save, sender=Vote)
+def count_vote(sender, instance, created, **kwargs):
+    if created:
+        writes.inc(kind='vote')
+
+
+@receiver(like_toggled)
+def count_like(sender, instance, user, liked, **kwargs):
+    if liked:
+        writes.inc(kind='like')
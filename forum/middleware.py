@@ -0,0 +1,125 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import REGISTRY, request_latency, request_queries
+from .perf import RequestProfile, current_profile, stats
+from .querylog import inspect_queries, log_findings
+from .tracing import SERVER, STATUS_ERROR, start_trace, trace_query
+
+
+class PerformanceMiddleware:
+    """
+    Profiles a PERF_SAMPLE_RATE share of requests: SQL count and time,
+    template render time and cache hits, added to the rolling stats under
+    the URL name and sent back in a Server-Timing header. Goes right after
+    the tracing and metrics middleware, so the total includes all the
+    middleware below it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+
+        match = request.resolver_match
+        profile.finish(match.view_name if match else '<unresolved>', response.status_code)
+        stats.add(profile)
+        response['Server-Timing'] = profile.server_timing()
+        return response
+
+
+class QueryInspectionMiddleware:
+    """
+    Logs the slow and repeated queries of a QUERY_INSPECTION_SAMPLE_RATE
+    share of requests, see forum.querylog.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.QUERY_INSPECTION_SAMPLE_RATE:
+            return self.get_response(request)
+        with inspect_queries(request) as inspector:
+            response = self.get_response(request)
+        log_findings(inspector.findings())
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Observes the latency and query count of every request for /metrics and
+    writes this process's samples out every METRICS_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        url_name = match.view_name if match else 'unresolved'
+        request_latency.observe(elapsed, url_name=url_name, status=str(response.status_code))
+        request_queries.observe(queries, url_name=url_name)
+        REGISTRY.maybe_flush()
+        return response
+
+
+class TracingMiddleware:
+    """
+    Traces a TRACE_SAMPLE_RATE share of requests, see forum.tracing. Goes
+    first in MIDDLEWARE so the other middleware's queries are in the trace.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.TRACE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with start_trace(request.method, SERVER, **{
+            'http.method': request.method,
+            'http.target': request.get_full_path(),
+        }) as root:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(trace_query))
+                response = self.get_response(request)
+            match = request.resolver_match
+            if match:
+                root.name = f'{request.method} {match.view_name}'
+                root.set_attribute('http.route', match.route)
+            root.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                root.status = STATUS_ERROR
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 4.1 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ['-timestamp', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-timestamp', '-id'], name='post_group_stream_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_like_counts(apps, schema_editor):
+    for model_name in ('Post', 'Comment', 'Reply'):
+        model = apps.get_model('forum', model_name)
+        through = model.likes.through
+        source = model_name.lower()
+        counts = through.objects.filter(
+            **{source: OuterRef('pk')}
+        ).values(source).annotate(n=Count('pk')).values('n')
+        model._base_manager.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0002_post_stream_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_like_counts, migrations.RunPython.noop),
+    ]
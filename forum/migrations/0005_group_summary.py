@@ -0,0 +1,57 @@
+# Generated by Django 4.1 on 2026-10-18 17:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_group_summary(apps, schema_editor):
+    Group = apps.get_model('forum', 'Group')
+    Membership = apps.get_model('forum', 'Membership')
+    Post = apps.get_model('forum', 'Post')
+
+    def count(queryset):
+        return Coalesce(Subquery(
+            queryset.order_by().values('group_id').annotate(n=Count('pk')).values('n')
+        ), 0)
+
+    memberships = Membership.objects.filter(group_id=OuterRef('pk'))
+    posts = Post._base_manager.filter(group_id=OuterRef('pk'), is_hidden=False)
+    Group.objects.update(
+        member_count=count(memberships.filter(is_approved=True)),
+        pending_count=count(memberships.filter(is_approved=False)),
+        post_count=count(posts),
+        last_post_id=Subquery(posts.order_by('-timestamp', '-id').values('id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0004_feed_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.post'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_group_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+def copy_roles(apps, schema_editor):
+    Group = apps.get_model('forum', 'Group')
+    Membership = apps.get_model('forum', 'Membership')
+
+    # the unique (group, user) constraint below needs duplicate rows gone
+    seen = set()
+    duplicates = []
+    for pk, group_id, user_id in Membership.objects.order_by(
+        '-is_approved', 'id'
+    ).values_list('id', 'group_id', 'user_id'):
+        if (group_id, user_id) in seen:
+            duplicates.append(pk)
+        else:
+            seen.add((group_id, user_id))
+    Membership.objects.filter(id__in=duplicates).delete()
+
+    for group_id, user_id in Group.admin.through.objects.values_list('group_id', 'account_id'):
+        updated = Membership.objects.filter(
+            group_id=group_id,
+            user_id=user_id
+        ).update(role='admin', is_approved=True)
+        if not updated:
+            Membership.objects.create(
+                group_id=group_id,
+                user_id=user_id,
+                role='admin',
+                is_approved=True
+            )
+
+    for group_id, owner_id in Group.objects.values_list('id', 'owner_id'):
+        Membership.objects.filter(
+            group_id=group_id,
+            user_id=owner_id
+        ).update(role='owner')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0005_group_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membership',
+            name='role',
+            field=models.CharField(choices=[('member', 'Member'), ('admin', 'Admin'), ('owner', 'Owner')], default='member', max_length=10),
+        ),
+        migrations.RunPython(copy_roles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='membership',
+            constraint=models.UniqueConstraint(fields=('group', 'user'), name='unique_membership'),
+        ),
+        migrations.RemoveField(
+            model_name='group',
+            name='admin',
+        ),
+    ]
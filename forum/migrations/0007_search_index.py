@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE forum_search USING fts5("
+        "kind UNINDEXED, object_id UNINDEXED, group_id UNINDEXED, post_id UNINDEXED, "
+        "title, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+        "SELECT 'group', id, id, NULL, name, COALESCE(description, '') FROM forum_group"
+    )
+    schema_editor.execute(
+        "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+        "SELECT 'post', id, group_id, id, COALESCE(title, ''), content "
+        "FROM forum_post WHERE NOT is_hidden"
+    )
+    schema_editor.execute(
+        "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+        "SELECT 'comment', c.id, p.group_id, p.id, '', c.content "
+        "FROM forum_comment c JOIN forum_post p ON p.id = c.post_id "
+        "WHERE NOT c.is_hidden AND NOT p.is_hidden"
+    )
+    schema_editor.execute(
+        "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+        "SELECT 'reply', r.id, p.group_id, p.id, '', r.content "
+        "FROM forum_reply r JOIN forum_comment c ON c.id = r.comment_id "
+        "JOIN forum_post p ON p.id = c.post_id "
+        "WHERE NOT r.is_hidden AND NOT c.is_hidden AND NOT p.is_hidden"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS forum_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0006_membership_role'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_group_stream_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_hidden', False)), fields=['post', '-timestamp'], name='comment_post_stream_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['group', 'user', 'is_approved'], name='membership_group_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['user', 'is_approved'], name='membership_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('is_hidden', False)), fields=['group', '-timestamp', '-id'], name='post_group_stream_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(condition=models.Q(('is_hidden', False)), fields=['comment', '-timestamp'], name='reply_comment_stream_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1 on 2026-10-18 18:10
+
+from django.core.management import call_command
+from django.db import migrations, models
+import time
+
+
+def create_cache_table(apps, schema_editor):
+    # the shared tier of forum.cache.TieredCache; skips tables that exist
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0008_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='cache_version',
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1 on 2026-10-18 18:22
+
+from django.db import migrations, models
+import time
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_group_cache_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='cache_version',
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+    ]
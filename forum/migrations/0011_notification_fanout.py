@@ -0,0 +1,42 @@
+# Generated by Django 4.1 on 2026-10-18 18:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forum', '0010_post_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationFanout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('audience', models.CharField(choices=[('members', 'Members'), ('admins', 'Admins')], max_length=10)),
+                ('verb', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('action_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('action_object_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_fanouts', to='forum.group')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notificationfanout',
+            index=models.Index(fields=['status', 'updated'], name='fanout_status_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def store_object_ids_as_text(apps, schema_editor):
+    # 0007 backfilled integer ids, which never equal the text ids the
+    # index is kept up to date and searched with
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "UPDATE forum_search SET object_id = CAST(object_id AS TEXT) "
+        "WHERE typeof(object_id) = 'integer'"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_notification_fanout'),
+    ]
+
+    operations = [
+        migrations.RunPython(store_object_ids_as_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # the shared cache tier moved to a file cache; 0009 created its table
+    # while it was a database cache
+
+    dependencies = [
+        ('forum', '0012_search_object_ids'),
+    ]
+
+    operations = [
+        migrations.RunSQL('DROP TABLE IF EXISTS shareit_cache', migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import time
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0013_drop_database_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='settings_version',
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+    ]
@@ -1,14 +1,27 @@
+import time
 import uuid
 
-from django.db import models
-from django.db.models.signals import pre_save
-from django.dispatch import receiver
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import Signal, receiver
 from django.utils.text import slugify
 from django.urls import reverse
 
+from .pagination import KeysetPage, KeysetPaginator
+
 
 # Create your models here.
 
+# sent by LikeCounter.toggle_like with instance, user and liked; the through
+# rows it writes don't send post_save because Django auto-created them
+like_toggled = Signal()
+
 
 class ActiveObject(models.Manager):
 
@@ -22,6 +35,83 @@ class HiddenObject(models.Manager):
         return super().get_queryset().filter(is_hidden=True)
 
 
+class LikeCounter:
+    """
+    Keeps like_count in step with the likes relation using single UPDATEs,
+    so concurrent toggles never read and write back a stale count.
+    """
+
+    def toggle_like(self, user):
+        # returns True when the user now likes the object
+        likes = self.likes
+        lookup = {
+            likes.source_field_name: self,
+            likes.target_field_name: user,
+        }
+        model = type(self)
+        with transaction.atomic():
+            deleted, _ = likes.through.objects.filter(**lookup).delete()
+            if deleted:
+                model.objects.filter(pk=self.pk).update(like_count=F('like_count') - 1)
+                like_toggled.send(sender=model, instance=self, user=user, liked=False)
+                return False
+            _, created = likes.through.objects.get_or_create(**lookup)
+            if created:
+                model.objects.filter(pk=self.pk).update(like_count=F('like_count') + 1)
+                like_toggled.send(sender=model, instance=self, user=user, liked=True)
+            return True
+
+
+class GroupQuerySet(models.QuerySet):
+
+    def bump_cache_version(self):
+        # a new value rather than +1, so saving a stale instance can't bring
+        # back a version something was cached under
+        return self.update(cache_version=time.time_ns())
+
+    def refresh_summary(self):
+        """
+        Recomputes the denormalized member/post figures of the selected groups
+        in a single UPDATE, for backfills; writes move them with move_summary.
+        Moves their cache version on as well.
+        """
+        def member_count(is_approved):
+            return Coalesce(Subquery(
+                Membership.objects.filter(
+                    group_id=OuterRef('pk'),
+                    is_approved=is_approved
+                ).values('group_id').annotate(n=Count('pk')).values('n')
+            ), 0)
+
+        posts = Post.active_objects.filter(group_id=OuterRef('pk'))
+        return self.update(
+            member_count=member_count(True),
+            pending_count=member_count(False),
+            post_count=Coalesce(Subquery(
+                posts.order_by().values('group_id').annotate(n=Count('pk')).values('n')
+            ), 0),
+            last_post_id=Subquery(posts.values('id')[:1]),
+            cache_version=time.time_ns(),
+        )
+
+    def move_summary(self, members=0, pending=0, posts=0, last_post=False):
+        """
+        Moves the denormalized figures of the selected groups by the given
+        amounts in a single UPDATE, re-reading the last post off the stream
+        index when last_post is set, so a write costs the same however big
+        the group is. Moves their cache version on as well.
+        """
+        changes = {'cache_version': time.time_ns()}
+        for field, amount in [('member_count', members), ('pending_count', pending), ('post_count', posts)]:
+            if amount:
+                changes[field] = F(field) + amount
+        if last_post:
+            changes['last_post_id'] = Subquery(
+                Post.active_objects.filter(group_id=OuterRef('pk')).values('id')[:1]
+            )
+        return self.update(**changes)
+
+
 class Group(models.Model):
     PRIVACY_CHOICES = (
         ('public', 'Public'),
@@ -36,7 +126,27 @@ class Group(models.Model):
     # member = models.ManyToManyField('accounts.Account', related_name='group_member')
     privacy = models.CharField(max_length=10, choices=PRIVACY_CHOICES, default='public')
     slug = models.SlugField(max_length=250, unique=True)
-    admin = models.ManyToManyField('accounts.Account', related_name='admin')
+    # set once the group is too big to copy posts into every member's feed
+    fanout_on_read = models.BooleanField(default=False)
+
+    # summary kept current by the Membership and Post signals below
+    member_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
+    last_post = models.ForeignKey(
+        'Post',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # namespaces what forum.cache keeps about the group; see bump_cache_version
+    cache_version = models.BigIntegerField(default=time.time_ns, editable=False)
+    # moved on by the group's own saves only; names the cached post HTML,
+    # which has the group's slug and settings in it; see forum.fragments
+    settings_version = models.BigIntegerField(default=time.time_ns, editable=False)
+
+    objects = GroupQuerySet.as_manager()
 
     class Meta:
         permissions = (("has_all_access", "Has all access"),)
@@ -47,14 +157,18 @@ class Group(models.Model):
     def get_absolute_url(self):
         return reverse('forum:group-detail', args=[self.slug])
 
+    def admins(self):
+        return self.member.filter(role__in=Membership.ADMIN_ROLES)
+
 
 @receiver(pre_save, sender=Group)
 def slugify_name(sender, instance, **kwargs):
     # if instance.slug is None:
     instance.slug = slugify(instance.name)
+    instance.settings_version = time.time_ns()
 
 
-class Post(models.Model):
+class Post(LikeCounter, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     title = models.CharField(max_length=200, null=True, blank=True)
     content = models.TextField()
@@ -64,6 +178,9 @@ class Post(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='posts')
     is_hidden = models.BooleanField(default=False)
     likes = models.ManyToManyField('accounts.Account', related_name='post_likes')
+    like_count = models.PositiveIntegerField(default=0)
+    # names the cached HTML of the post and its comments; see forum.fragments
+    cache_version = models.BigIntegerField(default=time.time_ns, editable=False)
 
     active_objects = ActiveObject()
     deleted_objects = HiddenObject()
@@ -71,7 +188,14 @@ class Post(models.Model):
     objects = models.Manager()
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(
+                fields=['group', '-timestamp', '-id'],
+                condition=models.Q(is_hidden=False),
+                name='post_group_stream_idx'
+            ),
+        ]
 
     def __str__(self):
         if self.title:
@@ -83,13 +207,20 @@ class Post(models.Model):
         return reverse('post-detail', args=[self.id])
 
 
-class Comment(models.Model):
+@receiver(pre_save, sender=Post)
+def bump_post_version(sender, instance, **kwargs):
+    # edits and hiding move the version on with the same UPDATE
+    instance.cache_version = time.time_ns()
+
+
+class Comment(LikeCounter, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     author = models.ForeignKey('accounts.Account', on_delete=models.CASCADE, related_name='comment')
     timestamp = models.DateTimeField(auto_now_add=True)
     is_hidden = models.BooleanField(default=False)
     likes = models.ManyToManyField('accounts.Account', related_name='comment_likes')
+    like_count = models.PositiveIntegerField(default=0)
 
     active_objects = ActiveObject()
     deleted_objects = HiddenObject()
@@ -98,18 +229,26 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(
+                fields=['post', '-timestamp'],
+                condition=models.Q(is_hidden=False),
+                name='comment_post_stream_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.content
 
 
-class Reply(models.Model):
+class Reply(LikeCounter, models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='replies')
     content = models.TextField()
     author = models.ForeignKey('accounts.Account', on_delete=models.CASCADE, related_name='reply')
     timestamp = models.DateTimeField(auto_now_add=True)
     is_hidden = models.BooleanField(default=False)
     likes = models.ManyToManyField('accounts.Account', related_name='reply_likes')
+    like_count = models.PositiveIntegerField(default=0)
 
     active_objects = ActiveObject()
     deleted_objects = HiddenObject()
@@ -118,12 +257,29 @@ class Reply(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(
+                fields=['comment', '-timestamp'],
+                condition=models.Q(is_hidden=False),
+                name='reply_comment_stream_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.content
 
 
 class Membership(models.Model):
+    MEMBER = 'member'
+    ADMIN = 'admin'
+    OWNER = 'owner'
+    ROLE_CHOICES = (
+        (MEMBER, 'Member'),
+        (ADMIN, 'Admin'),
+        (OWNER, 'Owner'),
+    )
+    ADMIN_ROLES = (ADMIN, OWNER)
+
     is_suspended = models.BooleanField(default=False)
     group = models.ForeignKey(
         Group,
@@ -136,6 +292,259 @@ class Membership(models.Model):
         related_name='group_membership'
     )
     is_approved = models.BooleanField(default=False)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=MEMBER)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'user'], name='unique_membership'),
+        ]
+        indexes = [
+            models.Index(fields=['group', 'user', 'is_approved'], name='membership_group_user_idx'),
+            models.Index(fields=['user', 'is_approved'], name='membership_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} in {self.group}"
+
+    @property
+    def is_admin(self):
+        return self.role in self.ADMIN_ROLES
+
+
+class FeedEntryManager(models.Manager):
+
+    def fan_out(self, post):
+        group = post.group
+        if group.fanout_on_read:
+            return
+        members = Membership.objects.filter(group_id=group.id, is_approved=True)
+        if members.count() > settings.FEED_FANOUT_LIMIT:
+            Group.objects.filter(id=group.id).update(fanout_on_read=True)
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, post=post, group=group, timestamp=post.timestamp)
+                for user_id in members.values_list('user_id', flat=True)
+            ],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+
+    def backfill(self, membership):
+        # give a new member the group's recent history
+        if membership.group.fanout_on_read:
+            return
+        posts = Post.active_objects.filter(
+            group_id=membership.group_id
+        ).values_list('id', 'timestamp')[:settings.FEED_BACKFILL_SIZE]
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=membership.user_id,
+                    post_id=post_id,
+                    group_id=membership.group_id,
+                    timestamp=timestamp
+                )
+                for post_id, timestamp in posts
+            ],
+            ignore_conflicts=True
+        )
+
+    def timeline(self, user, before=None, per_page=10):
+        """
+        Returns a page of posts for the user's home feed, merging the
+        materialized entries with posts read directly from large groups.
+        """
+        entries = KeysetPaginator(
+            self.filter(user_id=user.id, post__is_hidden=False).select_related(
+                'post__author', 'post__group'
+            ),
+            per_page=per_page,
+            key='post_id'
+        ).page(before=before)
+        posts = {entry.post_id: entry.post for entry in entries}
+        has_older = entries.has_older
+
+        large_groups = list(Group.objects.filter(
+            fanout_on_read=True,
+            member__user_id=user.id,
+            member__is_approved=True
+        ).values_list('id', flat=True))
+        if large_groups:
+            # one query: the next page of each group, read off the group's
+            # stream index in a UNION ALL, and only those merged and sorted,
+            # not every post the groups ever had
+            pages = [
+                KeysetPaginator(Post.active_objects.filter(group_id=group_id)).older(before)
+                .values('id')[:per_page + 1].query.sql_with_params()
+                for group_id in large_groups
+            ]
+            newest = RawSQL(
+                ' UNION ALL '.join(f'SELECT * FROM ({sql})' for sql, _ in pages),
+                [param for _, params in pages for param in params]
+            )
+            direct = KeysetPaginator(
+                Post.active_objects.filter(id__in=newest).select_related('author', 'group'),
+                per_page=per_page
+            ).page(before=before)
+            for post in direct:
+                posts.setdefault(post.id, post)
+            has_older = has_older or direct.has_older
+
+        ordered = sorted(posts.values(), key=lambda post: (post.timestamp, post.id), reverse=True)
+        return KeysetPage(
+            ordered[:per_page],
+            has_older=has_older or len(ordered) > per_page,
+            has_newer=bool(before)
+        )
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey('accounts.Account', on_delete=models.CASCADE, related_name='feed_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='feed_entries')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='feed_entries')
+    # copy of post.timestamp so the feed can be read from its own index
+    timestamp = models.DateTimeField()
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_feed_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-post'], name='feed_user_stream_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post} for {self.user}"
+
+
+class NotificationFanout(models.Model):
+    """
+    One notification to every member of a group, or to its admins, which
+    forum.fanout writes in chunks after the request that sent it. sent and
+    cursor record how far it got.
+    """
+    MEMBERS = 'members'
+    ADMINS = 'admins'
+    AUDIENCE_CHOICES = (
+        (MEMBERS, 'Members'),
+        (ADMINS, 'Admins'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='notification_fanouts')
+    audience = models.CharField(max_length=10, choices=AUDIENCE_CHOICES)
+    actor = models.ForeignKey('accounts.Account', on_delete=models.CASCADE, related_name='+')
+    verb = models.CharField(max_length=255)
+    description = models.TextField(blank=True, null=True)
+    action_object_content_type = models.ForeignKey(
+        ContentType, blank=True, null=True, on_delete=models.CASCADE, related_name='+'
+    )
+    action_object_id = models.CharField(max_length=255, blank=True, null=True)
+    action_object = GenericForeignKey('action_object_content_type', 'action_object_id')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    # recipients are written in user id order; the last one written
+    cursor = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated'], name='fanout_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.verb} to the {self.audience} of {self.group_id} ({self.sent}/{self.total})"
+
+    def recipient_ids(self):
+        memberships = Membership.objects.filter(group_id=self.group_id)
+        if self.audience == self.ADMINS:
+            memberships = memberships.filter(role__in=Membership.ADMIN_ROLES)
+        else:
+            memberships = memberships.filter(is_suspended=False).exclude(user_id=self.actor_id)
+        return memberships.order_by('user_id').values_list('user_id', flat=True)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.fan_out(instance)
+
+
+@receiver(post_init, sender=Membership)
+def remember_approval(sender, instance, **kwargs):
+    instance._saved_approved = instance.is_approved
+
+
+@receiver(post_save, sender=Membership)
+def backfill_feed(sender, instance, created, **kwargs):
+    # only when the membership gets approved, not on every later save
+    was_approved = False if created else instance._saved_approved
+    if instance.is_approved and not was_approved:
+        FeedEntry.objects.backfill(instance)
+
+
+@receiver(post_delete, sender=Membership)
+def clear_feed(sender, instance, **kwargs):
+    FeedEntry.objects.filter(
+        user_id=instance.user_id,
+        group_id=instance.group_id
+    ).delete()
+
+
+# Post and Membership writes move the group's figures by what they change;
+# these run after backfill_feed, which compares against the saved state too
+
+@receiver(post_save, sender=Membership)
+def count_saved_membership(sender, instance, created, **kwargs):
+    members = pending = 0
+    if created:
+        members, pending = (1, 0) if instance.is_approved else (0, 1)
+    elif instance.is_approved != instance._saved_approved:
+        members, pending = (1, -1) if instance.is_approved else (-1, 1)
+    Group.objects.filter(id=instance.group_id).move_summary(members=members, pending=pending)
+    instance._saved_approved = instance.is_approved
+
+
+@receiver(post_delete, sender=Membership)
+def count_deleted_membership(sender, instance, **kwargs):
+    members, pending = (-1, 0) if instance._saved_approved else (0, -1)
+    Group.objects.filter(id=instance.group_id).move_summary(members=members, pending=pending)
+
+
+@receiver(post_init, sender=Post)
+def remember_visibility(sender, instance, **kwargs):
+    instance._saved_visible = not instance.is_hidden
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    was_visible = False if created else instance._saved_visible
+    is_visible = not instance.is_hidden
+    Group.objects.filter(id=instance.group_id).move_summary(
+        posts=is_visible - was_visible, last_post=is_visible != was_visible
+    )
+    instance._saved_visible = is_visible
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    Group.objects.filter(id=instance.group_id).move_summary(
+        posts=-instance._saved_visible, last_post=instance._saved_visible
+    )
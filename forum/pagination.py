@@ -0,0 +1,100 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(obj):
+    # a cursor is the (timestamp, id) pair of the row at the edge of a page
+    raw = f"{obj.timestamp.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, pk = raw.split('|', 1)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    timestamp = parse_datetime(timestamp)
+    if timestamp is None or not pk:
+        raise InvalidCursor(cursor)
+    return timestamp, pk
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, has_older, has_newer):
+        self.object_list = object_list
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def older_cursor(self):
+        if self.has_older and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def newer_cursor(self):
+        if self.has_newer and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    """
+    Pages through a queryset newest first on (timestamp, id) without OFFSET,
+    so fetching a page costs the same however deep into the history it is.
+    """
+
+    def __init__(self, queryset, per_page=10, key='pk'):
+        self.queryset = queryset
+        self.per_page = per_page
+        # tiebreaker column, compared against the id stored in the cursor
+        self.key = key
+
+    def older(self, before=None):
+        """
+        Returns the queryset newest first, from just before the cursor
+        before when there is one.
+        """
+        queryset = self.queryset
+        if before:
+            timestamp, pk = decode_cursor(before)
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) |
+                Q(timestamp=timestamp, **{f'{self.key}__lt': pk})
+            )
+        return queryset.order_by('-timestamp', f'-{self.key}')
+
+    def page(self, before=None, after=None):
+        if after:
+            timestamp, pk = decode_cursor(after)
+            rows = list(self.queryset.filter(
+                Q(timestamp__gt=timestamp) |
+                Q(timestamp=timestamp, **{f'{self.key}__gt': pk})
+            ).order_by('timestamp', self.key)[:self.per_page + 1])
+            has_newer = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return KeysetPage(rows, has_older=True, has_newer=has_newer)
+
+        rows = list(self.older(before)[:self.per_page + 1])
+        has_older = len(rows) > self.per_page
+        return KeysetPage(
+            rows[:self.per_page],
+            has_older=has_older,
+            has_newer=bool(before)
+        )
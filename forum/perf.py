@@ -0,0 +1,187 @@
+"""
+Per-request performance measurements: SQL, template and cache time of
+the sampled requests, kept as rolling aggregates per URL name. Cache reads
+are also counted for /metrics, sampled or not.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.base import Template
+
+from .metrics import cache_lookups
+
+# the profile of the request being handled, None when it isn't sampled
+current_profile = ContextVar('current_profile', default=None)
+
+_MISSING = object()
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.url_name = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.total_ms = 0
+        self.sql_count = 0
+        self.sql_ms = 0
+        self.template_ms = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # nested renders ({% include %}, inclusion tags) are part of the outer one
+        self.template_depth = 0
+
+    def finish(self, url_name, status):
+        self.url_name = url_name
+        self.status = status
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_ms += (time.perf_counter() - start) * 1000
+
+    def server_timing(self):
+        cache = f'{self.cache_hits} hits, {self.cache_misses} misses'
+        return ', '.join([
+            f'db;dur={self.sql_ms:.1f};desc="{self.sql_count} queries"',
+            f'tpl;dur={self.template_ms:.1f}',
+            f'cache;desc="{cache}"',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+
+class RollingStats:
+    """
+    Keeps the last PERF_WINDOW profiles of every URL name and summarizes
+    them on demand, so old traffic ages out without a timer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = defaultdict(self.new_window)
+
+    def new_window(self):
+        return deque(maxlen=settings.PERF_WINDOW)
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles[profile.url_name].append(profile)
+
+    def clear(self):
+        with self.lock:
+            self.profiles.clear()
+
+    def summary(self):
+        with self.lock:
+            windows = {name: list(profiles) for name, profiles in self.profiles.items()}
+        return {name: summarize(profiles) for name, profiles in sorted(windows.items())}
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 2)
+
+
+def summarize(profiles):
+    totals = sorted(profile.total_ms for profile in profiles)
+    hits = sum(profile.cache_hits for profile in profiles)
+    misses = sum(profile.cache_misses for profile in profiles)
+    return {
+        'requests': len(profiles),
+        'total_ms': {
+            'mean': _mean(totals),
+            'p50': round(_percentile(totals, 0.50), 2),
+            'p95': round(_percentile(totals, 0.95), 2),
+            'max': round(totals[-1], 2),
+        },
+        'sql_count': _mean([profile.sql_count for profile in profiles]),
+        'sql_ms': _mean([profile.sql_ms for profile in profiles]),
+        'template_ms': _mean([profile.template_ms for profile in profiles]),
+        'cache_hits': hits,
+        'cache_misses': misses,
+        'cache_hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
+
+
+stats = RollingStats()
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, context):
+        profile = current_profile.get()
+        if profile is None:
+            return render(self, context)
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_ms += (time.perf_counter() - start) * 1000
+    return wrapper
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version)
+        cache_lookups.inc(result='miss' if value is _MISSING else 'hit')
+        profile = current_profile.get()
+        if profile is not None:
+            if value is _MISSING:
+                profile.cache_misses += 1
+            else:
+                profile.cache_hits += 1
+        return default if value is _MISSING else value
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, version=None):
+        keys = list(keys)
+        found = get_many(self, keys, version)
+        cache_lookups.inc(len(found), result='hit')
+        cache_lookups.inc(len(keys) - len(found), result='miss')
+        profile = current_profile.get()
+        if profile is not None:
+            profile.cache_hits += len(found)
+            profile.cache_misses += len(keys) - len(found)
+        return found
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """
+    Wraps template rendering and the get methods of the default cache
+    backend so they report to the current profile. Called once from
+    ForumConfig.ready().
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    Template.render = _timed_render(Template.render)
+    # only the cache the code reads; the tiers behind it would count reads twice
+    backend = type(caches['default'])
+    backend.get = _counted_get(backend.get)
+    # BaseCache.get_many calls get() per key, which is already counted
+    if 'get_many' in vars(backend):
+        backend.get_many = _counted_get_many(backend.get_many)
@@ -0,0 +1,334 @@
+"""
+Server-push of notifications over Server-Sent Events. Every ASGI process
+keeps a broker of the event streams open in it, by user. Notification
+writes publish a message once their transaction commits; PUSH_BACKEND
+carries it to the brokers of the other processes, and each stream passes
+it on to the browser. An idle stream is an open socket and a keepalive
+comment now and then, instead of a request every few seconds.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from notifications.models import Notification
+from notifications.utils import id2slug
+
+from accounts.models import Account
+
+from .inbox import notifications_created, unread_changed
+
+
+logger = logging.getLogger('forum.push')
+
+
+class Stream:
+    """
+    The messages for one open event stream, put from any thread and read
+    on the event loop that serves it.
+    """
+    # a stream this far behind gets the unread count instead of the rest
+    max_pending = 100
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(self.max_pending)
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+
+    def drain(self):
+        messages = []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        return messages
+
+
+class Broker:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = defaultdict(set)
+        self.listening = set()
+
+    def subscribe(self, user_id):
+        loop = asyncio.get_running_loop()
+        stream = Stream(user_id, loop)
+        with self.lock:
+            self.streams[user_id].add(stream)
+            start = loop not in self.listening
+            self.listening.add(loop)
+        if start:
+            loop.create_task(backend().listen(self))
+        return stream
+
+    def unsubscribe(self, stream):
+        with self.lock:
+            streams = self.streams[stream.user_id]
+            streams.discard(stream)
+            if not streams:
+                del self.streams[stream.user_id]
+
+    def deliver(self, message):
+        with self.lock:
+            streams = list(self.streams.get(message['user'], ()))
+        for stream in streams:
+            stream.put(message)
+
+
+BROKER = Broker()
+
+
+class LocalBackend:
+    """
+    Delivers messages to the streams of the publishing process only, for a
+    deployment with a single ASGI process.
+    """
+
+    def publish(self, messages):
+        for message in messages:
+            BROKER.deliver(message)
+
+    async def listen(self, broker):
+        pass
+
+
+class SQLiteBackend(LocalBackend):
+    """
+    A stand-in for a pub/sub server between the processes of one host:
+    messages are appended to a table in the SQLite file PUSH_DATABASE and
+    each process with open streams polls it every PUSH_POLL_INTERVAL
+    seconds for the ones other processes wrote. Rows are kept for
+    PUSH_RETENTION seconds.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.PUSH_DATABASE)
+        self.origin = os.getpid()
+        self.pruned = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS message ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER, created REAL, body TEXT)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS message_created ON message (created)')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def publish(self, messages):
+        super().publish(messages)
+        now = time.time()
+        # runs after the write committed, so a locked or broken file costs
+        # the other processes' streams a message, not the request a 500
+        try:
+            with self.connect() as db:
+                db.executemany(
+                    'INSERT INTO message (origin, created, body) VALUES (?, ?, ?)',
+                    [(self.origin, now, json.dumps(message)) for message in messages],
+                )
+                if now - self.pruned > settings.PUSH_RETENTION / 10:
+                    db.execute('DELETE FROM message WHERE created < ?', (now - settings.PUSH_RETENTION,))
+                    self.pruned = now
+        except sqlite3.Error:
+            logger.exception("Could not publish %s push messages", len(messages))
+
+    def last_id(self):
+        with self.connect() as db:
+            return db.execute('SELECT COALESCE(MAX(id), 0) FROM message').fetchone()[0]
+
+    def read(self, after):
+        """
+        Returns the id of the last message after the id after and the
+        messages other processes published among them.
+        """
+        with self.connect() as db:
+            rows = db.execute(
+                'SELECT id, origin, body FROM message WHERE id > ? ORDER BY id', (after,)
+            ).fetchall()
+        last = rows[-1][0] if rows else after
+        return last, [json.loads(body) for _, origin, body in rows if origin != self.origin]
+
+    async def listen(self, broker):
+        after = await asyncio.to_thread(self.last_id)
+        while True:
+            await asyncio.sleep(settings.PUSH_POLL_INTERVAL)
+            try:
+                after, messages = await asyncio.to_thread(self.read, after)
+            except sqlite3.Error:
+                continue
+            for message in messages:
+                broker.deliver(message)
+
+
+@lru_cache(maxsize=None)
+def backend():
+    return import_string(settings.PUSH_BACKEND)()
+
+
+def publish_on_commit(messages):
+    transaction.on_commit(lambda: backend().publish(messages))
+
+
+def _notification_message(notification):
+    # the streams load it, so a write doesn't pay for rendering it for
+    # recipients who have no stream open
+    return {'user': notification.recipient_id, 'event': 'notification', 'id': notification.id}
+
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if created:
+        publish_on_commit([_notification_message(instance)])
+
+
+@receiver(notifications_created)
+def push_notifications(sender, notifications, **kwargs):
+    publish_on_commit([_notification_message(notification) for notification in notifications])
+
+
+@receiver(unread_changed)
+def push_unread_count(sender, user_ids, **kwargs):
+    # only a nudge: the streams read the count once the write has committed
+    publish_on_commit([{'user': user_id, 'event': 'unread'} for user_id in user_ids])
+
+
+def event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+@sync_to_async
+def _load_user(scope):
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+@sync_to_async
+def _notifications(user_id, ids):
+    notifications = Notification.objects.filter(recipient_id=user_id, id__in=ids).prefetch_related(
+        'actor', 'action_object', 'target'
+    )
+    return [
+        {
+            'id': notification.id,
+            'slug': id2slug(notification.id),
+            'verb': notification.verb,
+            'description': notification.description,
+            'actor': str(notification.actor),
+            'text': str(notification),
+            'timestamp': notification.timestamp.isoformat(),
+        }
+        for notification in reversed(notifications)
+    ]
+
+
+@sync_to_async
+def _unread_count(user_id):
+    return Account.objects.filter(id=user_id).values_list('unread_notifications', flat=True).first() or 0
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(scope, receive, send):
+    """
+    ASGI app answering PUSH_PATH with the event stream of the signed-in
+    user: an unread event with the count on connecting and whenever it
+    changes, and a notification event for each new notification.
+    """
+    user = await _load_user(scope)
+    if user is None:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    stream = BROKER.subscribe(user.id)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        count = await _unread_count(user.id)
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        await send({'type': 'http.response.body', 'body': event('unread', {'unread_count': count}), 'more_body': True})
+        while True:
+            next_message = asyncio.ensure_future(stream.queue.get())
+            done, _ = await asyncio.wait(
+                {next_message, disconnected}, timeout=settings.PUSH_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                next_message.cancel()
+                return
+            if next_message not in done:
+                next_message.cancel()
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            pushed = [next_message.result(), *stream.drain()]
+            ids = [message['id'] for message in pushed if message['event'] == 'notification']
+            body = b''
+            if ids:
+                for data in await _notifications(user.id, ids):
+                    body += event('notification', data)
+            # one read however many writes the messages are about
+            latest = await _unread_count(user.id)
+            if latest != count:
+                count = latest
+                body += event('unread', {'unread_count': count})
+            if body:
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        BROKER.unsubscribe(stream)
+
+
+def application(django_application):
+    """
+    Wraps the Django ASGI app so PUSH_PATH is served by stream_events on
+    the event loop: Django 4.1 iterates streaming responses synchronously
+    and would hold the loop for as long as a stream stays open.
+    """
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == settings.PUSH_PATH:
+            return await stream_events(scope, receive, send)
+        return await django_application(scope, receive, send)
+    return app
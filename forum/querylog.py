@@ -0,0 +1,167 @@
+"""
+Finds slow queries and SQL repeated within one request (N+1 lookups),
+attributes each to the view and to the template line or Python frame that
+ran it, and appends the findings to QUERY_FINDINGS_LOG as JSON lines.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+from django.utils import timezone
+
+
+logger = logging.getLogger('forum.queries')
+_log_lock = threading.Lock()
+
+Query = namedtuple('Query', ['shape', 'ms', 'template', 'frame'])
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w"])\d+(?![\w"])')
+
+# frames of the wrappers themselves aren't call sites
+_INSTRUMENTATION = {
+    os.path.join(os.path.dirname(__file__), name)
+    for name in ('querylog.py', 'perf.py', 'middleware.py')
+}
+# frames outside a middleware's __call__ belong to the server, not the request
+_REQUEST_BOUNDARY = os.path.join(os.path.dirname(__file__), 'middleware.py')
+
+
+def query_shape(sql):
+    """
+    Returns sql with literals replaced, so the same lookup for different
+    objects has the same shape.
+    """
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = STRING.sub('?', sql)
+    return NUMBER.sub('?', sql)
+
+
+def _is_project_file(filename):
+    return (
+        filename.startswith(str(settings.BASE_DIR))
+        and 'site-packages' not in filename
+        and filename not in _INSTRUMENTATION
+    )
+
+
+def call_site(frame):
+    """
+    Walks out from frame and returns the innermost template node being
+    rendered as "template:line" and the innermost project frame as
+    "path:line in function". Either is None when there isn't one.
+    """
+    template = python = None
+    while frame is not None and (template is None or python is None):
+        code = frame.f_code
+        if code.co_filename == _REQUEST_BOUNDARY and code.co_name == '__call__':
+            break
+        if template is None and code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if isinstance(node, Node) and node.origin is not None:
+                name = node.origin.template_name or node.origin.name
+                template = f'{name}:{node.token.lineno}'
+        if python is None and _is_project_file(code.co_filename):
+            path = os.path.relpath(code.co_filename, settings.BASE_DIR)
+            python = f'{path}:{frame.f_lineno} in {code.co_name}'
+        frame = frame.f_back
+    return template, python
+
+
+class QueryInspector:
+    """
+    Database execute wrapper that keeps the shape, duration and call site
+    of every query run while it is installed.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            template, frame = call_site(sys._getframe(1))
+            self.queries.append(Query(query_shape(sql), elapsed, template, frame))
+
+    def view_name(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match else None
+
+    def findings(self):
+        base = {
+            'time': timezone.now().isoformat(),
+            'view': self.view_name(),
+            'path': getattr(self.request, 'path', None),
+        }
+        findings = []
+        for query in self.queries:
+            if query.ms >= settings.SLOW_QUERY_MS:
+                findings.append(dict(
+                    base, kind='slow', sql=query.shape, count=1, ms=round(query.ms, 2),
+                    template=query.template, frame=query.frame,
+                ))
+
+        by_shape = defaultdict(list)
+        for query in self.queries:
+            by_shape[query.shape].append(query)
+        for shape, queries in by_shape.items():
+            if len(queries) < settings.QUERY_REPEAT_LIMIT:
+                continue
+            # the lookup in a loop is the site most of the repeats come from
+            (template, frame), _ = Counter((q.template, q.frame) for q in queries).most_common(1)[0]
+            findings.append(dict(
+                base, kind='repeated', sql=shape, count=len(queries),
+                ms=round(sum(query.ms for query in queries), 2),
+                template=template, frame=frame,
+            ))
+        return findings
+
+
+@contextmanager
+def inspect_queries(request=None):
+    inspector = QueryInspector(request)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(inspector))
+        yield inspector
+
+
+def log_findings(findings):
+    if not findings:
+        return
+    for finding in findings:
+        logger.info(
+            '%s query in %s (%s x, %s ms) at %s',
+            finding['kind'], finding['view'], finding['count'], finding['ms'],
+            finding['template'] or finding['frame'],
+        )
+    path = settings.QUERY_FINDINGS_LOG
+    if not path:
+        return
+    lines = ''.join(json.dumps(finding) + '\n' for finding in findings)
+    with _log_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as log:
+            log.write(lines)
+
+
+def read_findings(path):
+    with open(path) as log:
+        for line in log:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,240 @@
+"""
+Full-text search over groups, posts, comments and replies, backed by the
+SQLite FTS5 table `forum_search` created in migration 0007.
+
+The index only ever holds visible content: hiding a post, comment or reply
+removes it (and everything under it) and unhiding puts it back. Group
+privacy is checked at query time, since it can change without touching
+the indexed rows.
+"""
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, Group, Post, Reply
+
+
+SearchHit = namedtuple('SearchHit', ['kind', 'object'])
+
+KINDS = {
+    'group': Group,
+    'post': Post,
+    'comment': Comment,
+    'reply': Reply,
+}
+
+
+class SearchPage:
+
+    def __init__(self, hits, number, has_next):
+        self.hits = hits
+        self.number = number
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def _object_id(pk):
+    # store ids the way Django stores them in the source tables
+    return pk.hex if hasattr(pk, 'hex') else str(pk)
+
+
+def _delete(cursor, kind, object_ids):
+    if not object_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(object_ids))
+    cursor.execute(
+        f"DELETE FROM forum_search WHERE kind = %s AND object_id IN ({placeholders})",
+        [kind, *object_ids]
+    )
+
+
+def _insert(cursor, rows):
+    if rows:
+        cursor.executemany(
+            "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows
+        )
+
+
+def index_group(group):
+    with connection.cursor() as cursor:
+        _delete(cursor, 'group', [str(group.pk)])
+        _insert(cursor, [('group', str(group.pk), group.pk, None, group.name, group.description or '')])
+
+
+def index_replies(replies, post):
+    replies = list(replies)
+    with connection.cursor() as cursor:
+        _delete(cursor, 'reply', [str(reply.pk) for reply in replies])
+        if post.is_hidden:
+            return
+        _insert(cursor, [
+            ('reply', str(reply.pk), post.group_id, _object_id(post.pk), '', reply.content)
+            for reply in replies
+            if not reply.is_hidden and not reply.comment.is_hidden
+        ])
+
+
+def index_comment(comment):
+    post = comment.post
+    with connection.cursor() as cursor:
+        _delete(cursor, 'comment', [str(comment.pk)])
+        if not comment.is_hidden and not post.is_hidden:
+            _insert(cursor, [
+                ('comment', str(comment.pk), post.group_id, _object_id(post.pk), '', comment.content)
+            ])
+    index_replies(Reply.objects.filter(comment=comment).select_related('comment'), post)
+
+
+def index_post(post):
+    post_id = _object_id(post.pk)
+    with connection.cursor() as cursor:
+        _delete(cursor, 'post', [post_id])
+        if not post.is_hidden:
+            _insert(cursor, [
+                ('post', post_id, post.group_id, post_id, post.title or '', post.content)
+            ])
+        comments = list(Comment.objects.filter(post=post))
+        _delete(cursor, 'comment', [str(comment.pk) for comment in comments])
+        if not post.is_hidden:
+            _insert(cursor, [
+                ('comment', str(comment.pk), post.group_id, post_id, '', comment.content)
+                for comment in comments
+                if not comment.is_hidden
+            ])
+    index_replies(Reply.objects.filter(comment__post=post).select_related('comment'), post)
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM forum_search")
+        cursor.execute(
+            "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+            "SELECT 'group', CAST(id AS TEXT), id, NULL, name, COALESCE(description, '') FROM forum_group"
+        )
+        cursor.execute(
+            "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+            "SELECT 'post', id, group_id, id, COALESCE(title, ''), content "
+            "FROM forum_post WHERE NOT is_hidden"
+        )
+        cursor.execute(
+            "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+            "SELECT 'comment', CAST(c.id AS TEXT), p.group_id, p.id, '', c.content "
+            "FROM forum_comment c JOIN forum_post p ON p.id = c.post_id "
+            "WHERE NOT c.is_hidden AND NOT p.is_hidden"
+        )
+        cursor.execute(
+            "INSERT INTO forum_search (kind, object_id, group_id, post_id, title, body) "
+            "SELECT 'reply', CAST(r.id AS TEXT), p.group_id, p.id, '', r.content "
+            "FROM forum_reply r JOIN forum_comment c ON c.id = r.comment_id "
+            "JOIN forum_post p ON p.id = c.post_id "
+            "WHERE NOT r.is_hidden AND NOT c.is_hidden AND NOT p.is_hidden"
+        )
+
+
+def _match_expression(query):
+    # quote every term so user input can't be read as FTS5 syntax
+    terms = ['"{}"'.format(term.replace('"', '""')) for term in query.split()]
+    return ' '.join(terms)
+
+
+def search(user, query, kinds=None, page=1, per_page=10):
+    """
+    Returns a page of hits for query ranked by BM25, with titles weighted
+    above bodies. Posts, comments and replies only match in public groups
+    or groups the user is an approved member of.
+    """
+    expression = _match_expression(query)
+    kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+    if not expression or not kinds:
+        return SearchPage([], page, False)
+
+    placeholders = ', '.join(['%s'] * len(kinds))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT kind, object_id FROM forum_search "
+            "WHERE forum_search MATCH %s "
+            f"AND kind IN ({placeholders}) "
+            "AND (kind = 'group' OR group_id IN ("
+            "    SELECT id FROM forum_group WHERE privacy = 'public' "
+            "    UNION SELECT group_id FROM forum_membership "
+            "    WHERE user_id = %s AND is_approved"
+            ")) "
+            "ORDER BY bm25(forum_search, 0, 0, 0, 0, 10.0, 1.0) "
+            "LIMIT %s OFFSET %s",
+            [expression, *kinds, user.id, per_page + 1, (page - 1) * per_page]
+        )
+        rows = cursor.fetchall()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    ids_by_kind = {}
+    for kind, object_id in rows:
+        ids_by_kind.setdefault(kind, []).append(object_id)
+    objects = {}
+    for kind, ids in ids_by_kind.items():
+        queryset = KINDS[kind].objects.filter(pk__in=ids)
+        if kind == 'post':
+            queryset = queryset.select_related('author', 'group')
+        elif kind == 'comment':
+            queryset = queryset.select_related('author', 'post__group')
+        elif kind == 'reply':
+            queryset = queryset.select_related('author', 'comment__post__group')
+        for obj in queryset:
+            objects[(kind, _object_id(obj.pk))] = obj
+
+    hits = [
+        SearchHit(kind, objects[(kind, object_id)])
+        for kind, object_id in rows
+        if (kind, object_id) in objects
+    ]
+    return SearchPage(hits, page, has_next)
+
+
+@receiver(post_save, sender=Group)
+def index_saved_group(sender, instance, **kwargs):
+    index_group(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, **kwargs):
+    index_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+def index_saved_comment(sender, instance, **kwargs):
+    index_comment(instance)
+
+
+@receiver(post_save, sender=Reply)
+def index_saved_reply(sender, instance, **kwargs):
+    index_replies([instance], instance.comment.post)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Reply)
+def unindex_deleted(sender, instance, **kwargs):
+    with connection.cursor() as cursor:
+        _delete(cursor, sender.__name__.lower(), [_object_id(instance.pk)])
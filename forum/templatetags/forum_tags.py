@@ -1,5 +1,8 @@
 from django import template
 
+from ..access import resolve_group_access
+from ..fragments import like_slot, liked_by_slot, since_slot
+
 register = template.Library()
 
 
@@ -11,9 +14,38 @@ def filter_query(value, arg):
 
 
 def latest_post(value):
-    return value.first()
+    # value is a group; its newest post is kept on the group itself
+    return value.last_post
 
 
 register.filter('filter_query', filter_query)
 register.filter('latest_post', latest_post)
-
+# open slots in cached post HTML, filled in per request by forum.fragments
+register.simple_tag(like_slot)
+register.simple_tag(liked_by_slot)
+register.simple_tag(since_slot)
+
+
+@register.inclusion_tag('forum/includes/group_header.html', takes_context=True)
+def group_header(context, group):
+    """
+    The cover, name, join button and tabs of a group page. All but the join
+    button are cached per group version and vary only with the viewer's role.
+    """
+    request = context['request']
+    access = resolve_group_access(request, group.slug)
+    return {
+        'request': request,
+        'csrf_token': context.get('csrf_token'),
+        'group': group,
+        'access': access,
+        'is_owner': request.user.id == group.owner_id,
+        'can_see_members': group.privacy == 'public' or access.is_member,
+    }
+
+
+@register.inclusion_tag('forum/includes/group_members.html')
+def group_members(group):
+    # only read when the cached widget has to be rendered again
+    memberships = group.member.filter(is_approved=True, is_suspended=False).select_related('user')[:6]
+    return {'group': group, 'memberships': memberships}
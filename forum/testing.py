@@ -0,0 +1,275 @@
+"""
+Helpers shared by the test suites of forum, polls, event and accounts.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern
+from django.utils import timezone
+
+from accounts.models import Account, UserProfile
+from event.models import Event
+from polls.models import Choice, Poll, Vote
+
+from .metrics import REGISTRY
+from .models import Comment, Group, Membership, Post, Reply
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the suites with the shared cache tier in memory and the files the
+    query inspector, metrics, tracing and push write in a directory of the
+    run's own, so a run neither writes into the working tree nor reads what
+    a dev server left there.
+    """
+    files = {
+        'QUERY_FINDINGS_LOG': 'query_findings.jsonl',
+        'METRICS_DIR': 'metrics',
+        'TRACE_LOG': 'traces.jsonl',
+        'PUSH_DATABASE': 'push.sqlite3',
+    }
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.files_dir = tempfile.mkdtemp(prefix='shareit-tests-')
+        self.isolated = override_settings(
+            CACHES={
+                'default': settings.CACHES['default'],
+                'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            },
+            **{name: os.path.join(self.files_dir, file) for name, file in self.files.items()}
+        )
+        self.isolated.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        # forum.metrics would flush what's left to the real METRICS_DIR at exit
+        REGISTRY.clear()
+        REGISTRY.dirty = False
+        self.isolated.disable()
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+
+def create_user(username, **kwargs):
+    user = Account.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password'
+    )
+    # accounts are inactive until the email is confirmed
+    user.is_active = True
+    for field, value in kwargs.items():
+        setattr(user, field, value)
+    user.save()
+    return user
+
+
+def create_sample_group(posts=3, members=2, polls=1, events=1, name='Sample group', privacy='public'):
+    """
+    Creates a group with an owner, approved members and a pending request,
+    posts with a comment and a reply each, polls the members voted on and
+    events, and returns them in a dict.
+    """
+    owner = create_user(f'{name.lower().replace(" ", "")}owner')
+    group = Group.objects.create(name=name, owner=owner, privacy=privacy)
+    Membership.objects.create(group=group, user=owner, is_approved=True, role=Membership.OWNER)
+    users = []
+    for i in range(members):
+        user = create_user(f'{group.slug}member{i}')
+        Membership.objects.create(group=group, user=user, is_approved=True)
+        users.append(user)
+    pending = create_user(f'{group.slug}pending')
+    Membership.objects.create(group=group, user=pending)
+    UserProfile.objects.get_or_create(user=owner)
+
+    post_list = []
+    for i in range(posts):
+        post = Post.objects.create(
+            title=f'Post {i}', content=f'post number {i}', author=owner, group=group
+        )
+        comment = Comment.objects.create(post=post, content='a comment', author=owner)
+        Reply.objects.create(comment=comment, content='a reply', author=owner)
+        post_list.append(post)
+
+    poll_list = []
+    for i in range(polls):
+        poll = Poll.objects.create(
+            poll_text=f'Poll {i}',
+            poll_author=owner,
+            group=group,
+            start_date=date.today() - timedelta(days=1),
+            end_date=date.today() + timedelta(days=1)
+        )
+        choice = Choice.objects.create(poll=poll, choice_text='yes')
+        Choice.objects.create(poll=poll, choice_text='no')
+        for user in users[1:]:
+            Vote.objects.create(poll=poll, voter=user, choice=choice)
+        poll_list.append(poll)
+
+    now = timezone.now()
+    event_list = []
+    for i in range(events):
+        event = Event.objects.create(
+            group=group,
+            host=owner,
+            name=f'{name} event {i}',
+            description='an event',
+            location='online',
+            start_date_time=now + timedelta(days=i + 1),
+            end_date_time=now + timedelta(days=i + 1, hours=2)
+        )
+        event.confirmed_invitees.add(*users)
+        event_list.append(event)
+    return {
+        'owner': owner,
+        'group': group,
+        'members': users,
+        'pending': pending,
+        'posts': post_list,
+        'polls': poll_list,
+        'poll': poll_list[0] if poll_list else None,
+        'choice': poll_list[0].choice_set.first() if poll_list else None,
+        'events': event_list,
+        'event': event_list[0] if event_list else None,
+    }
+
+
+# "SCAN forum_post" reads every row; "SCAN forum_post USING INDEX ..." and
+# "SEARCH ..." don't, and neither does scanning a subquery or the FTS table
+FULL_SCAN = re.compile(r'^SCAN (?P<table>\w+)$')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class QueryPlanMixin:
+    """
+    Checks the plan of every SELECT a request runs and fails when SQLite
+    would read a whole table to answer it.
+    """
+    # tables a view reads in full by design
+    scan_allowed = ()
+
+    def full_scans(self, queries):
+        scans = []
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            for detail in explain(sql):
+                match = FULL_SCAN.match(detail)
+                if match and match.group('table') not in self.scan_allowed:
+                    scans.append((detail, sql))
+        return scans
+
+    def assertNoFullScans(self, url, method='get', **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 500)
+        scans = self.full_scans(context.captured_queries)
+        self.assertFalse(scans, '\n'.join(
+            f'{url}: {detail}\n    {sql}' for detail, sql in scans
+        ))
+        return response
+
+
+class ViewRequest(namedtuple('ViewRequest', ['name', 'url', 'method', 'data', 'user'])):
+    __slots__ = ()
+
+    def __new__(cls, name, url, method='get', data=None, user=None):
+        return super().__new__(cls, name, url, method, data, user)
+
+
+class QueryBudgetMixin:
+    """
+    Requests every URL of an app at two data scales and fails when a view's
+    query count grows with the data or when it goes over its budget.
+
+    Subclasses set urlconf to the app's urls module, budgets to a dict of
+    URL name -> (max queries, max milliseconds) and return one ViewRequest
+    per URL name from view_requests(). Set VIEW_BUDGET_REPORT to a file
+    path to append the measurements to it as JSON lines.
+    """
+    urlconf = None
+    budgets = {}
+    # create_sample_group arguments for the small and the large dataset
+    scales = (
+        {'posts': 3, 'members': 2, 'polls': 1, 'events': 1},
+        {'posts': 40, 'members': 30, 'polls': 8, 'events': 8},
+    )
+
+    def view_requests(self, sample):
+        raise NotImplementedError
+
+    def url_names(self):
+        return {
+            pattern.name
+            for pattern in import_module(self.urlconf).urlpatterns
+            if isinstance(pattern, URLPattern) and pattern.name
+        }
+
+    def measure(self, view_request, sample):
+        self.client.force_login(view_request.user or sample['owner'])
+        request = getattr(self.client, view_request.method)
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = request(view_request.url, data=view_request.data, HTTP_REFERER='/')
+            elapsed = (time.perf_counter() - start) * 1000
+        self.assertLess(response.status_code, 500, view_request.url)
+        return len(context.captured_queries), elapsed
+
+    def test_view_budgets(self):
+        measurements = {}
+        for arguments in self.scales:
+            savepoint = transaction.savepoint()
+            sample = create_sample_group(**arguments)
+            view_requests = self.view_requests(sample)
+            self.assertEqual({view_request.name for view_request in view_requests}, self.url_names())
+            for view_request in view_requests:
+                measurements.setdefault(view_request.name, []).append(
+                    self.measure(view_request, sample)
+                )
+            transaction.savepoint_rollback(savepoint)
+
+        self.report(measurements)
+        for name, ((small_queries, small_ms), (large_queries, large_ms)) in measurements.items():
+            max_queries, max_ms = self.budgets[name]
+            self.assertLessEqual(
+                large_queries, small_queries,
+                f'{name} runs {small_queries} queries on the small dataset '
+                f'and {large_queries} on the large one'
+            )
+            self.assertLessEqual(
+                max(small_queries, large_queries), max_queries,
+                f'{name} is over its query budget'
+            )
+            self.assertLessEqual(max(small_ms, large_ms), max_ms, f'{name} is over its time budget')
+
+    def report(self, measurements):
+        path = os.environ.get('VIEW_BUDGET_REPORT')
+        if not path:
+            return
+        with open(path, 'a') as report:
+            for name, scales in measurements.items():
+                report.write(json.dumps({
+                    'view': f'{self.urlconf}:{name}',
+                    'budget': self.budgets[name],
+                    'scales': [
+                        {'queries': queries, 'ms': round(elapsed, 2)}
+                        for queries, elapsed in scales
+                    ],
+                }) + '\n')
@@ -1,3 +1,1086 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from notifications.models import Notification
+from notifications.signals import notify
+
+from accounts.models import Account
+from event.models import Event
+from polls.models import Choice, Poll, Vote
+
+from . import fanout, push
+from .cache import LocalTier, cached_for_group
+from .fragments import post_key
+from .inbox import mark_all_read
+from .metrics import REGISTRY, writes
+from .models import Comment, FeedEntry, Group, Membership, NotificationFanout, Post, Reply
+from .perf import stats
+from .querylog import inspect_queries, read_findings
+from .search import rebuild_index, search
+from .tracing import read_traces
+from .testing import (
+    QueryBudgetMixin, QueryPlanMixin, ViewRequest, create_sample_group, create_user, explain
+)
+
+
+class FeedBackfillTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=3)
+
+    def feed(self, user):
+        return FeedEntry.objects.filter(user=user, group=self.sample['group'])
+
+    def test_backfill_runs_when_the_membership_is_approved(self):
+        pending = Membership.objects.get(user=self.sample['pending'])
+        self.assertFalse(self.feed(pending.user).exists())
+        pending.is_approved = True
+        pending.save()
+        self.assertEqual(self.feed(pending.user).count(), 3)
+
+    def test_later_saves_dont_backfill(self):
+        member = Membership.objects.get(user=self.sample['members'][0])
+        self.feed(member.user).delete()
+        member.role = Membership.ADMIN
+        member.save()
+        Membership.objects.get(id=member.id).save()
+        self.assertFalse(self.feed(member.user).exists())
+
+
+class GroupSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=3)
+
+    def summary(self):
+        return Group.objects.filter(id=self.sample['group'].id).values(
+            'member_count', 'pending_count', 'post_count', 'last_post_id'
+        ).get()
+
+    def assertSummaryRecounts(self):
+        summary = self.summary()
+        Group.objects.filter(id=self.sample['group'].id).refresh_summary()
+        self.assertEqual(summary, self.summary())
+
+    def test_membership_writes_move_the_counts(self):
+        pending = Membership.objects.get(user=self.sample['pending'])
+        pending.is_approved = True
+        pending.save()
+        self.assertSummaryRecounts()
+        Membership.objects.get(user=self.sample['members'][0]).delete()
+        Membership.objects.create(group=self.sample['group'], user=create_user('summaryjoiner'))
+        self.assertEqual(self.summary()['member_count'], 3)
+        self.assertEqual(self.summary()['pending_count'], 1)
+        self.assertSummaryRecounts()
+
+    def test_post_writes_move_the_counts(self):
+        newest = self.sample['posts'][-1]
+        newest.is_hidden = True
+        newest.save()
+        self.assertEqual(self.summary()['last_post_id'], self.sample['posts'][-2].id)
+        self.assertSummaryRecounts()
+        newest.is_hidden = False
+        newest.save()
+        self.sample['posts'][0].delete()
+        self.assertEqual(self.summary()['post_count'], 2)
+        self.assertSummaryRecounts()
+
+    def test_post_write_doesnt_recount(self):
+        with CaptureQueriesContext(connection) as queries:
+            Post.objects.create(
+                title='Counted', content='incrementally', author=self.sample['owner'], group=self.sample['group']
+            )
+        [update] = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "forum_group"')]
+        self.assertNotIn('COUNT(', update)
+        self.assertSummaryRecounts()
+
+
+class SearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=1)
+        cls.comment = cls.sample['posts'][0].comments.first()
+
+    def matches(self, query):
+        return [hit.object for hit in search(self.sample['owner'], query, kinds=['comment'])]
+
+    def test_rebuilt_index_follows_edits_and_deletes(self):
+        rebuild_index()
+        self.assertEqual(self.matches('comment'), [self.comment])
+
+        self.comment.content = 'an edited remark'
+        self.comment.save()
+        self.assertEqual(self.matches('comment'), [])
+        self.assertEqual(self.matches('remark'), [self.comment])
+
+        self.comment.delete()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM forum_search WHERE kind = 'comment'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class ForumQueryPlanTests(QueryPlanMixin, TestCase):
+    # the group list shows every group
+    scan_allowed = ('forum_group',)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=12)
+        create_sample_group(name='Other group', privacy='private')
+        cls.owner = cls.sample['owner']
+        cls.group = cls.sample['group']
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_feed(self):
+        self.assertNoFullScans(reverse('forum:home'))
+
+    def test_feed_reads_large_groups_off_their_index(self):
+        def feed_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('forum:home'))
+            self.assertEqual(len(response.context['post_feed']), 10)
+            return [query['sql'] for query in context.captured_queries if 'FROM "forum_post"' in query['sql']]
+
+        large = [self.group]
+        for name in ['Large group', 'Larger group']:
+            other = create_sample_group(name=name, posts=3)['group']
+            Membership.objects.create(group=other, user=self.owner, is_approved=True)
+            large.append(other)
+        Group.objects.filter(id__in=[group.id for group in large[:2]]).update(fanout_on_read=True)
+        two_groups = feed_queries()
+        Group.objects.filter(id=large[2].id).update(fanout_on_read=True)
+        three_groups = feed_queries()
+
+        # one query however many large groups, reading a page off each
+        # group's index and sorting only those
+        self.assertEqual(len(three_groups), len(two_groups))
+        [plan] = [explain(sql) for sql in three_groups if 'UNION ALL' in sql]
+        self.assertEqual(sum('USING INDEX post_group_stream_idx' in detail for detail in plan), 3)
+        self.assertEqual(sum('TEMP B-TREE' in detail for detail in plan), 1)
+
+    def test_group_list(self):
+        self.assertNoFullScans(reverse('forum:groups'))
+
+    def test_group_search(self):
+        self.assertNoFullScans(reverse('forum:groups') + '?query=sample')
+
+    def test_search(self):
+        self.assertNoFullScans(reverse('forum:search') + '?query=post')
+
+    def test_group_detail(self):
+        response = self.assertNoFullScans(reverse('forum:group-detail', args=[self.group.slug]))
+        self.assertNoFullScans(
+            reverse('forum:group-posts', args=[self.group.slug])
+            + '?before=' + response.context['post_page'].older_cursor
+        )
+
+    def test_group_about(self):
+        self.assertNoFullScans(reverse('forum:group-about', args=[self.group.slug]))
+
+    def test_group_edit(self):
+        self.assertNoFullScans(reverse('forum:group-edit', args=[self.group.slug]))
+
+    def test_members(self):
+        self.assertNoFullScans(reverse('forum:members', args=[self.group.slug]))
+
+    def test_create_post(self):
+        self.assertNoFullScans(
+            reverse('forum:create-post', args=[self.group.slug]),
+            method='post',
+            data={'content': 'hello'}
+        )
+
+    def test_like_post(self):
+        post = self.sample['posts'][0]
+        self.assertNoFullScans(
+            reverse('forum:like-post', args=[self.group.slug, post.id]),
+            HTTP_REFERER='/'
+        )
+
+    def test_join_leave(self):
+        user = create_user('joiner')
+        self.client.force_login(user)
+        url = reverse('forum:join-leave', args=[self.group.slug, user.id])
+        self.assertNoFullScans(url, method='post', HTTP_REFERER='/')
+        self.assertNoFullScans(url, method='post', HTTP_REFERER='/')
+
+    def test_approve_join_request(self):
+        self.assertNoFullScans(
+            reverse('forum:approve_join_request', args=[self.group.slug, self.sample['pending'].id]),
+            HTTP_REFERER='/'
+        )
+
+
+class ForumQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'forum.urls'
+    budgets = {
+        'home': (5, 300),
+        'group-create': (3, 300),
+        'groups': (5, 300),
+        'search': (5, 300),
+        'perf': (3, 200),
+        'metrics': (3, 200),
+        'mark-all-notifications-read': (4, 200),
+        'unread-notification-count': (2, 200),
+        'group-detail': (11, 300),
+        'group-about': (4, 300),
+        'group-edit': (4, 300),
+        'members': (7, 300),
+        'join-leave': (13, 200),
+        'approve_join_request': (12, 200),
+        'reject_join_request': (4, 200),
+        'suspend-member': (8, 200),
+        'remove-member': (7, 200),
+        'make-admin': (7, 200),
+        'group-posts': (7, 300),
+        'create-post': (12, 200),
+        'like-post': (16, 200),
+        'hide-post': (11, 200),
+        'add-comment': (10, 200),
+        'like-comment': (16, 200),
+        'hide-comment': (10, 200),
+        'add-reply': (15, 200),
+        'like-reply': (16, 200),
+        'hide-reply': (9, 200),
+        'notification-fanout': (3, 200),
+    }
+
+    def view_requests(self, sample):
+        slug = sample['group'].slug
+        members = sample['members']
+        post = sample['posts'][0]
+        comment = post.comments.first()
+        reply = comment.replies.first()
+        post_args = [slug, post.id]
+        comment_args = [slug, post.id, comment.id]
+        reply_args = [slug, post.id, comment.id, reply.id]
+        joiner = create_user(f'{slug}joiner')
+        invites = NotificationFanout.objects.create(
+            group=sample['group'], audience=NotificationFanout.MEMBERS, actor=sample['owner'], verb='ping'
+        )
+        return [
+            ViewRequest('home', reverse('forum:home')),
+            ViewRequest('group-create', reverse('forum:group-create')),
+            ViewRequest('groups', reverse('forum:groups')),
+            ViewRequest('search', reverse('forum:search'), data={'query': 'post'}),
+            ViewRequest('perf', reverse('forum:perf')),
+            ViewRequest('metrics', reverse('forum:metrics')),
+            ViewRequest('mark-all-notifications-read', reverse('forum:mark-all-notifications-read')),
+            ViewRequest('unread-notification-count', reverse('forum:unread-notification-count')),
+            ViewRequest('notification-fanout', reverse('forum:notification-fanout', args=[slug, invites.id])),
+            ViewRequest('group-detail', reverse('forum:group-detail', args=[slug])),
+            ViewRequest('group-about', reverse('forum:group-about', args=[slug])),
+            ViewRequest('group-edit', reverse('forum:group-edit', args=[slug])),
+            ViewRequest('members', reverse('forum:members', args=[slug])),
+            ViewRequest('group-posts', reverse('forum:group-posts', args=[slug])),
+            ViewRequest(
+                'join-leave', reverse('forum:join-leave', args=[slug, joiner.id]),
+                method='post', user=joiner
+            ),
+            ViewRequest(
+                'reject_join_request',
+                reverse('forum:reject_join_request', args=[slug, joiner.id]),
+                method='post'
+            ),
+            ViewRequest(
+                'approve_join_request',
+                reverse('forum:approve_join_request', args=[slug, sample['pending'].id]),
+                method='post'
+            ),
+            ViewRequest(
+                'suspend-member', reverse('forum:suspend-member', args=[slug, members[0].id]),
+                method='post'
+            ),
+            ViewRequest(
+                'make-admin', reverse('forum:make-admin', args=[slug, members[1].id]),
+                method='post'
+            ),
+            ViewRequest(
+                'remove-member', reverse('forum:remove-member', args=[slug, members[1].id]),
+                method='post'
+            ),
+            ViewRequest(
+                'create-post', reverse('forum:create-post', args=[slug]),
+                method='post', data={'content': 'a new post'}
+            ),
+            ViewRequest('like-post', reverse('forum:like-post', args=post_args)),
+            ViewRequest(
+                'add-comment', reverse('forum:add-comment', args=post_args),
+                method='post', data={'content': 'a new comment'}
+            ),
+            ViewRequest('like-comment', reverse('forum:like-comment', args=comment_args)),
+            ViewRequest(
+                'add-reply', reverse('forum:add-reply', args=comment_args),
+                method='post', data={'content': 'a new reply'}
+            ),
+            ViewRequest('like-reply', reverse('forum:like-reply', args=reply_args)),
+            ViewRequest('hide-reply', reverse('forum:hide-reply', args=reply_args), method='post'),
+            ViewRequest('hide-comment', reverse('forum:hide-comment', args=comment_args), method='post'),
+            ViewRequest('hide-post', reverse('forum:hide-post', args=post_args), method='post'),
+        ]
+
+
+@override_settings(PERF_SAMPLE_RATE=1)
+class PerformanceMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+        cls.staff = create_user('staff', is_staff=True)
+
+    def setUp(self):
+        stats.clear()
+        self.client.force_login(self.sample['owner'])
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('forum:group-detail', args=[self.sample['group'].slug]))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+
+    def test_rolling_stats(self):
+        url = reverse('forum:group-detail', args=[self.sample['group'].slug])
+        for _ in range(3):
+            self.client.get(url)
+        summary = stats.summary()['forum:group-detail']
+        self.assertEqual(summary['requests'], 3)
+        self.assertGreater(summary['sql_count'], 0)
+        self.assertGreater(summary['template_ms'], 0)
+        self.assertLessEqual(summary['sql_ms'] + summary['template_ms'], summary['total_ms']['max'] * 3)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.client.get(reverse('forum:home'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(stats.summary(), {})
+
+    def test_stats_are_staff_only(self):
+        self.client.get(reverse('forum:home'))
+        self.assertEqual(self.client.get(reverse('forum:perf')).status_code, 403)
+        self.client.force_login(self.staff)
+        summary = self.client.get(reverse('forum:perf')).json()
+        self.assertEqual(summary['forum:home']['requests'], 1)
+
+
+@override_settings(QUERY_INSPECTION_SAMPLE_RATE=1, QUERY_REPEAT_LIMIT=5, SLOW_QUERY_MS=100)
+class QueryInspectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=6)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'findings.jsonl')
+
+    def repeated(self, inspector):
+        return [finding for finding in inspector.findings() if finding['kind'] == 'repeated']
+
+    def test_repeated_lookup_in_template(self):
+        template = Template('{% for post in posts %}\n{{ post.author.username }}{% endfor %}')
+        posts = list(Post.objects.all())
+        with inspect_queries() as inspector:
+            template.render(Context({'posts': posts}))
+        [finding] = self.repeated(inspector)
+        self.assertEqual(finding['count'], 6)
+        self.assertEqual(finding['template'], '<unknown source>:2')
+        self.assertIn('"accounts_account"', finding['sql'])
+
+    def test_repeated_lookup_in_python(self):
+        with inspect_queries() as inspector:
+            for post in Post.objects.all():
+                post.author.username
+        [finding] = self.repeated(inspector)
+        self.assertIsNone(finding['template'])
+        self.assertRegex(finding['frame'], r'^forum/tests\.py:\d+ in test_repeated_lookup_in_python$')
+
+    def test_select_related_is_not_flagged(self):
+        with inspect_queries() as inspector:
+            for post in Post.objects.select_related('author'):
+                post.author.username
+        self.assertEqual(inspector.findings(), [])
+
+    def test_middleware_logs_findings_for_report(self):
+        self.client.force_login(self.sample['owner'])
+        url = reverse('forum:group-detail', args=[self.sample['group'].slug])
+        with self.settings(SLOW_QUERY_MS=0, QUERY_FINDINGS_LOG=self.log):
+            self.client.get(url)
+        findings = list(read_findings(self.log))
+        self.assertTrue(findings)
+        self.assertEqual({finding['view'] for finding in findings}, {'forum:group-detail'})
+        self.assertTrue(any(finding['template'] for finding in findings))
+
+        out = StringIO()
+        call_command('query_report', log=self.log, kind='slow', json=True, stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertTrue(summary)
+        self.assertEqual(sum(row['queries'] for row in summary), len(findings))
+
+
+class MetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = self.settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        REGISTRY.clear()
+        self.addCleanup(REGISTRY.clear)
+        self.client.force_login(self.sample['owner'])
+
+    def scrape(self):
+        response = self.client.get(reverse('forum:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_histograms(self):
+        slug = self.sample['group'].slug
+        self.client.get(reverse('forum:group-detail', args=[slug]))
+        text = self.scrape()
+        self.assertIn('# TYPE shareit_request_duration_seconds histogram', text)
+        self.assertIn(
+            'shareit_request_duration_seconds_bucket'
+            '{le="+Inf",status="200",url_name="forum:group-detail"} 1.0', text
+        )
+        self.assertIn('shareit_request_queries_count{url_name="forum:group-detail"} 1.0', text)
+
+    def test_write_counters(self):
+        post = self.sample['posts'][0]
+        self.client.get(reverse('forum:like-post', args=[self.sample['group'].slug, post.id]))
+        Post.objects.create(content='another', author=self.sample['owner'], group=self.sample['group'])
+        text = self.scrape()
+        self.assertIn('shareit_writes_total{kind="like"} 1.0', text)
+        self.assertIn('shareit_writes_total{kind="post"} 1.0', text)
+
+    def test_cache_hit_ratio_and_queue_gauges(self):
+        cache.set('metrics-test', 1)
+        cache.get('metrics-test')
+        cache.get('metrics-test-missing')
+        text = self.scrape()
+        self.assertIn('shareit_cache_hit_ratio 0.5', text)
+        self.assertRegex(text, r'shareit_notifications_unread \d+\.0')
+        self.assertIn('shareit_emails_in_flight 0.0', text)
+
+    def test_samples_of_other_processes_are_added(self):
+        writes.inc(kind='vote')
+        # a process that has exited: its counters still count, its live gauges don't
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        with open(os.path.join(self.directory, f'{int(finished.stdout)}.json'), 'w') as file:
+            json.dump({
+                'samples': [['shareit_writes_total', [['kind', 'vote']], 2]],
+                'live': [['shareit_emails_in_flight', [], 3]],
+            }, file)
+        text = self.scrape()
+        self.assertIn('shareit_writes_total{kind="vote"} 3.0', text)
+        self.assertIn('shareit_emails_in_flight 0.0', text)
+
+    def test_access(self):
+        with self.settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(reverse('forum:metrics')).status_code, 403)
+            self.client.force_login(create_user('metricsstaff', is_staff=True))
+            self.assertEqual(self.client.get(reverse('forum:metrics')).status_code, 200)
+
+
+class TracingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'traces.jsonl')
+        settings = self.settings(TRACE_SAMPLE_RATE=1, TRACE_LOG=self.log)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.sample['members'][0])
+
+    def trace(self):
+        [spans] = read_traces(self.log)
+        return spans
+
+    def assertTree(self, spans):
+        ids = {span['spanId'] for span in spans}
+        [root] = [span for span in spans if 'parentSpanId' not in span]
+        self.assertEqual({span['traceId'] for span in spans}, {root['traceId']})
+        for span in spans:
+            self.assertTrue(span.get('parentSpanId', root['spanId']) in ids)
+            self.assertLessEqual(int(span['startTimeUnixNano']), int(span['endTimeUnixNano']))
+        return root
+
+    def children(self, spans, parent):
+        return [span for span in spans if span.get('parentSpanId') == parent['spanId']]
+
+    def test_group_detail(self):
+        self.client.get(reverse('forum:group-detail', args=[self.sample['group'].slug]))
+        spans = self.trace()
+        root = self.assertTree(spans)
+        self.assertEqual(root['name'], 'GET forum:group-detail')
+        [view] = [span for span in spans if span['name'] == 'view GroupDetailView']
+        self.assertEqual(view['parentSpanId'], root['spanId'])
+        queries = [span for span in spans if span['name'] == 'db.query']
+        self.assertTrue(queries)
+        self.assertTrue(any(query['parentSpanId'] == view['spanId'] for query in queries))
+        templates = {span['spanId']: span for span in spans if span['name'] == 'template.render'}
+        # included templates are rendered inside the page template
+        self.assertTrue(any(span['parentSpanId'] in templates for span in templates.values()))
+
+    @override_settings(CALENDAR_SYNC=False)
+    def test_accept_invite(self):
+        event = self.sample['event']
+        slug = self.sample['group'].slug
+        self.client.post(
+            reverse('forum:event:event-invite', args=[slug, event.id, 'accept']),
+            {'next_url': '/'}
+        )
+        names = [span['name'] for span in self.trace()]
+        self.assertIn('view AcceptInviteView', names)
+        self.assertIn('calendar.sync_event', names)
+
+    def test_notify_send(self):
+        post = self.sample['posts'][0]
+        self.client.get(reverse('forum:like-post', args=[self.sample['group'].slug, post.id]))
+        spans = self.trace()
+        self.assertTree(spans)
+        [notify] = [span for span in spans if span['name'] == 'notify.send']
+        self.assertTrue(any(
+            span['name'] == 'db.query' and span['parentSpanId'] == notify['spanId'] for span in spans
+        ))
+
+    def test_unsampled_requests_are_not_traced(self):
+        with self.settings(TRACE_SAMPLE_RATE=0):
+            self.client.get(reverse('forum:home'))
+        self.assertFalse(os.path.exists(self.log))
+
+
+class TieredCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        cache.local.clear()
+        self.group = self.sample['group']
+
+    def test_local_tier_evicts_least_recently_used(self):
+        tier = LocalTier(2)
+        tier.set('a', 1, None)
+        tier.set('b', 2, None)
+        tier.get('a')
+        tier.set('c', 3, None)
+        self.assertIsNone(tier.get('b'))
+        self.assertEqual(tier.get('a'), (1, None))
+        self.assertEqual(tier.get('c'), (3, None))
+
+    def test_reads_fall_back_to_the_shared_tier(self):
+        caches['shared'].set('tiered-test', 'shared value')
+        self.assertEqual(cache.get('tiered-test'), 'shared value')
+        # now held locally, so the shared tier isn't read again
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get('tiered-test'), 'shared value')
+        cache.delete('tiered-test')
+        self.assertIsNone(cache.get('tiered-test'))
+
+    def assertBumps(self, write):
+        before = Group.objects.get(id=self.group.id).cache_version
+        write()
+        self.assertNotEqual(Group.objects.get(id=self.group.id).cache_version, before)
+
+    def test_writes_move_the_group_version_on(self):
+        owner = self.sample['owner']
+        poll = self.sample['polls'][0]
+        event = self.sample['event']
+        self.assertBumps(lambda: Post.objects.create(content='new', author=owner, group=self.group))
+        self.assertBumps(lambda: Membership.objects.create(group=self.group, user=create_user('cachejoiner')))
+        self.assertBumps(lambda: Vote.objects.create(poll=poll, voter=owner, choice=self.sample['choice']))
+        self.assertBumps(lambda: Poll.objects.filter(id=poll.id).first().save())
+        self.assertBumps(lambda: event.unconfirmed_invitees.add(owner))
+        self.assertBumps(lambda: Event.objects.get(id=event.id).delete())
+
+    def test_cached_for_group(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        group = Group.objects.get(id=self.group.id)
+        self.assertEqual(cached_for_group(group, 'calls', compute), 1)
+        self.assertEqual(cached_for_group(group, 'calls', compute), 1)
+        Post.objects.create(content='new', author=self.sample['owner'], group=group)
+        group.refresh_from_db()
+        self.assertEqual(cached_for_group(group, 'calls', compute), 2)
+
+    def test_poll_list_is_cached_until_a_write(self):
+        self.client.force_login(self.sample['owner'])
+        url = reverse('forum:polls:poll-list', args=[self.group.slug])
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(url)
+        self.assertLess(len(second), len(first))
+        Poll.objects.create(
+            poll_text='A later poll', poll_author=self.sample['owner'], group=self.group,
+            start_date=self.sample['polls'][0].start_date, end_date=self.sample['polls'][0].end_date,
+        )
+        self.assertContains(self.client.get(url), 'A later poll')
+
+
+class GroupHeaderCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        cache.local.clear()
+        self.url = reverse('forum:group-detail', args=[self.sample['group'].slug])
+
+    def header(self, user):
+        self.client.force_login(user)
+        return self.client.get(self.url).content.decode()
+
+    def test_join_button_varies_per_viewer(self):
+        self.assertIn('Leave', self.header(self.sample['members'][0]))
+        self.assertIn('Cancel Request', self.header(self.sample['pending']))
+        self.assertIn('<span> Join </span>', self.header(create_user('headeroutsider')))
+
+    def test_header_is_rendered_once_per_group_version(self):
+        member = self.sample['members'][0]
+        with CaptureQueriesContext(connection) as first:
+            self.header(member)
+        with CaptureQueriesContext(connection) as cached:
+            self.header(member)
+        # the six members in the sidebar aren't read again
+        self.assertTrue([query for query in first if 'LIMIT 6' in query['sql']])
+        self.assertFalse([query for query in cached if 'LIMIT 6' in query['sql']])
+        Membership.objects.create(group=self.sample['group'], user=create_user('headerjoiner'), is_approved=True)
+        count = Group.objects.get(id=self.sample['group'].id).member_count
+        self.assertIn(f'{count} members', self.header(member))
+
+
+class PostFragmentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        cache.local.clear()
+        self.url = reverse('forum:group-detail', args=[self.sample['group'].slug])
+        self.post = self.sample['posts'][0]
+
+    def page(self, user):
+        self.client.force_login(user)
+        return self.client.get(self.url).content.decode()
+
+    def test_writes_move_the_post_version_on(self):
+        member = self.sample['members'][0]
+        comment = self.post.comments.first()
+        for write in [
+            lambda: Comment.objects.create(post=self.post, content='new', author=member),
+            lambda: Reply.objects.create(comment=comment, content='new', author=member),
+            lambda: Comment.objects.filter(id=comment.id).first().save(),
+            lambda: Post.objects.get(id=self.post.id).save(),
+        ]:
+            before = Post.objects.get(id=self.post.id).cache_version
+            write()
+            self.assertNotEqual(Post.objects.get(id=self.post.id).cache_version, before)
+
+    def test_cached_page_skips_the_comment_tree(self):
+        member = self.sample['members'][0]
+        with CaptureQueriesContext(connection) as first:
+            self.page(member)
+        with CaptureQueriesContext(connection) as cached:
+            self.page(member)
+        self.assertTrue([query for query in first if 'FROM "forum_comment"' in query['sql']])
+        self.assertFalse([query for query in cached if 'FROM "forum_comment"' in query['sql']])
+
+    def test_slots_are_filled_per_viewer(self):
+        member, other = self.sample['members']
+        self.post.toggle_like(member)
+        self.page(other)
+        liker = self.page(member)
+        self.assertNotIn('<!--slot:', liker)
+        self.assertIn('Unlike', liker)
+        self.assertIn('Liked by 1 person', liker)
+        self.assertNotIn('Unlike', self.page(other))
+        self.assertIn('minutes ago', liker)
+        # Django masks the token differently each time it's asked for it
+        self.assertRegex(liker, r'/comment" >\s*<input type="hidden" name="csrfmiddlewaretoken" value="\w{64}">')
+
+    def test_hide_controls_are_for_admins(self):
+        self.assertNotIn('Hide Comment', self.page(self.sample['members'][0]))
+        self.assertIn('Hide Comment', self.page(self.sample['owner']))
+
+    def test_other_writes_in_the_group_leave_posts_cached(self):
+        member = self.sample['members'][0]
+        self.page(member)
+        poll = self.sample['polls'][0]
+        Vote.objects.create(poll=poll, voter=member, choice=Choice.objects.filter(poll=poll).first())
+        Post.objects.create(title='Later', content='a later post', author=member, group=self.sample['group'])
+        self.post.toggle_like(member)
+        group = Group.objects.get(id=self.sample['group'].id)
+        keys = [post_key(post, group, 'member') for post in Post.objects.filter(id__in=[
+            post.id for post in self.sample['posts']
+        ])]
+        self.assertEqual(len(cache.get_many(keys)), len(keys))
+        self.assertIn('Liked by 1 person', self.page(member))
+
+    def test_only_admins_can_hide(self):
+        comment = self.post.comments.first()
+        reply = comment.replies.first()
+        slug = self.sample['group'].slug
+        urls = [
+            reverse('forum:hide-post', args=[slug, self.post.id]),
+            reverse('forum:hide-comment', args=[slug, self.post.id, comment.id]),
+            reverse('forum:hide-reply', args=[slug, self.post.id, comment.id, reply.id]),
+        ]
+        self.client.force_login(self.sample['members'][0])
+        for url in urls:
+            self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertFalse(Post.objects.get(id=self.post.id).is_hidden)
+        self.client.force_login(self.sample['owner'])
+        for url in urls:
+            self.assertEqual(self.client.post(url, HTTP_REFERER='/').status_code, 302)
+        self.assertTrue(Post.objects.get(id=self.post.id).is_hidden)
+
+    def test_renamed_group_is_linked_to(self):
+        member = self.sample['members'][0]
+        self.page(member)
+        group = Group.objects.get(id=self.sample['group'].id)
+        group.name = 'Renamed group'
+        group.save()
+        self.url = reverse('forum:group-detail', args=['renamed-group'])
+        page = self.page(member)
+        self.assertIn(f'/group/renamed-group/post/{self.post.id}', page)
+        self.assertNotIn(f'/group/{self.sample["group"].slug}/post/', page)
+
+    def test_new_comment_is_shown(self):
+        member = self.sample['members'][0]
+        self.page(member)
+        Comment.objects.create(post=self.post, content='a later comment', author=member)
+        self.assertIn('a later comment', self.page(member))
+
+
+class NotificationMenuTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def notify(self, count):
+        owner = self.sample['owner']
+        for i in range(count):
+            actor = create_user(f'notifier{Notification.objects.count()}')
+            if i % 3 == 0:
+                notify.send(actor, recipient=owner, verb='requested to join', action_object=self.sample['group'],
+                            description='join request')
+            elif i % 3 == 1:
+                notify.send(actor, recipient=owner, verb='invited you', action_object=self.sample['event'],
+                            description='event invite')
+            else:
+                notify.send(actor, recipient=owner, verb='liked your post')
+
+    def home(self):
+        self.client.force_login(self.sample['owner'])
+        with CaptureQueriesContext(connection) as context:
+            content = self.client.get(reverse('forum:home')).content.decode()
+        return content, len(context.captured_queries)
+
+    def test_dropdown_costs_the_same_for_any_notifications(self):
+        self.notify(1)
+        _, one = self.home()
+        self.notify(3)
+        content, four = self.home()
+        self.assertEqual(four, one + 2)  # the invite event and its group
+        self.notify(4)
+        _, eight = self.home()
+        self.assertEqual(eight, four)
+        self.assertIn(reverse('forum:event:event-invite', args=[
+            self.sample['group'].slug, self.sample['event'].id, 'accept'
+        ]), content)
+
+    def unread(self):
+        return Account.objects.get(id=self.sample['owner'].id).unread_notifications
+
+    def test_counter_follows_the_notifications(self):
+        self.notify(3)
+        self.assertEqual(self.unread(), 3)
+        content, _ = self.home()
+        self.assertIn('<span class="live_notify_badge">3</span>', content)
+        notifications = Notification.objects.filter(recipient=self.sample['owner'])
+        notification = notifications.first()
+        notification.mark_as_read()
+        self.assertEqual(self.unread(), 2)
+        notification.mark_as_unread()
+        self.assertEqual(self.unread(), 3)
+        notification.mark_as_read()
+        notification.save()
+        self.assertEqual(self.unread(), 2)
+        notifications.last().delete()
+        self.assertEqual(self.unread(), 1)
+        self.client.get(reverse('notifications:mark_all_as_read'))
+        self.assertEqual(self.unread(), 0)
+        self.assertIn('<span class="live_notify_badge">0</span>', self.home()[0])
+
+    def test_unread_count_endpoint_revalidates(self):
+        self.notify(2)
+        self.client.force_login(self.sample['owner'])
+        url = reverse('notifications:live_unread_notification_count')
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'unread_count': 2})
+        self.assertIn('no-cache', response['Cache-Control'])
+        with CaptureQueriesContext(connection) as context:
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertFalse([query for query in context if 'notifications_notification' in query['sql']])
+        self.notify(1)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.json(), {'unread_count': 3})
+
+
+@override_settings(PUSH_BACKEND='forum.push.LocalBackend')
+class PushTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+
+    def setUp(self):
+        push.backend.cache_clear()
+        self.addCleanup(push.backend.cache_clear)
+
+    def scope(self, user=None):
+        headers = []
+        if user:
+            self.client.force_login(user)
+            headers.append((b'cookie', f'sessionid={self.client.cookies["sessionid"].value}'.encode()))
+        return {'type': 'http', 'path': settings.PUSH_PATH, 'headers': headers}
+
+    def stream(self, scope, during):
+        """
+        Opens an event stream, runs during() in the test's thread once it's
+        connected, waits for the text during() returns to be sent and
+        returns everything that was.
+        """
+        async def run():
+            received = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            async def until(text, start=0):
+                while not any(text in message.get('body', b'') for message in sent[start:]):
+                    await asyncio.sleep(0.01)
+
+            task = asyncio.ensure_future(push.stream_events(scope, received.get, send))
+            await asyncio.wait_for(until(b'event: unread'), 5)
+            start = len(sent)
+            expected = await sync_to_async(during)()
+            await asyncio.wait_for(until(expected, start), 5)
+            await received.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(task, 5)
+            return sent
+        return async_to_sync(run)()
+
+    def test_stream_pushes_notifications_and_counts(self):
+        owner, member = self.sample['owner'], self.sample['members'][0]
+
+        def notify_owner():
+            with self.captureOnCommitCallbacks(execute=True):
+                notify.send(member, recipient=owner, verb='liked your post')
+            return b'"unread_count": 1'
+
+        sent = self.stream(self.scope(owner), notify_owner)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in sent)
+        self.assertIn(b'event: unread\ndata: {"unread_count": 0}\n\n', body)
+        self.assertIn(b'event: notification\ndata: ', body)
+        self.assertIn(b'liked your post', body)
+
+    def test_other_users_are_not_told(self):
+        owner, member = self.sample['owner'], self.sample['members'][0]
+
+        def notify_both():
+            with self.captureOnCommitCallbacks(execute=True):
+                notify.send(owner, recipient=member, verb='liked your comment')
+                notify.send(member, recipient=owner, verb='liked your post')
+            return b'event: notification'
+
+        body = b''.join(message.get('body', b'') for message in self.stream(self.scope(owner), notify_both))
+        self.assertIn(b'liked your post', body)
+        self.assertNotIn(b'liked your comment', body)
+
+    def test_marking_all_read_pushes_the_count(self):
+        owner = self.sample['owner']
+        notify.send(self.sample['members'][0], recipient=owner, verb='liked your post')
+
+        def read_all():
+            with self.captureOnCommitCallbacks(execute=True):
+                mark_all_read(owner)
+            return b'event: unread\ndata: {"unread_count": 0}'
+
+        body = b''.join(message.get('body', b'') for message in self.stream(self.scope(owner), read_all))
+        self.assertIn(b'event: unread\ndata: {"unread_count": 1}', body)
+
+    def test_stream_needs_a_session(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(push.stream_events)(self.scope(), None, send)
+        self.assertEqual(sent[0]['status'], 403)
+
+    def test_sqlite_backend_relays_other_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'push.sqlite3')
+        publisher, listener = push.SQLiteBackend(path), push.SQLiteBackend(path)
+        listener.origin = publisher.origin + 1
+        after = listener.last_id()
+        publisher.publish([{'user': 1, 'event': 'unread'}])
+        after, messages = listener.read(after)
+        self.assertEqual(messages, [{'user': 1, 'event': 'unread'}])
+        self.assertEqual(listener.read(after), (after, []))
+        # the publisher has delivered it to its own streams already
+        self.assertEqual(publisher.read(0)[1], [])
+
+    def test_sqlite_backend_publish_errors_are_logged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        publisher = push.SQLiteBackend(os.path.join(directory.name, 'push.sqlite3'))
+        with publisher.connect() as db:
+            db.execute('DROP TABLE message')
+        with self.assertLogs('forum.push', 'ERROR'):
+            publisher.publish([{'user': 1, 'event': 'unread'}])
+
+
+@override_settings(NOTIFICATION_FANOUT_IN_THREAD=False, NOTIFICATION_FANOUT_CHUNK=2)
+class NotificationFanoutTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(members=5)
+
+    def test_join_request_reaches_the_admins(self):
+        joiner = create_user('fanoutjoiner')
+        admin = self.sample['members'][0]
+        Membership.objects.filter(user=admin).update(role=Membership.ADMIN)
+        Group.objects.filter(id=self.sample['group'].id).update(privacy='private')
+        self.client.force_login(joiner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('forum:join-leave', args=[self.sample['group'].slug, joiner.id]))
+        requests = Notification.objects.filter(description='join request')
+        self.assertEqual(
+            set(requests.values_list('recipient_id', flat=True)), {self.sample['owner'].id, admin.id}
+        )
+
+    def test_stopped_fanout_resumes_after_its_last_chunk(self):
+        with self.captureOnCommitCallbacks():
+            progress = fanout.send(self.sample['owner'], self.sample['group'], NotificationFanout.MEMBERS, 'ping')
+        self.assertTrue(fanout.claim(progress.id))
+        fanout.write_chunk(progress)
+        NotificationFanout.objects.filter(id=progress.id).update(status=NotificationFanout.FAILED)
+
+        out = StringIO()
+        call_command('run_fanouts', stale=0, stdout=out)
+        progress.refresh_from_db()
+        self.assertEqual((progress.status, progress.sent, progress.total), (NotificationFanout.DONE, 6, 6))
+        recipients = list(Notification.objects.filter(verb='ping').values_list('recipient_id', flat=True))
+        self.assertEqual(len(recipients), len(set(recipients)))
+        self.assertIn('done', out.getvalue())
+
+    def test_progress_is_for_the_actor(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            progress = fanout.send(self.sample['owner'], self.sample['group'], NotificationFanout.MEMBERS, 'ping')
+        url = reverse('forum:notification-fanout', args=[self.sample['group'].slug, progress.id])
+        self.client.force_login(self.sample['owner'])
+        self.assertEqual(self.client.get(url).json(), {'status': 'done', 'sent': 6, 'total': 6})
+        self.client.force_login(self.sample['members'][0])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class LikeCoalescingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group(posts=1, members=4)
+
+    def setUp(self):
+        self.post = self.sample['posts'][0]
+        self.url = reverse('forum:like-post', args=[self.sample['group'].slug, self.post.id])
+
+    def toggle(self, user):
+        self.client.force_login(user)
+        self.client.get(self.url)
+
+    def likes(self):
+        return Notification.objects.filter(recipient=self.sample['owner'], description='like')
+
+    def test_likes_merge_into_one_notification(self):
+        for member in self.sample['members']:
+            self.toggle(member)
+        notification = self.likes().get()
+        self.assertEqual(notification.actor, self.sample['members'][-1])
+        self.assertEqual(notification.verb, 'and 3 others liked your post')
+        self.assertEqual(notification.action_object, self.post)
+        self.assertEqual(Account.objects.get(id=self.sample['owner'].id).unread_notifications, 1)
+
+    def test_toggling_again_is_not_notified(self):
+        member = self.sample['members'][0]
+        for _ in range(5):
+            self.toggle(member)
+        self.assertEqual(list(self.likes().values_list('verb', flat=True)), ['liked your post'])
+
+    def test_liking_again_after_others_counts_once(self):
+        first, second = self.sample['members'][:2]
+        for member in (first, second, first, first):
+            self.toggle(member)
+        self.assertEqual(list(self.likes().values_list('verb', flat=True)), ['and 1 other liked your post'])
+
+    def test_read_notification_is_not_merged_into(self):
+        self.toggle(self.sample['members'][0])
+        self.likes().mark_all_as_read()
+        self.toggle(self.sample['members'][1])
+        self.assertEqual(self.likes().count(), 2)
+
+    @override_settings(NOTIFICATION_COALESCE_WINDOW=0)
+    def test_likes_outside_the_window_are_not_merged(self):
+        self.toggle(self.sample['members'][0])
+        self.toggle(self.sample['members'][1])
+        self.assertEqual(self.likes().count(), 2)
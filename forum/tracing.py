@@ -0,0 +1,245 @@
+"""
+In-process tracing. A sampled request is a trace of nested spans: the
+view, every query, every template render, notify.send, email sends and
+calendar syncs. Finished traces are appended to TRACE_LOG, one OTLP/JSON
+ExportTraceServiceRequest per line, which an OpenTelemetry collector's
+otlpjsonfile receiver can read back.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.template.base import Template
+from django.utils.decorators import classonlymethod
+from django.views import View
+
+from notifications.signals import notify
+
+
+# OTLP span kinds and status codes
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+current_span = ContextVar('current_span', default=None)
+
+_export_lock = threading.Lock()
+
+
+class Span:
+
+    def __init__(self, name, kind=INTERNAL, parent=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        # the root span collects the finished spans of its trace
+        self.spans = parent.spans if parent else []
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = STATUS_UNSET
+        self.start = time.time_ns()
+        self.end = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.status = STATUS_ERROR
+        self.events.append({
+            'timeUnixNano': str(time.time_ns()),
+            'name': 'exception',
+            'attributes': _attributes({
+                'exception.type': type(exception).__name__,
+                'exception.message': str(exception),
+            }),
+        })
+
+    def finish(self):
+        self.end = time.time_ns()
+        self.spans.append(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': _attributes(self.attributes),
+            'status': {'code': self.status},
+        }
+        if self.parent:
+            span['parentSpanId'] = self.parent.span_id
+        if self.events:
+            span['events'] = self.events
+        return span
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # OTLP/JSON carries 64-bit integers as strings
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _attributes(attributes):
+    return [{'key': key, 'value': _value(value)} for key, value in attributes.items() if value is not None]
+
+
+@contextmanager
+def _activate(span):
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as exception:
+        span.record_exception(exception)
+        raise
+    finally:
+        current_span.reset(token)
+        span.finish()
+
+
+@contextmanager
+def start_trace(name, kind=SERVER, **attributes):
+    """
+    Runs the block as the root span of a new trace and exports the trace
+    when it ends.
+    """
+    root = Span(name, kind, attributes=attributes)
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        export(root.spans)
+
+
+@contextmanager
+def span(name, kind=INTERNAL, **attributes):
+    """
+    Runs the block as a child of the current span. Outside a trace it does
+    nothing and yields None, so untraced requests pay almost nothing.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(name, kind, parent, attributes)) as child:
+        yield child
+
+
+def traced(name, kind=INTERNAL):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding a span per query.
+    """
+    connection = context['connection']
+    with span(
+        'db.query', CLIENT,
+        **{
+            'db.system': connection.vendor,
+            'db.name': str(connection.settings_dict['NAME']),
+            'db.operation': sql.lstrip().split(' ', 1)[0].upper(),
+            'db.statement': sql,
+            'db.executemany': many,
+        }
+    ):
+        return execute(sql, params, many, context)
+
+
+def export(spans):
+    path = settings.TRACE_LOG
+    if not path or not spans:
+        return
+    line = json.dumps({'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': settings.TRACE_SERVICE_NAME})},
+        'scopeSpans': [{
+            'scope': {'name': __name__},
+            'spans': [span.to_otlp() for span in spans],
+        }],
+    }]})
+    with _export_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as log:
+            log.write(line + '\n')
+
+
+def read_traces(path):
+    """
+    Yields the spans of each trace in a TRACE_LOG file as a list of dicts.
+    """
+    with open(path) as log:
+        for line in log:
+            if line.strip():
+                request = json.loads(line)
+                yield [
+                    span
+                    for resource in request['resourceSpans']
+                    for scope in resource['scopeSpans']
+                    for span in scope['spans']
+                ]
+
+
+def _traced_render(render):
+    @wraps(render)
+    def wrapper(self, context):
+        if current_span.get() is None:
+            return render(self, context)
+        with span('template.render', **{'template.name': self.origin.template_name or self.origin.name}):
+            return render(self, context)
+    return wrapper
+
+
+def _traced_as_view(as_view):
+    @wraps(as_view)
+    def wrapper(cls, **initkwargs):
+        view = as_view(cls, **initkwargs)
+        if cls.__module__.split('.')[0] not in settings.TRACED_APPS:
+            return view
+
+        @wraps(view)
+        def traced_view(request, *args, **kwargs):
+            with span(f'view {cls.__name__}', **{'code.namespace': cls.__module__}):
+                return view(request, *args, **kwargs)
+        return traced_view
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """
+    Wraps template rendering, the views of TRACED_APPS, notify.send and
+    EmailMessage.send in spans. Called once from ForumConfig.ready(),
+    before the URLconf calls as_view().
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    Template.render = _traced_render(Template.render)
+    View.as_view = classonlymethod(_traced_as_view(View.as_view.__func__))
+    notify.send = traced('notify.send')(notify.send)
+    EmailMessage.send = traced('email.send', CLIENT)(EmailMessage.send)
@@ -6,7 +6,9 @@ from .views import (
     ApproveJoinRequestView, CreateCommentView, CreatePostView, CreateGroupView,
     CreateReplyView, EditGroupView, FeedView, GroupListView, GroupDetailView,
     GroupAboutView, JoinLeaveGroupView, RejectJoinRequestView, MakeAdminView,
-    MemberListVIew, PostListView, PostDetailView, RemoveMemberView, SuspendMemberView,
+    MarkAllNotificationsReadView, NotificationFanoutView, UnreadNotificationCountView,
+    MemberListVIew, MetricsView, PerformanceStatsView, PostListView, PostDetailView,
+    RemoveMemberView, SearchView, SuspendMemberView,
     ToggleCommentLikeVIew, ToggleCommentVisibilityView, TogglePostLikeView,
     TogglePostVisibilityView, ToggleReplyLikeView, ToggleReplyVisibilityView
 )
@@ -18,11 +20,24 @@ urlpatterns = [
     path('', FeedView.as_view(), name='home'),
     path('group/create', CreateGroupView.as_view(), name='group-create'),
     path('groups', GroupListView.as_view(), name='groups'),
+    path('search', SearchView.as_view(), name='search'),
+    path('perf', PerformanceStatsView.as_view(), name='perf'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('group/<slug:slug>', GroupDetailView.as_view(), name='group-detail'),
     path('group/<slug:slug>/about', GroupAboutView.as_view(), name='group-about'),
     path('group/<slug:slug>/edit', EditGroupView.as_view(), name='group-edit'),
 ]
 
+# shadow the django-notifications URLs of the same paths
+urlpatterns += [
+    path('notifications/mark-all-as-read/',
+         MarkAllNotificationsReadView.as_view(),
+         name='mark-all-notifications-read'),
+    path('notifications/api/unread_count/',
+         UnreadNotificationCountView.as_view(),
+         name='unread-notification-count'),
+]
+
 # member url patterns
 urlpatterns += [
     path('group/<slug:slug>/members', MemberListVIew.as_view(), name='members'),
@@ -36,6 +51,9 @@ urlpatterns += [
          RemoveMemberView.as_view(),
          name='remove-member'),
     path('group/<slug:slug>/members/<int:pk>/make-admin', MakeAdminView.as_view(), name='make-admin'),
+    path('group/<slug:slug>/notification-fanouts/<int:pk>',
+         NotificationFanoutView.as_view(),
+         name='notification-fanout'),
 ]
 
 # post url patterns
@@ -1,61 +1,103 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import (
-    LoginRequiredMixin, PermissionRequiredMixin
+    LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 )
 from django.contrib.auth.models import Permission
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.db.models import Exists, OuterRef
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views import View
-from django.views.generic import DetailView, ListView
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.generic import DetailView, ListView, TemplateView
 from django.views.generic.edit import CreateView, FormView, UpdateView
 
 from notifications.signals import notify
 
 from accounts.models import Account
 
+from . import coalesce, fanout
+from .access import resolve_group_access
 from .forms import CreateCommentForm, CreatePostForm, CreateReplyForm
-from .models import Comment, Group, Membership, Post, Reply
+from .fragments import render_posts
+from .inbox import mark_all_read, unread_count
+from .models import Comment, FeedEntry, Group, Membership, NotificationFanout, Post, Reply
+from .metrics import REGISTRY, render as render_metrics
+from .pagination import InvalidCursor, KeysetPaginator
+from .perf import stats
+from .search import search
 # Create your views here.
 
 
 class GroupMixin:
 
     def dispatch(self, request, *args, **kwargs):
-        self.group = Group.objects.get(slug=self.kwargs.get('slug'))
-        self.membership_checked = self.group.member.filter(
-            user_id=self.request.user.id,
-            is_approved=True
-        ).exists()
+        self.access = resolve_group_access(request, self.kwargs.get('slug'))
+        self.group = self.access.group
+        self.membership_checked = self.access.is_member
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         context['group'] = self.group
-        context['membership_checked'] = self.group.member.filter(
-            user_id=self.request.user.id,
-            is_approved=True
-        ).exists()
-        context['membership_pending'] = self.group.member.filter(
-            user_id=self.request.user.id,
-            is_approved=False
-        ).exists()
-        context['number_of_members'] = self.group.member.filter(
-            is_approved=True
-        ).count()
+        context['group_access'] = self.access
+        context['membership_checked'] = self.access.is_member
+        context['membership_pending'] = self.access.is_pending
+        context['number_of_members'] = self.group.member_count
+        return context
+
+
+class PostStreamMixin:
+    posts_per_page = 10
+
+    def get(self, request, *args, **kwargs):
+        if self.group.privacy == "private" and not self.membership_checked:
+            return HttpResponseRedirect(
+                reverse('forum:group-about', args=[self.group.slug])
+            )
+        return super().get(request, *args, **kwargs)
+
+    def get_post_page(self):
+        paginator = KeysetPaginator(
+            Post.active_objects.filter(group=self.group).select_related('author'),
+            per_page=self.posts_per_page
+        )
+        try:
+            return paginator.page(
+                before=self.request.GET.get('before'),
+                after=self.request.GET.get('after')
+            )
+        except InvalidCursor:
+            raise Http404("Invalid post cursor")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['post_page'] = self.get_post_page()
+        context['post_blocks'] = render_posts(
+            self.request, self.group, self.access, context['post_page']
+        )
+        context['user_suspended'] = self.access.is_suspended
         return context
 
 
 class FeedView(LoginRequiredMixin, ListView):
-    model = Group
     template_name = 'forum/index.html'
-    context_object_name = 'group_feed'
+    context_object_name = 'post_feed'
 
     def get_queryset(self):
-        return Group.objects.filter(
-            member__user_id=self.request.user.id
-        )
+        try:
+            return FeedEntry.objects.timeline(
+                self.request.user,
+                before=self.request.GET.get('before')
+            )
+        except InvalidCursor:
+            raise Http404("Invalid feed cursor")
 
 
 class CreateGroupView(LoginRequiredMixin, CreateView):
@@ -66,13 +108,12 @@ class CreateGroupView(LoginRequiredMixin, CreateView):
         form.save(commit=False)
         form.instance.owner_id = self.request.user.id
         form.save()
-        form.instance.admin.add(self.request.user)
-        # member = Account.objects.filter(id=self.request.user.id).first()
         # add group creator to members list
         Membership.objects.create(
             group_id=form.instance.id,
             user_id=self.request.user.id,
-            is_approved=True
+            is_approved=True,
+            role=Membership.OWNER
         )
         return super().form_valid(form)
 
@@ -87,58 +128,71 @@ class GroupListView(LoginRequiredMixin, ListView):
     model = Group
     paginate_by = 10
 
+    def get_queryset(self):
+        return Group.objects.annotate(
+            viewer_is_member=Exists(Membership.objects.filter(
+                group_id=OuterRef('pk'),
+                user_id=self.request.user.id
+            ))
+        ).order_by('name')
+
     def get_context_data(self, **kwargs):
 
         context = super(GroupListView, self).get_context_data()
         if self.request.GET.get('query'):
             search_query = self.request.GET.get('query')
-            context['group_list'] = Group.objects.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
+            hits = search(self.request.user, search_query, kinds=['group'])
+            groups = self.get_queryset().in_bulk([hit.object.pk for hit in hits])
+            context['group_list'] = [groups[hit.object.pk] for hit in hits]
+            context['is_paginated'] = False
         return context
 
 
-class GroupDetailView(GroupMixin, LoginRequiredMixin, DetailView):
-    model = Group
-
-    def get(self, request, **kwargs):
-        group = self.get_object()
-        if group.privacy == "private" and not self.membership_checked:
-            return HttpResponseRedirect(
-                reverse('forum:group-about', args=[group.slug])
-            )
-        return super().get(request, **kwargs)
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = 'forum/search.html'
 
     def get_context_data(self, **kwargs):
-        context = super(GroupDetailView, self).get_context_data()
-        if self.object.member.filter(user_id=self.request.user.id):
-            context['user_suspended'] = self.object.member.filter(
-                user_id=self.request.user.id
-            ).first().is_suspended
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('query', '')
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        context['query'] = query
+        context['results'] = search(self.request.user, query, page=page)
         return context
 
 
+class GroupDetailView(GroupMixin, LoginRequiredMixin, PostStreamMixin, DetailView):
+    model = Group
+
+    def get_object(self, queryset=None):
+        return self.group
+
+
 class GroupAboutView(GroupMixin, LoginRequiredMixin, DetailView):
     model = Group
     template_name_suffix = "_about"
 
+    def get_object(self, queryset=None):
+        return self.group
+
 
 class JoinLeaveGroupView(LoginRequiredMixin, View):
 
     def post(self, request, slug, pk, **kwargs):
-        group = Group.objects.filter(slug=slug).first()
+        group = get_object_or_404(Group, slug=slug)
         sender = self.request.user
-        if group.member.filter(user_id=pk).exists():
-            if request.user in group.admin.all() and group.admin.count() <= 1:
+        membership = group.member.filter(user_id=pk).first()
+        if membership:
+            if membership.is_admin and group.admins().count() <= 1:
                 messages.error(
                     request,
                     f"You cannot leave the group because you're the only admin,"
                     f" make someone else admin before leaving."
                 )
             else:
-                group.admin.remove(request.user)
-                Membership.objects.filter(user_id=pk).delete()
+                membership.delete()
                 messages.error(
                     request,
                     f"You're no longer a member {group.name}"
@@ -149,12 +203,12 @@ class JoinLeaveGroupView(LoginRequiredMixin, View):
                 group_id=group.id,
                 is_approved=False
             )
-            recipient = group.admin.all()
             action = f"requested to join {group.name}"
             description = "join request"
-            notify.send(
+            fanout.send(
                 sender,
-                recipient=recipient,
+                group,
+                NotificationFanout.ADMINS,
                 verb=action,
                 action_object=group,
                 description=description
@@ -172,7 +226,6 @@ class JoinLeaveGroupView(LoginRequiredMixin, View):
                 request,
                 f"Welcome to {group.name}"
             )
-        group.save()
         return HttpResponseRedirect(
             request.META.get('HTTP_REFERER')
         )
@@ -184,39 +237,76 @@ class MemberListVIew(GroupMixin, LoginRequiredMixin, ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        # account = Account.objects.filter()
-        return group.member.filter(
+        return self.group.member.filter(
             is_suspended=False,
             is_approved=True
-        )
-        # return group.member.filter()
+        ).select_related('user')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
-        # context['group'] = Group.objects.filter(slug=self.kwargs['slug']).first()
-        # context['membership_checked'] = context['group'].member.filter(
-        #     user_id=self.request.user.id
-        # )
-        context['suspended_members'] = context['group'].member.filter(is_suspended=True)
+        context['suspended_members'] = self.group.member.filter(
+            is_suspended=True
+        ).select_related('user')
         return context
 
 
-class MakeAdminView(LoginRequiredMixin, View):
+class GroupAdminRequiredMixin:
+    """
+    Lets only admins of the group in the URL manage its members, and loads
+    the targeted membership in the same lookup.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.access = resolve_group_access(request, kwargs['slug'])
+        if not self.access.is_admin:
+            messages.error(request, "Only group admins can manage members")
+            return HttpResponseRedirect(
+                request.META.get('HTTP_REFERER', self.access.group.get_absolute_url())
+            )
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_membership(self):
+        return get_object_or_404(
+            Membership.objects.select_related('user'),
+            group_id=self.access.group.id,
+            user_id=self.kwargs['pk']
+        )
+
+
+class GroupModeratorRequiredMixin(UserPassesTestMixin):
+    """
+    Lets only admins and the owner of the group in the URL hide and unhide
+    what is posted in it; anyone else gets a 403.
+    """
+
+    def test_func(self):
+        self.access = resolve_group_access(self.request, self.kwargs['slug'])
+        return self.access.is_admin or self.access.is_owner
+
+
+class MakeAdminView(LoginRequiredMixin, GroupAdminRequiredMixin, View):
 
     def post(self, request, slug, pk, **kwargs):
-        member = Account.objects.filter(id=pk).first()
-        group = Group.objects.get(slug=slug)
-        if group.admin.filter(username=member.username).exists():
-            group.admin.remove(member)
+        group = self.access.group
+        membership = self.get_membership()
+        member = membership.user
+        if membership.role == Membership.OWNER:
+            messages.add_message(
+                self.request,
+                messages.ERROR,
+                f"{member.username} created this group and stays an admin"
+            )
+        elif membership.role == Membership.ADMIN:
+            membership.role = Membership.MEMBER
+            membership.save(update_fields=['role'])
             messages.add_message(
                 self.request,
                 messages.ERROR,
                 f"{member.username} is no longer an admin"
             )
-        elif group.admin.count() <= 3:
-            group.admin.add(member)
-            group.save()
+        elif group.admins().count() <= 3:
+            membership.role = Membership.ADMIN
+            membership.save(update_fields=['role'])
             messages.add_message(
                 self.request,
                 messages.ERROR,
@@ -233,53 +323,39 @@ class MakeAdminView(LoginRequiredMixin, View):
         )
 
 
-class SuspendMemberView(LoginRequiredMixin, View):
+class SuspendMemberView(LoginRequiredMixin, GroupAdminRequiredMixin, View):
 
     def post(self, request, slug, pk, **kwargs):
-        try:
-            if Group.objects.filter(slug=slug, owner_id=pk).exists():
-                group = Group.objects.filter(slug=slug, owner_id=pk).first()
+        group = self.access.group
+        member = self.get_membership()
+        if member.role == Membership.OWNER:
+            messages.error(
+                request,
+                f"Can't suspend {member.user.username} because they created this group"
+            )
+        else:
+            sender = self.request.user
+            recipient = member.user
+            member.is_suspended = not member.is_suspended
+            member.save(update_fields=['is_suspended'])
+            if member.is_suspended:
+                action = f"have been suspended from {group.name}"
+                notify.send(sender, recipient=recipient, verb=action)
                 messages.error(
                     request,
-                    f"Can't suspend {group.owner.username} because they created this group"
+                    f"{member.user.username} has been suspended"
                 )
             else:
-                group = Group.objects.get(slug=slug)
-                member = Membership.objects.filter(
-                    group=group,
-                    user_id=pk
-                ).first()
-                sender = self.request.user
-                recipient = get_object_or_404(Account, id=pk)
-                member.is_suspended = not member.is_suspended
-                member.save()
-                if member.is_suspended:
-                    action = f"have been suspended from {group.name}"
-                    notify.send(sender, recipient=recipient, verb=action)
-                    messages.error(
-                        request,
-                        f"{member.user.username} has been suspended"
-                    )
-                else:
-                    action = f"suspension in {group.name} has been lifted"
-                    notify.send(sender, recipient=recipient, verb=action)
-                    messages.error(
-                        request,
-                        f"{member.user.username} has been unsuspended"
-                    )
-
-            return HttpResponseRedirect(
-                request.META.get('HTTP_REFERER')
-            )
+                action = f"suspension in {group.name} has been lifted"
+                notify.send(sender, recipient=recipient, verb=action)
+                messages.error(
+                    request,
+                    f"{member.user.username} has been unsuspended"
+                )
 
-        except Group.DoesNotExist:
-            messages.error(
-                request,
-                "No such group exist"
-            )
-            return HttpResponseRedirect(
-                request.META.get('HTTP_REFERER')
-            )
+        return HttpResponseRedirect(
+            request.META.get('HTTP_REFERER')
+        )
 
 
 class ApproveJoinRequestView(LoginRequiredMixin, View):
@@ -347,8 +423,9 @@ class EditPostView(LoginRequiredMixin, UpdateView):
     model = Post
 
 
-class PostListView(LoginRequiredMixin, ListView):
-    model = Post
+class PostListView(GroupMixin, LoginRequiredMixin, PostStreamMixin, TemplateView):
+    # fragment endpoint used by the group page to load older/newer posts
+    template_name = 'forum/post_stream.html'
 
 
 class PostDetailView(LoginRequiredMixin, View):
@@ -404,17 +481,8 @@ class TogglePostLikeView(LoginRequiredMixin, View):
     def get(self, request, slug, pk, **kwargs):
         try:
             post = Post.objects.get(id=pk)
-            sender = request.user
-            recipient = post.author
-            if post.likes.filter(id=request.user.id).exists():
-                post.likes.remove(request.user)
-                action = 'unliked your post'
-                notify.send(sender, recipient=recipient, verb=action)
-            else:
-                post.likes.add(request.user)
-                action = 'liked your post'
-                notify.send(sender, recipient=recipient, verb=action)
-            post.save()
+            if post.toggle_like(request.user):
+                coalesce.notify_liked(request.user, post, 'post')
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
         except Post.DoesNotExist:
             return HttpResponseRedirect(reverse('forum:home'))
@@ -425,17 +493,8 @@ class ToggleCommentLikeVIew(LoginRequiredMixin, View):
     def get(self, request, int, **kwargs):
         try:
             comment = Comment.objects.get(id=int)
-            sender = request.user
-            recipient = comment.author
-            if comment.likes.filter(id=request.user.id).exists():
-                comment.likes.remove(request.user)
-                action = 'unliked your comment'
-                notify.send(sender, recipient=recipient, verb=action)
-            else:
-                comment.likes.add(request.user)
-                action = 'liked your comment'
-                notify.send(sender, recipient=recipient, verb=action)
-            comment.save()
+            if comment.toggle_like(request.user):
+                coalesce.notify_liked(request.user, comment, 'comment')
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
         except Comment.DoesNotExist:
             return HttpResponseRedirect(reverse('forum:home'))
@@ -446,27 +505,18 @@ class ToggleReplyLikeView(LoginRequiredMixin, View):
     def get(self, request, str, **kwargs):
         try:
             reply = Reply.objects.get(id=str)
-            sender = request.user
-            recipient = reply.author
-            if reply.likes.filter(id=request.user.id).exists():
-                reply.likes.remove(request.user)
-                action = 'unliked your reply'
-                notify.send(sender, recipient=recipient, verb=action)
-            else:
-                reply.likes.add(request.user)
-                action = 'liked your reply'
-                notify.send(sender, recipient=recipient, verb=action)
-            reply.save()
+            if reply.toggle_like(request.user):
+                coalesce.notify_liked(request.user, reply, 'reply')
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
         except Reply.DoesNotExist:
             return HttpResponseRedirect(reverse('forum:home'))
 
 
-class TogglePostVisibilityView(LoginRequiredMixin, View):
+class TogglePostVisibilityView(LoginRequiredMixin, GroupModeratorRequiredMixin, View):
 
     def post(self, request, pk, **kwargs):
         try:
-            post = Post.objects.get(id=pk)
+            post = Post.objects.get(id=pk, group_id=self.access.group.id)
             post.is_hidden = not post.is_hidden
             post.save()
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
@@ -482,11 +532,11 @@ class TogglePostVisibilityView(LoginRequiredMixin, View):
             ))
 
 
-class ToggleCommentVisibilityView(LoginRequiredMixin, View):
+class ToggleCommentVisibilityView(LoginRequiredMixin, GroupModeratorRequiredMixin, View):
 
     def post(self, request, int, **kwargs):
         try:
-            comment = Comment.objects.get(id=int)
+            comment = Comment.objects.get(id=int, post__group_id=self.access.group.id)
             comment.is_hidden = not comment.is_hidden
             comment.save()
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
@@ -502,11 +552,11 @@ class ToggleCommentVisibilityView(LoginRequiredMixin, View):
             ))
 
 
-class ToggleReplyVisibilityView(LoginRequiredMixin, View):
+class ToggleReplyVisibilityView(LoginRequiredMixin, GroupModeratorRequiredMixin, View):
 
     def post(self, request, int, **kwargs):
         try:
-            reply = Reply.objects.get(id=int)
+            reply = Reply.objects.get(id=int, comment__post__group_id=self.access.group.id)
             reply.is_hidden = not reply.is_hidden
             reply.save()
             return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
@@ -522,24 +572,18 @@ class ToggleReplyVisibilityView(LoginRequiredMixin, View):
             ))
 
 
-class RemoveMemberView(LoginRequiredMixin, View):
+class RemoveMemberView(LoginRequiredMixin, GroupAdminRequiredMixin, View):
 
     def post(self, request, slug, pk, **kwargs):
-        group = Group.objects.filter(slug=slug).first()
-        user = Account.objects.filter(id=pk).first()
-        if Group.objects.filter(slug=slug, owner_id=pk).exists():
+        membership = self.get_membership()
+        user = membership.user
+        if membership.role == Membership.OWNER:
             messages.error(
                 request,
                 f"Can't remove {user.username} because they created this group"
             )
-        elif Membership.objects.filter(user_id=pk).exists():
-            group.admin.remove(user)
-            Membership.objects.filter(
-                user_id=pk,
-                group_id=group.id
-            ).delete()
-            # group.member.remove(user)
-            group.save()
+        else:
+            membership.delete()
             messages.error(
                 request,
                 f"{user.username} is no longer a member of this group"
@@ -548,3 +592,64 @@ class RemoveMemberView(LoginRequiredMixin, View):
         return HttpResponseRedirect(
             request.META.get('HTTP_REFERER')
         )
+
+
+class PerformanceStatsView(LoginRequiredMixin, UserPassesTestMixin, View):
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(stats.summary())
+
+
+class MetricsView(View):
+
+    def get(self, request):
+        allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+        if not (allowed or request.user.is_staff):
+            return HttpResponseForbidden()
+        return HttpResponse(
+            render_metrics(REGISTRY.collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class MarkAllNotificationsReadView(LoginRequiredMixin, View):
+    """
+    Takes the place of django-notifications' mark_all_as_read, whose UPDATE
+    sends no signal, to recount the unread counter along with it.
+    """
+
+    def get(self, request):
+        mark_all_read(request.user)
+        next_url = request.GET.get('next')
+        if next_url and url_has_allowed_host_and_scheme(next_url, {request.get_host()}):
+            return HttpResponseRedirect(next_url)
+        return HttpResponseRedirect(reverse('notifications:unread'))
+
+
+@method_decorator(cache_control(private=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=lambda request: str(unread_count(request.user))), name='get')
+class UnreadNotificationCountView(View):
+    """
+    Takes the place of django-notifications' unread count endpoint. The
+    count comes off the account's counter, and the ETag lets a polling tab
+    revalidate it and get an empty 304 while it stays the same.
+    """
+
+    def get(self, request):
+        return JsonResponse({'unread_count': unread_count(request.user)})
+
+
+class NotificationFanoutView(LoginRequiredMixin, View):
+    """
+    How far a fan-out its actor started has got, for the page that started
+    it to poll.
+    """
+
+    def get(self, request, slug, pk):
+        progress = get_object_or_404(
+            NotificationFanout, id=pk, group__slug=slug, actor_id=request.user.id
+        )
+        return JsonResponse({'status': progress.status, 'sent': progress.sent, 'total': progress.total})
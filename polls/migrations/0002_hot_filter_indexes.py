@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['poll', 'voter'], name='vote_poll_voter_idx'),
+        ),
+    ]
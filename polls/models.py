@@ -48,3 +48,8 @@ class Vote(models.Model):
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['poll', 'voter'], name='vote_poll_voter_idx'),
+        ]
+
@@ -1,3 +1,58 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from forum.testing import QueryBudgetMixin, QueryPlanMixin, ViewRequest, create_sample_group
+
+
+class PollsQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = create_sample_group()
+        cls.group = cls.sample['group']
+        cls.poll = cls.sample['poll']
+
+    def setUp(self):
+        self.client.force_login(self.sample['owner'])
+
+    def test_poll_list(self):
+        self.assertNoFullScans(reverse('forum:polls:poll-list', args=[self.group.slug]))
+
+    def test_poll_create(self):
+        self.assertNoFullScans(reverse('forum:polls:poll-create', args=[self.group.slug]))
+
+    def test_poll_edit(self):
+        self.assertNoFullScans(reverse('forum:polls:poll-edit', args=[self.group.slug, self.poll.id]))
+
+    def test_results(self):
+        self.assertNoFullScans(reverse('forum:polls:results', args=[self.group.slug, self.poll.id]))
+
+    def test_vote(self):
+        # the vote pattern repeats the group slug, so it can't be reversed
+        url = f'/group/{self.group.slug}/polls/{self.group.slug}/{self.poll.id}/vote/'
+        self.assertNoFullScans(url, method='post', data={'choice': self.sample['choice'].id})
+
+
+class PollsQueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlconf = 'polls.urls'
+    budgets = {
+        'poll-list': (8, 300),
+        'poll-create': (4, 300),
+        'results': (7, 300),
+        'vote': (11, 200),
+        'poll-edit': (8, 300),
+    }
+
+    def view_requests(self, sample):
+        slug = sample['group'].slug
+        poll = sample['poll']
+        return [
+            ViewRequest('poll-list', reverse('forum:polls:poll-list', args=[slug])),
+            ViewRequest('poll-create', reverse('forum:polls:poll-create', args=[slug])),
+            ViewRequest('poll-edit', reverse('forum:polls:poll-edit', args=[slug, poll.id])),
+            ViewRequest('results', reverse('forum:polls:results', args=[slug, poll.id])),
+            ViewRequest(
+                'vote', f'/group/{slug}/polls/{slug}/{poll.id}/vote/',
+                method='post', data={'choice': sample['choice'].id}
+            ),
+        ]
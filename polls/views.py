@@ -2,31 +2,39 @@ from datetime import date
 
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect, JsonResponse, HttpResponseForbidden
+from django.db.models import Count
+from django.http import Http404, HttpResponseRedirect, JsonResponse, HttpResponseForbidden
 from django.forms.models import modelformset_factory  # modelform for querysets
 from django.forms import formset_factory
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views import generic, View
 
-from forum.models import Group, Membership
-
 from .forms import PollForm, ChoicesForm
 from .models import Poll, Choice, Vote
+from forum.access import resolve_group_access
+from forum.cache import cached_for_group
 from forum.views import GroupMixin
 
 
 class PollListVIew(GroupMixin, generic.ListView):
     model = Poll
     template_name = 'polls/polls_list.html'
+    context_object_name = 'poll_list'
 
     def get_queryset(self):
-        return Poll.objects.filter(group=self.group).order_by("-created_date")
+        # the same for every viewer; votes are added per request below
+        return cached_for_group(self.group, 'polls', lambda: list(
+            Poll.objects.filter(group=self.group).select_related(
+                'group'
+            ).prefetch_related('choice_set').order_by("-created_date")
+        ))
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(PollListVIew, self).get_context_data(**kwargs)
-        votes = Vote.objects.filter(voter=self.request.user)
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        # poll = Poll.objects.filter(group=group).first().start_date
+        votes = Vote.objects.filter(
+            voter=self.request.user,
+            poll__group=self.group
+        ).select_related('choice')
         context["votes"] = votes
         context["slug"] = self.kwargs['slug']
         context["current_date"] = date.today()
@@ -42,7 +50,8 @@ class PollCreateView(GroupMixin, LoginRequiredMixin, View):
             'poll_form': poll_form,
             'formset': formset,
             'group': self.group,
-            'membership_checked': self.group.member.filter(user_id=self.request.user.id).exists()
+            'group_access': self.access,
+            'membership_checked': self.access.is_member,
         }
         return render(request,
                       "polls/poll_create_view.html",
@@ -54,7 +63,7 @@ class PollCreateView(GroupMixin, LoginRequiredMixin, View):
         formset = ChoiceFormset(request.POST or None)
 
         if all([poll_form.is_valid(), formset.is_valid()]):
-            if request.user in self.group.admin.all():
+            if self.access.is_admin:
                 parent = poll_form.save(commit=False)
                 parent.poll_author = self.request.user
                 parent.group = self.group
@@ -77,7 +86,8 @@ class PollCreateView(GroupMixin, LoginRequiredMixin, View):
                 'poll_form': poll_form,
                 'formset': formset,
                 'group': self.group,
-                'membership_checked': self.group.member.filter(user_id=self.request.user.id).exists()
+                'group_access': self.access,
+                'membership_checked': self.access.is_member,
             }
             return render(request,
                           "polls/poll_create_view.html",
@@ -100,7 +110,8 @@ class PollEditView(GroupMixin, LoginRequiredMixin, View):
             'formset': formset,
             'poll': poll,
             'group': self.group,
-            'membership_checked': self.group.member.filter(user_id=self.request.user.id).exists()
+            'group_access': self.access,
+            'membership_checked': self.access.is_member,
         }
         return render(request, "polls/poll_edit.html", context)
 
@@ -112,7 +123,7 @@ class PollEditView(GroupMixin, LoginRequiredMixin, View):
         formset = ChoiceFormset(request.POST or None, queryset=choices_qs)
 
         if all([poll_form.is_valid(), formset.is_valid()]):
-            if request.user in self.group.admin.all():
+            if self.access.is_admin:
                 parent = poll_form.save(commit=False)
                 parent.save()
                 for form in formset:
@@ -129,7 +140,8 @@ class PollEditView(GroupMixin, LoginRequiredMixin, View):
             'formset': formset,
             'poll': poll,
             'group': self.group,
-            'membership_checked': self.group.member.filter(user_id=self.request.user.id).exists()
+            'group_access': self.access,
+            'membership_checked': self.access.is_member,
         }
         messages.error(request, "Form not valid. No field should be empty.")
         return render(request, "polls/poll_edit.html", context)
@@ -158,9 +170,14 @@ class ResultsView(GroupMixin, LoginRequiredMixin, generic.DetailView):
     model = Poll
     template_name = 'polls/results.html'
 
-    def get_queryset(self):
-        group = Group.objects.filter(slug=self.kwargs['slug']).first()
-        return Poll.objects.filter(group=group)
+    def get_object(self, queryset=None):
+        pk = self.kwargs['pk']
+        poll = cached_for_group(self.group, f'poll-results:{pk}', lambda: Poll.objects.filter(
+            group=self.group, pk=pk
+        ).annotate(vote_total=Count('vote')).prefetch_related('choice_set').first())
+        if poll is None:
+            raise Http404("No poll found matching the query")
+        return poll
 
     def get_context_data(self, **kwargs):
         context = super(ResultsView, self).get_context_data(**kwargs)
@@ -173,7 +190,8 @@ class VoteView(View, LoginRequiredMixin):
     def post(self, request, poll_id, slug, **kwargs):
         current_date = date.today()
         poll = get_object_or_404(Poll, pk=poll_id)
-        if Membership.objects.get(user=request.user, group=poll.group).is_suspended == True:
+        access = resolve_group_access(request, poll.group.slug)
+        if access.membership is None or access.is_suspended:
             return redirect(f"/group/{slug}/polls/{poll.id}/results/?command=eligibility&sl={poll.group.slug}")
 
         if poll.start_date > current_date: